@@ -0,0 +1,4 @@
+"""
+Setwise Web backend
+Generation, compile and caching machinery behind the Streamlit interface
+"""
@@ -0,0 +1,260 @@
+"""
+Bulk generation for Setwise Web
+Many question files, described by a manifest, generated into one zip
+"""
+
+import io
+import json
+import os
+import re
+import zipfile
+from concurrent.futures import CancelledError, ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from setwise_web.config import (
+    BULK_MANIFEST_NAMES, BULK_MAX_ENTRIES, BULK_MAX_FILE_BYTES, BULK_MAX_SETS, BULK_WORKERS,
+    TEMPLATES)
+from setwise_web.generation import derive_seed, generate_quiz_pdfs, write_sets_to_zip
+from setwise_web.logs import bind_request
+from setwise_web.scheduler import JobCancelled
+
+
+# PyYAML reads bulk manifests; JSON manifests work without it
+try:
+    import yaml
+    YAML_AVAILABLE = True
+except ImportError:
+    YAML_AVAILABLE = False
+
+
+def load_bulk_manifest(name, text):
+    """Parse a YAML or JSON bulk manifest"""
+    if name.endswith('.json'):
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{name}: {e}")
+    if not YAML_AVAILABLE:
+        raise ValueError(f"{name}: YAML manifests need PyYAML - upload manifest.json instead")
+    try:
+        return yaml.safe_load(text)
+    except yaml.YAMLError as e:
+        raise ValueError(f"{name}: {e}")
+
+
+def read_bulk_upload(uploads):
+    """Collect question files and the manifest from a bulk upload
+
+    ``uploads`` are ``(name, bytes)`` pairs. Zip archives are unpacked one
+    level deep and their members treated as if they had been uploaded one
+    by one. Returns ``(files, manifest)``: question file paths mapped to
+    their text, and the parsed manifest (None when there is none).
+    """
+    files = {}
+    manifests = []
+    
+    def add(name, read, size):
+        base = os.path.basename(name)
+        if base in BULK_MANIFEST_NAMES or name.endswith('.py'):
+            if size > BULK_MAX_FILE_BYTES:
+                raise ValueError(f"{name} is larger than {BULK_MAX_FILE_BYTES // 1024} KB")
+            try:
+                text = read().decode('utf-8')
+            except UnicodeDecodeError:
+                raise ValueError(f"{name} is not UTF-8 text")
+            if base in BULK_MANIFEST_NAMES:
+                manifests.append((name, text))
+            else:
+                files[name] = text
+    
+    for name, data in uploads:
+        if not name.endswith('.zip'):
+            add(name, lambda data=data: data, len(data))
+            continue
+        try:
+            archive = zipfile.ZipFile(io.BytesIO(data))
+        except zipfile.BadZipFile:
+            raise ValueError(f"{name} is not a valid zip file")
+        with archive:
+            for info in archive.infolist():
+                base = os.path.basename(info.filename)
+                if info.is_dir() or info.filename.startswith('__MACOSX/') or base.startswith('.'):
+                    continue
+                # Sizes come from the zip directory, so oversized members are never inflated
+                add(info.filename, lambda info=info: archive.read(info), info.file_size)
+    
+    if len(manifests) > 1:
+        raise ValueError("more than one manifest in the upload: "
+                         + ", ".join(name for name, _ in manifests))
+    manifest = load_bulk_manifest(*manifests[0]) if manifests else None
+    return files, manifest
+
+
+def _bulk_file(files, path):
+    """Find a manifest ``file`` among the uploads, by path or unique basename"""
+    if path in files:
+        return path
+    matches = [name for name in files if os.path.basename(name) == os.path.basename(path)]
+    if len(matches) == 1:
+        return matches[0]
+    if matches:
+        raise ValueError(f"'{path}' is ambiguous: " + ", ".join(sorted(matches)))
+    raise ValueError(f"'{path}' is not among the uploaded question files")
+
+
+def build_bulk_entries(files, manifest, defaults):
+    """Expand a manifest into one generation request per output folder
+
+    The manifest is ``{"defaults": {...}, "quizzes": [...]}`` or just the
+    list of quizzes. Each quiz names a question ``file`` and may set
+    ``name``, ``template``, ``num_sets``, ``seed``, ``title``, ``subject``,
+    ``exam_info`` and ``sections`` - a list of section names that each get
+    their own folder and seed. Without a manifest every uploaded file is one
+    quiz. Settings missing everywhere come from ``defaults`` (the UI);
+    a missing seed is derived from the content hash.
+    """
+    if manifest is None:
+        quizzes, manifest_defaults = [{'file': name} for name in sorted(files)], {}
+    elif isinstance(manifest, list):
+        quizzes, manifest_defaults = manifest, {}
+    elif isinstance(manifest, dict) and isinstance(manifest.get('quizzes'), list):
+        quizzes, manifest_defaults = manifest['quizzes'], manifest.get('defaults') or {}
+    else:
+        raise ValueError("manifest must be a list of quizzes or a mapping with a 'quizzes' list")
+    if not quizzes:
+        raise ValueError("no question files to generate")
+    
+    entries = []
+    for position, quiz in enumerate(quizzes, 1):
+        if not isinstance(quiz, dict) or 'file' not in quiz:
+            raise ValueError(f"quiz {position} in the manifest has no 'file'")
+        settings = {**defaults, **manifest_defaults, **quiz}
+        path = _bulk_file(files, str(quiz['file']))
+        template = settings['template']
+        if template not in TEMPLATES:
+            raise ValueError(f"quiz {position}: unknown template '{template}' (use one of {', '.join(TEMPLATES)})")
+        try:
+            num_sets = int(settings['num_sets'])
+            seed = None if settings.get('seed') is None else int(settings['seed'])
+        except (TypeError, ValueError):
+            raise ValueError(f"quiz {position}: num_sets and seed must be whole numbers")
+        if not 1 <= num_sets <= BULK_MAX_SETS:
+            raise ValueError(f"quiz {position}: num_sets must be between 1 and {BULK_MAX_SETS}")
+        header_config = {key: str(settings.get(key) or "") for key in ('title', 'subject', 'exam_info')}
+        questions_text = files[path]
+        if seed is None:
+            seed = derive_seed(questions_text, template, header_config)
+        
+        name = str(settings.get('name') or Path(path).stem)
+        sections = settings.get('sections') or [None]
+        if not isinstance(sections, list):
+            raise ValueError(f"quiz {position}: sections must be a list of names")
+        for offset, section in enumerate(sections):
+            folder = name if section is None else f"{name}/{section}"
+            entries.append({
+                'name': re.sub(r'[^\w./-]+', '_', folder).strip('./'),
+                'file': path,
+                'questions_text': questions_text,
+                'template': template,
+                'num_sets': num_sets,
+                'header_config': header_config,
+                # Consecutive seeds, so every section of a quiz gets different sets
+                'seed': (seed - 1 + offset) % 10000 + 1,
+            })
+    
+    names = [entry['name'] for entry in entries]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError("two quizzes would write to the same folder: " + ", ".join(duplicates))
+    if len(entries) > BULK_MAX_ENTRIES:
+        raise ValueError(f"{len(entries)} quizzes requested - the limit is {BULK_MAX_ENTRIES} per upload")
+    return entries
+
+
+def run_bulk_generation(entries, zip_path, workspaces, progress=None, cache=None, models=None,
+                        scheduler=None, formats=None, session_id=None, figures=None):
+    """Generate every bulk entry and write all artifacts into one zip at ``zip_path``
+
+    Entries run side by side on ``BULK_WORKERS`` threads, but their
+    pdflatex work still goes through ``scheduler`` like any other request.
+    Sets are added to the zip as each entry finishes, so nothing larger
+    than one entry is held in memory. A failed entry does not stop the
+    others; every entry's outcome is recorded in ``report.json`` inside the
+    zip. Each entry gets its own workspace from ``workspaces``, released as
+    soon as its files are in the zip. Returns the report. Entries report
+    their stages through ``progress`` too, so a job cancelled through it
+    stops its running entries at their next stage.
+    """
+    if progress is None:
+        progress = lambda stage, fraction: None
+    report = []
+    
+    def generate(entry):
+        # Overall progress only moves as entries finish
+        entry_progress = lambda stage, fraction: progress(f"{entry['name']}: {stage}", len(report) / len(entries))
+        diagnostics = []
+        if models is not None and entry.get('model') is not None:
+            models.put(entry['questions_text'], entry['model'])
+        output_dir = workspaces.create("bulk")
+        try:
+            quiz_sets, error = generate_quiz_pdfs(
+                entry['questions_text'], entry['template'], entry['num_sets'], entry['header_config'],
+                seed=entry['seed'], cache=cache, parallel=True, scheduler=scheduler,
+                progress=entry_progress, session_id=session_id, formats=formats, figures=figures,
+                models=models, diagnostics=diagnostics,
+                output_dir=output_dir
+            )
+        except BaseException:
+            workspaces.release(output_dir)
+            raise
+        return output_dir, quiz_sets, error, diagnostics
+    
+    def release_abandoned(future):
+        if not future.cancelled() and future.exception() is None:
+            workspaces.release(future.result()[0])
+    
+    pool = ThreadPoolExecutor(max_workers=BULK_WORKERS, thread_name_prefix="setwise-bulk")
+    futures = {}
+    consumed = set()
+    try:
+        with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            futures = {pool.submit(bind_request(generate), entry): entry for entry in entries}
+            for future in as_completed(futures):
+                entry = futures[future]
+                consumed.add(future)
+                try:
+                    output_dir, quiz_sets, error, diagnostics = future.result()
+                except (JobCancelled, CancelledError):
+                    raise
+                except Exception as e:
+                    output_dir, quiz_sets, error, diagnostics = None, None, f"Unexpected error: {str(e)}", []
+                
+                try:
+                    write_sets_to_zip(archive, quiz_sets or [], folder=entry['name'])
+                finally:
+                    # The zip is the only copy this request keeps
+                    if output_dir:
+                        workspaces.release(output_dir)
+                
+                report.append({
+                    'name': entry['name'],
+                    'file': entry['file'],
+                    'template': entry['template'],
+                    'num_sets': entry['num_sets'],
+                    'seed': entry['seed'],
+                    'status': 'failed' if error else 'ok',
+                    'sets': len(quiz_sets or []),
+                    'warnings': sum(1 for d in diagnostics if d['severity'] == 'warning'),
+                    'error': error,
+                })
+                progress(f"{entry['name']} {'failed' if error else 'done'}", len(report) / len(entries))
+            
+            report.sort(key=lambda r: r['name'])
+            archive.writestr("report.json", json.dumps(report, indent=2))
+    finally:
+        for future in futures:
+            # Entries still running when the caller gave up clean up after themselves
+            if future not in consumed and not future.cancel():
+                future.add_done_callback(release_abandoned)
+        pool.shutdown(wait=False)
+    return report
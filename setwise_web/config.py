@@ -0,0 +1,113 @@
+"""
+Settings for Setwise Web
+Every tunable is read from a SETWISE_WEB_* environment variable
+"""
+
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+
+# Try to import setwise package
+try:
+    from setwise.quiz_generator import QuizGenerator
+    from setwise.template_manager import TemplateManager
+    SETWISE_AVAILABLE = True
+    IMPORT_ERROR = None
+except ImportError as e:
+    SETWISE_AVAILABLE = False
+    IMPORT_ERROR = str(e)
+
+# Setwise version is part of the cache key so upgrades never serve stale output
+try:
+    from importlib.metadata import version as _dist_version
+    SETWISE_VERSION = _dist_version("setwise")
+except Exception:
+    SETWISE_VERSION = "unknown"
+
+# On-disk cache of compiled quiz sets (shared by every session on this host)
+CACHE_DIR = Path(os.environ.get(
+    "SETWISE_WEB_CACHE_DIR",
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "setwise-web"
+))
+CACHE_MAX_BYTES = int(os.environ.get("SETWISE_WEB_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+# Finished results live on disk; sessions only hold handles to them
+ARTIFACT_DIR = Path(os.environ.get("SETWISE_WEB_ARTIFACT_DIR", CACHE_DIR / "artifacts"))
+ARTIFACT_TTL = int(os.environ.get("SETWISE_WEB_ARTIFACT_TTL", "14400"))
+ARTIFACT_MAX_BYTES = int(os.environ.get("SETWISE_WEB_ARTIFACT_MAX_MB", "2048")) * 1024 * 1024
+
+# Per-job scratch directories, on tmpfs when the host has one
+_SHM = Path("/dev/shm")
+WORK_DISK_DIR = Path(tempfile.gettempdir()) / "setwise-web"
+WORK_DIR = Path(os.environ.get(
+    "SETWISE_WEB_WORK_DIR",
+    _SHM / "setwise-web" if _SHM.is_dir() and os.access(_SHM, os.W_OK) else WORK_DISK_DIR
+))
+WORKSPACE_TTL = int(os.environ.get("SETWISE_WEB_WORKSPACE_TTL", "3600"))
+WORKSPACE_MIN_FREE_BYTES = int(os.environ.get("SETWISE_WEB_WORKSPACE_MIN_FREE_MB", "256")) * 1024 * 1024
+WORKSPACE_JANITOR_INTERVAL = 300
+# Disk usage shown on the page and in metrics is rescanned at most this often
+STORAGE_STATS_TTL = 30
+
+# LaTeX compilation - COMPILE_WORKERS caps concurrent pdflatex runs server-wide
+PDFLATEX = shutil.which("pdflatex") or "pdflatex"
+COMPILE_WORKERS = int(os.environ.get("SETWISE_WEB_COMPILE_WORKERS", os.cpu_count() or 1))
+COMPILE_TIMEOUT = int(os.environ.get("SETWISE_WEB_COMPILE_TIMEOUT", "120"))
+MAX_LATEX_PASSES = 3
+# Precompiled formats skip reloading the template's packages on every compile
+WARM_FORMATS = os.environ.get("SETWISE_WEB_WARM_FORMATS", "1") == "1"
+FORMAT_DIR = CACHE_DIR / "formats"
+# Figures are compiled once to standalone PDFs and included from there
+EXTERNALIZE_FIGURES = os.environ.get("SETWISE_WEB_EXTERNALIZE_FIGURES", "1") == "1"
+FIGURE_DIR = CACHE_DIR / "figures"
+FIGURE_MAX_BYTES = int(os.environ.get("SETWISE_WEB_FIGURE_MAX_MB", "256")) * 1024 * 1024
+# A figure that failed to build is left inline this long before it is tried again
+FIGURE_RETRY_AFTER = 600
+
+# Previews are page images rasterized on the server, not whole PDFs sent to the browser
+PDFTOPPM = shutil.which("pdftoppm")
+PDFINFO = shutil.which("pdfinfo")
+THUMBNAIL_DIR = CACHE_DIR / "thumbnails"
+THUMBNAIL_MAX_BYTES = int(os.environ.get("SETWISE_WEB_THUMBNAIL_MAX_MB", "256")) * 1024 * 1024
+THUMBNAIL_WIDTH = 900
+THUMBNAIL_TIMEOUT = 30
+
+# Metrics in the Prometheus text format, served on a port and/or flushed to a file
+METRICS_PORT = int(os.environ.get("SETWISE_WEB_METRICS_PORT", "0"))
+# Loopback only unless asked otherwise - set 0.0.0.0 to let a remote Prometheus scrape
+METRICS_HOST = os.environ.get("SETWISE_WEB_METRICS_HOST", "127.0.0.1")
+METRICS_FILE = os.environ.get("SETWISE_WEB_METRICS_FILE")
+METRICS_FLUSH_INTERVAL = 15
+ACTIVE_SESSION_WINDOW = 300
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SETS_BUCKETS = (1, 2, 3, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# Background generation jobs
+JOB_WORKERS = int(os.environ.get("SETWISE_WEB_JOB_WORKERS", "4"))
+JOB_RESULT_TTL = int(os.environ.get("SETWISE_WEB_JOB_RESULT_TTL", "3600"))
+JOB_POLL_INTERVAL = 1.0
+
+# Bulk mode: many question files in one request, described by a manifest
+TEMPLATES = ["default", "compact", "minimal"]
+BULK_WORKERS = int(os.environ.get("SETWISE_WEB_BULK_WORKERS", "4"))
+BULK_MAX_SETS = int(os.environ.get("SETWISE_WEB_BULK_MAX_SETS", "10"))
+BULK_MAX_ENTRIES = int(os.environ.get("SETWISE_WEB_BULK_MAX_ENTRIES", "500"))
+BULK_MAX_FILE_BYTES = 1024 * 1024
+BULK_MANIFEST_NAMES = ("manifest.yaml", "manifest.yml", "manifest.json")
+
+# High-volume variant mode: one quiz per student, compiled once per distinct variant
+VARIANT_MAX_STUDENTS = int(os.environ.get("SETWISE_WEB_VARIANT_MAX_STUDENTS", "1000"))
+VARIANT_MAX_ORDERINGS = 5
+
+# Live preview: regenerate a draft of set 1 once the editor has been still this long
+LIVE_PREVIEW_DEBOUNCE = float(os.environ.get("SETWISE_WEB_LIVE_DEBOUNCE", "1.5"))
+LIVE_PREVIEW_POLL_INTERVAL = 0.5
+RENDER_TIMEOUT = int(os.environ.get("SETWISE_WEB_RENDER_TIMEOUT", "60"))
+
+# Question files are arbitrary Python, so they are executed in a throwaway
+# child process with CPU, memory and wall-clock limits
+PARSE_CPU_SECONDS = int(os.environ.get("SETWISE_WEB_PARSE_CPU", "2"))
+PARSE_MEMORY_MB = int(os.environ.get("SETWISE_WEB_PARSE_MEMORY_MB", "256"))
+PARSE_TIMEOUT = float(os.environ.get("SETWISE_WEB_PARSE_TIMEOUT", "5"))
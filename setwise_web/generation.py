@@ -0,0 +1,369 @@
+"""
+Quiz generation for Setwise Web
+One question file rendered by setwise and compiled into quiz sets
+"""
+
+import json
+import os
+import random
+import subprocess
+import sys
+import zipfile
+from concurrent.futures import CancelledError
+from pathlib import Path
+
+from setwise_web.config import (
+    COMPILE_TIMEOUT, COMPILE_WORKERS, IMPORT_ERROR, RENDER_TIMEOUT, SETWISE_AVAILABLE)
+from setwise_web.latex import collect_latex_errors
+from setwise_web.logs import TRACE, log, log_span
+from setwise_web.questions import (
+    QuestionParseError, format_diagnostics, lint_question_model, merge_header_config,
+    parse_questions_sandboxed, render_questions_module, validate_question_model)
+from setwise_web.scheduler import JobCancelled, compile_quiz_sets
+from setwise_web.storage import link_or_copy, quiz_cache_key, tex_digest
+
+
+# setwise resolves its templates relative to the working directory, which is
+# process-wide. Running it in a child process with its own cwd keeps
+# concurrent sessions from changing directories underneath each other.
+_SETWISE_WORKER = """
+import json, sys
+from setwise.quiz_generator import QuizGenerator
+args = json.loads(sys.argv[1])
+generator = QuizGenerator(questions_file=args["questions_file"], output_dir=args["output_dir"])
+success = generator.generate_quizzes(
+    num_sets=args["num_sets"],
+    template_name=args["template"],
+    compile_pdf=args["compile_pdf"],
+    seed=args["seed"],
+)
+print(json.dumps({"success": bool(success)}))
+"""
+
+
+def run_setwise_worker(questions_file, output_dir, num_sets, template, seed, compile_pdf, cwd):
+    """Run ``QuizGenerator.generate_quizzes`` in a child process rooted at ``cwd``
+
+    Returns the generator's success flag; raises RuntimeError when the
+    worker crashes or times out.
+    """
+    args = {
+        'questions_file': str(questions_file),
+        'output_dir': str(output_dir),
+        'num_sets': num_sets,
+        'template': template,
+        'seed': seed,
+        'compile_pdf': compile_pdf,
+    }
+    timeout = RENDER_TIMEOUT + (COMPILE_TIMEOUT * num_sets if compile_pdf else 0)
+    try:
+        proc = subprocess.run(
+            [sys.executable, "-c", _SETWISE_WORKER, json.dumps(args)],
+            cwd=str(cwd), capture_output=True, text=True, timeout=timeout,
+            stdin=subprocess.DEVNULL
+        )
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"setwise worker timed out after {timeout}s")
+    if proc.returncode != 0:
+        stderr_tail = "\n".join(proc.stderr.strip().splitlines()[-10:])
+        raise RuntimeError(f"setwise worker exited with code {proc.returncode}:\n{stderr_tail}")
+    # setwise prints its own progress; the worker's verdict is the last line
+    try:
+        return json.loads(proc.stdout.strip().splitlines()[-1])['success']
+    except (IndexError, ValueError, KeyError):
+        raise RuntimeError(f"setwise worker returned no result:\n{proc.stdout[-500:]}")
+
+
+def reuse_unchanged_pdfs(output_dir, num_sets, previous_sets):
+    """Link PDFs from ``previous_sets`` for every set whose rendered TeX is unchanged
+
+    ``previous_sets`` carry ``tex_hash`` and ``pdf_path``; a PDF that has
+    gone away in the meantime is simply compiled again. Returns the set
+    numbers that still need compiling.
+    """
+    previous_pdfs = {}
+    for quiz_set in previous_sets or []:
+        if quiz_set.get('pdf_path') and quiz_set.get('tex_hash'):
+            previous_pdfs[quiz_set['tex_hash']] = quiz_set['pdf_path']
+    
+    to_compile = []
+    for i in range(1, num_sets + 1):
+        tex_path = Path(output_dir) / f'quiz_set_{i}.tex'
+        try:
+            digest = tex_digest(tex_path.read_text(encoding='utf-8'))
+        except OSError:
+            to_compile.append(i)
+            continue
+        if digest not in previous_pdfs:
+            to_compile.append(i)
+            continue
+        try:
+            link_or_copy(previous_pdfs[digest], tex_path.with_suffix('.pdf'))
+            log.debug("quiz_set_%d.tex unchanged - reusing previous PDF", i)
+        except OSError:
+            to_compile.append(i)
+    return to_compile
+
+
+def derive_seed(questions_text, template, header_config):
+    """Seed taken from the content hash: same questions and settings, same quiz"""
+    digest = quiz_cache_key(questions_text, template, 0, header_config, None)
+    return int(digest[:8], 16) % 10000 + 1
+
+
+def resolve_seed(seed_mode, fixed_seed, questions_text, template, header_config):
+    """Turn the seed control in the UI into a concrete seed for this run
+
+    Only a ``Fixed`` seed stays the same while the questions are edited, which
+    is what lets ``reuse_unchanged_pdfs`` find sets the edit did not touch; a
+    content-hash seed changes with every edit.
+    """
+    if seed_mode == "Fixed":
+        return int(fixed_seed)
+    if seed_mode == "Content hash":
+        return derive_seed(questions_text, template, header_config)
+    return random.randint(1, 10000)
+
+
+def generate_quiz_pdfs(questions_text, template, num_sets, header_config=None, seed=None, cache=None,
+                       parallel=True, progress=None, scheduler=None, session_id=None,
+                       previous_sets=None, formats=None, draft=False, models=None, diagnostics=None,
+                       figures=None, *, output_dir):
+    """Generate quiz PDFs using the setwise package
+
+    Results are served from ``cache`` when one is given and the run is
+    reproducible (an explicit ``seed``); a random-seed run is never cached.
+    With ``parallel`` the .tex files of all sets are rendered first and then
+    compiled at the same time instead of one after another. ``progress``,
+    if given, is called as ``progress(stage, fraction)`` after each stage.
+    All pdflatex work is admitted through ``scheduler`` when one is given.
+    In parallel mode, sets whose rendered TeX matches one of
+    ``previous_sets`` reuse that PDF instead of being recompiled,
+    ``formats`` (a FormatCache) provides precompiled preambles and
+    ``figures`` (a FigureCache) prebuilt figures.
+    A ``draft`` run only renders the .tex files and answer keys; its sets
+    carry no PDF and are never cached. ``models`` (a QuestionModelCache)
+    lets repeated requests for the same text skip re-parsing it. Structured
+    validation, lint and LaTeX-log diagnostics are appended to the
+    ``diagnostics`` list when one is given. Returned sets carry the paths of
+    their files in the output directory, never the bytes. Files are written
+    to ``output_dir``, which the caller creates and removes once it is done
+    with them.
+    """
+    if header_config is None:
+        header_config = {}
+    if progress is None:
+        progress = lambda stage, fraction: None
+    
+    try:
+        log.debug("Starting generation: template=%s, sets=%d", template, num_sets)
+        
+        if not SETWISE_AVAILABLE:
+            log.error("Setwise not available: %s", IMPORT_ERROR)
+            return None, f"Setwise package not available. Import error: {IMPORT_ERROR}\\n\\nPlease ensure the setwise package is installed."
+        
+        log.debug("Output directory: %s", output_dir)
+        
+        cache_key = None
+        if cache is not None and seed is not None and not draft:
+            cache_key = quiz_cache_key(questions_text, template, num_sets, header_config, seed)
+            with log_span("cache_lookup", key=cache_key[:12]) as span:
+                cached_sets = cache.get(cache_key, output_dir)
+                span['hit'] = cached_sets is not None
+            if cached_sets is not None:
+                progress("served from cache", 1.0)
+                return cached_sets, None
+        
+        # Validate questions format and inspect content
+        try:
+            with log_span("exec", chars=len(questions_text)):
+                model = models.get(questions_text) if models is not None else parse_questions_sandboxed(questions_text)
+            progress("questions executed", 0.1)
+            
+            with log_span("validate") as span:
+                found = validate_question_model(model, questions_text) + lint_question_model(model, questions_text)
+                span['diagnostics'] = len(found)
+            if diagnostics is not None:
+                diagnostics.extend(found)
+            errors = [d for d in found if d['severity'] == 'error']
+            for d in found:
+                log.debug("%s", format_diagnostics([d]))
+            if errors:
+                # These can only ever fail in pdflatex - don't spend a compile finding out
+                return None, (f"Question validation failed with {len(errors)} error(s):\n"
+                              + format_diagnostics(found))
+            progress("questions validated", 0.15)
+            
+        except (JobCancelled, CancelledError):
+            # A superseded job is not an error - let the job runner drop it
+            raise
+        except QuestionParseError as e:
+            log.info("Questions %s error: %s", e.kind, e)
+            if e.kind == "syntax":
+                return None, f"Python syntax error: {str(e)}\\n\\nCheck your mcq = [...] and subjective = [...] format."
+            return None, f"Error in questions format: {str(e)}"
+        except Exception as e:
+            log.info("Questions format error: %s", e)
+            return None, f"Error in questions format: {str(e)}"
+        
+        # setwise only loads question files, so the merged model is written
+        # once, as plain literals, next to the output it produces
+        with log_span("merge"):
+            metadata = merge_header_config(model.get('quiz_metadata'), header_config)
+            full_content = render_questions_module(model, metadata)
+            questions_file = os.path.join(output_dir, 'questions.py')
+            with open(questions_file, 'w', encoding='utf-8') as f:
+                f.write(full_content)
+        
+        if log.isEnabledFor(TRACE):
+            log.log(TRACE, "Questions file %s (%d chars):\n%s", questions_file, len(full_content), full_content)
+        
+        try:
+            # Find the correct template directory - setwise expects to be run from its own directory
+            import setwise
+            setwise_dir = Path(setwise.__file__).parent
+            templates_dir = setwise_dir / 'templates'
+            
+            random_seed = seed if seed is not None else random.randint(1, 10000)
+            log.debug("Running setwise: templates=%s, seed=%d", templates_dir, random_seed)
+            
+            try:
+                compile_in_setwise = not parallel and not draft
+                worker_args = (questions_file, output_dir, num_sets, template, random_seed,
+                               compile_in_setwise, setwise_dir)
+                # Sequential mode compiles inside setwise, so the span covers the compiles too
+                with log_span("render", template=template, sets=num_sets, compile=compile_in_setwise) as span:
+                    if scheduler is not None and compile_in_setwise:
+                        # ...and the whole run takes a compile slot
+                        progress("queued for compile", 0.1)
+                        success = scheduler.submit(session_id, run_setwise_worker, *worker_args).result()
+                    else:
+                        success = run_setwise_worker(*worker_args)
+                    span['ok'] = success
+                
+                if success and draft:
+                    progress("tex rendered (draft)", 1.0)
+                elif success and parallel:
+                    progress("tex rendered", 0.3)
+                    to_compile = reuse_unchanged_pdfs(output_dir, num_sets, previous_sets)
+                    if len(to_compile) < num_sets:
+                        log.debug("Reusing %d unchanged set(s) from the previous run", num_sets - len(to_compile))
+                    log.debug("Compiling %d sets in parallel (server cap %d compiles)", len(to_compile), COMPILE_WORKERS)
+                    finished = []
+                    
+                    def on_compiled(i, ok):
+                        finished.append(i)
+                        progress(f"set {i} {'compiled' if ok else 'failed to compile'}",
+                                 0.3 + 0.7 * len(finished) / len(to_compile))
+                    
+                    compiled = compile_quiz_sets(output_dir, num_sets, texinputs=templates_dir,
+                                                 scheduler=scheduler, session_id=session_id,
+                                                 on_compiled=on_compiled, only=to_compile,
+                                                 formats=formats, figures=figures, template=template)
+                    success = len(compiled) == len(to_compile)
+                elif success:
+                    progress("all sets compiled", 1.0)
+                
+                # The output listing is only worth its I/O when tracing
+                if log.isEnabledFor(TRACE):
+                    try:
+                        listing = [f"{f}: {os.path.getsize(os.path.join(output_dir, f))} bytes"
+                                   for f in os.listdir(output_dir)]
+                        log.log(TRACE, "Files in %s:\n%s", output_dir, "\n".join(listing))
+                    except OSError as e:
+                        log.log(TRACE, "Error listing files: %s", e)
+                
+                if not success:
+                    log.warning("QuizGenerator returned False")
+                    
+                    # Only the parsed error records are kept - not whole logs
+                    latex_errors = collect_latex_errors(output_dir, num_sets, questions_text, model)
+                    if diagnostics is not None:
+                        diagnostics.extend(latex_errors)
+                    tex_created = any(os.path.exists(os.path.join(output_dir, f'quiz_set_{i}.tex'))
+                                      for i in range(1, num_sets + 1))
+                    if not tex_created:
+                        summary = "❌ No LaTeX files created - question processing failed"
+                    elif latex_errors:
+                        summary = ("❌ LaTeX files created but PDF compilation failed:\n"
+                                   + format_diagnostics(latex_errors))
+                    else:
+                        summary = "❌ LaTeX files created but PDF compilation failed (no error record in the logs)"
+                    
+                    return None, f"QuizGenerator returned False.\n{summary}"
+                    
+            except (JobCancelled, CancelledError):
+                raise
+            except Exception as gen_error:
+                log.exception("Exception during generate_quizzes")
+                return None, f"Generation exception: {str(gen_error)}"
+                
+        except (JobCancelled, CancelledError):
+            raise
+        except Exception as e:
+            log.exception("Error preparing the setwise run")
+            return None, f"Generation error: {str(e)}"
+        
+        # Collect results
+        quiz_sets = []
+        
+        for i in range(1, num_sets + 1):
+            pdf_path = os.path.join(output_dir, f'quiz_set_{i}.pdf')
+            answer_path = os.path.join(output_dir, f'answer_key_{i}.txt')
+            tex_path = os.path.join(output_dir, f'quiz_set_{i}.tex')
+            
+            if os.path.exists(pdf_path) or (draft and os.path.exists(tex_path)):
+                # Only paths are collected - bytes are read when something needs them
+                tex_data = ""
+                if os.path.exists(tex_path):
+                    with open(tex_path, 'r', encoding='utf-8') as f:
+                        tex_data = f.read()
+                
+                quiz_sets.append({
+                    'name': f'Quiz Set {i}',
+                    'tex_hash': tex_digest(tex_data),
+                    'pdf_path': None if draft else pdf_path,
+                    'tex_path': tex_path if os.path.exists(tex_path) else None,
+                    'answer_path': answer_path if os.path.exists(answer_path) else None,
+                })
+        
+        log.debug("Collected %d of %d quiz sets", len(quiz_sets), num_sets)
+        
+        # Only complete results are worth serving again
+        if cache_key and not draft and len(quiz_sets) == num_sets:
+            cache.put(cache_key, quiz_sets)
+        
+        return quiz_sets, None
+        
+    except (JobCancelled, CancelledError):
+        raise
+    except Exception as e:
+        log.exception("Unexpected error during generation")
+        return None, f"Unexpected error: {str(e)}"
+
+def write_sets_to_zip(archive, quiz_sets, folder=""):
+    """Add every set's PDF, TEX file and answer key to an open zip
+
+    Files are streamed from the output directory in chunks, so a zip of
+    many sets never needs their bytes in memory at once.
+    """
+    prefix = f"{folder}/" if folder else ""
+    for quiz_set in quiz_sets:
+        for path_key in ('pdf_path', 'tex_path', 'answer_path'):
+            path = quiz_set.get(path_key)
+            if not path or not os.path.exists(path):
+                continue
+            # PDFs are already compressed - deflating them again only costs time
+            compress_type = zipfile.ZIP_STORED if path_key == 'pdf_path' else None
+            archive.write(path, prefix + os.path.basename(path), compress_type=compress_type)
+
+
+def write_results_zip(quiz_sets):
+    """Zip one generation's sets next to them in their output directory; returns the zip path"""
+    tex_paths = [quiz_set['tex_path'] for quiz_set in quiz_sets if quiz_set.get('tex_path')]
+    if not tex_paths:
+        return None
+    zip_path = os.path.join(os.path.dirname(tex_paths[0]), "setwise_quizzes.zip")
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        write_sets_to_zip(archive, quiz_sets)
+    return zip_path
@@ -0,0 +1,255 @@
+"""
+Background jobs for Setwise Web
+Generations run off the script thread and hand back artifact handles
+"""
+
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+from setwise_web.bulk import run_bulk_generation
+from setwise_web.config import JOB_RESULT_TTL, JOB_WORKERS
+from setwise_web.generation import generate_quiz_pdfs, write_results_zip
+from setwise_web.logs import bind_request, log, request_context
+from setwise_web.scheduler import JobCancelled
+from setwise_web.storage import publish_quiz_sets
+from setwise_web.variants import generate_variant_pdfs
+
+
+class GenerationJob:
+    """One queued or running call to ``generate_quiz_pdfs`` and its outcome"""
+
+    def __init__(self, session_id, params):
+        self.id = uuid.uuid4().hex
+        # Tags the job's log lines and its queued compiles
+        self.request_id = self.id[:12]
+        self.session_id = session_id
+        self.params = params
+        self.kind = ('bulk' if 'entries' in params else 'variants' if 'student_ids' in params
+                     else 'draft' if params.get('draft') else 'generate')
+        self.stage = "queued"
+        self.progress = 0.0
+        self.events = []
+        self.result = None
+        self.created = time.time()
+        self.finished = None
+        self.cancelled = False
+
+    def report(self, stage, fraction):
+        # Every stage boundary doubles as a cancellation point
+        if self.cancelled:
+            raise JobCancelled(self.id)
+        self.stage = stage
+        self.progress = max(self.progress, min(fraction, 1.0))
+        self.events.append((time.time() - self.created, stage))
+
+
+class JobManager:
+    """Runs generation jobs on background threads so the script thread never blocks
+
+    Finished jobs are kept until their session collects them (or until
+    ``JOB_RESULT_TTL`` passes, for sessions that went away). Their files are
+    moved into ``artifacts`` and results refer to them by handle only. Jobs
+    submitted with ``cacheable=False`` (a random seed) bypass the quiz cache.
+    """
+
+    def __init__(self, artifacts, workspaces, cache=None, scheduler=None, formats=None, models=None,
+                 figures=None, thumbnails=None, metrics=None, max_workers=JOB_WORKERS,
+                 result_ttl=JOB_RESULT_TTL):
+        self.artifacts = artifacts
+        self.workspaces = workspaces
+        self.cache = cache
+        self.models = models
+        self.scheduler = scheduler
+        self.formats = formats
+        self.figures = figures
+        self.thumbnails = thumbnails
+        self.metrics = metrics
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="setwise-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.result_ttl = result_ttl
+
+    def submit(self, session_id, **params):
+        """Queue a generation and return its job id"""
+        job = GenerationJob(session_id, params)
+        with self._lock:
+            self._expire()
+            self._jobs[job.id] = job
+        with request_context(job.request_id):
+            log.info("Job queued", extra={'fields': {
+                'kind': job.kind, 'session': session_id[:8], 'template': params.get('template'),
+                'sets': params.get('num_sets'), 'seed': params.get('seed'),
+                'chars': len(params.get('questions_text') or "")}})
+            self._pool.submit(bind_request(self._run), job)
+        return job.id
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def collect(self, job_id):
+        """Hand over a finished job's result and forget the job"""
+        with self._lock:
+            return self._jobs.pop(job_id, None)
+
+    def cancel(self, job_id):
+        """Drop a superseded job
+
+        Its queued compiles are withdrawn at once; work already running
+        stops at the job's next stage boundary.
+        """
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None and not job.finished:
+            job.cancelled = True
+            withdrawn = self.scheduler.cancel(job.request_id) if self.scheduler is not None else 0
+            log.info("Cancelled job %s", job.request_id, extra={'fields': {'withdrawn': withdrawn}})
+
+    def _run(self, job):
+        params = job.params
+        diagnostics = []
+        try:
+            job.report("started", 0.0)
+        except JobCancelled:
+            return
+        if 'entries' in params:
+            return self._run_bulk(job)
+        if 'student_ids' in params:
+            return self._run_variants(job)
+        # Previous results are handles; reuse needs the files they point at
+        previous_sets = [self.artifacts.resolve(quiz_set) for quiz_set in params.get('previous_sets') or []]
+        handle = zip_name = None
+        # The workspace goes away on every exit path; what is worth keeping is published first
+        with self.workspaces.workspace("job") as output_dir:
+            try:
+                quiz_sets, error = generate_quiz_pdfs(
+                    params['questions_text'], params['template'], params['num_sets'],
+                    params['header_config'], seed=params['seed'], cache=self._cache_for(params),
+                    parallel=params['parallel'], progress=job.report,
+                    scheduler=self.scheduler, session_id=job.session_id,
+                    previous_sets=previous_sets, formats=self.formats, figures=self.figures,
+                    draft=params.get('draft', False), models=self.models, diagnostics=diagnostics,
+                    output_dir=output_dir
+                )
+            except (JobCancelled, CancelledError):
+                return
+            except Exception as e:
+                quiz_sets, error = None, f"Unexpected error: {str(e)}"
+            if job.cancelled:
+                # The cancel landed inside a stage that swallows exceptions
+                return
+            try:
+                if quiz_sets:
+                    zip_path = write_results_zip(quiz_sets)
+                    handle, quiz_sets = publish_quiz_sets(self.artifacts, quiz_sets, zip_path)
+                    zip_name = os.path.basename(zip_path) if zip_path else None
+                    self._warm_previews(handle, quiz_sets, params.get('draft', False))
+            except OSError as e:
+                quiz_sets, error = None, f"Could not store the generated files: {str(e)}"
+        job.result = {
+            'quiz_sets': quiz_sets,
+            'artifact': handle,
+            'zip': zip_name,
+            'error': error,
+            'template': params['template'],
+            'num_sets': params['num_sets'],
+            'seed': params['seed'],
+            'draft': params.get('draft', False),
+            'diagnostics': diagnostics,
+            # Enough to re-run the same request, without pinning the previous PDFs
+            'params': {k: v for k, v in params.items() if k != 'previous_sets'}
+        }
+        self._finish(job, error)
+
+    def _run_bulk(self, job):
+        def build(zip_path):
+            report = run_bulk_generation(
+                job.params['entries'], zip_path, self.workspaces, progress=job.report, cache=self.cache,
+                models=self.models, scheduler=self.scheduler, formats=self.formats,
+                session_id=job.session_id, figures=self.figures
+            )
+            failed = [r for r in report if r['status'] != 'ok']
+            error = f"All {len(report)} quizzes in the batch failed" if len(failed) == len(report) else None
+            return {'report': report}, error, bool(report)
+        self._run_archive(job, 'bulk', build)
+
+    def _run_variants(self, job):
+        params = job.params
+        diagnostics = []
+        
+        def build(zip_path):
+            summary, error = generate_variant_pdfs(
+                params['questions_text'], params['template'], params['student_ids'],
+                params['header_config'], seed=params['seed'], orderings=params['orderings'],
+                max_variants=params['max_variants'], zip_path=zip_path, workspaces=self.workspaces,
+                progress=job.report,
+                cache=self._cache_for(params), models=self.models, scheduler=self.scheduler,
+                formats=self.formats, session_id=job.session_id, diagnostics=diagnostics,
+                figures=self.figures
+            )
+            return ({'summary': summary, 'diagnostics': diagnostics,
+                     'seed': summary['seed'] if summary else params['seed']},
+                    error, summary is not None)
+        self._run_archive(job, 'variants', build)
+
+    def _run_archive(self, job, kind, build):
+        """Run ``build(zip_path)`` for a job whose output is one zip on disk
+
+        ``build`` returns ``(result, error, has_zip)``; ``kind`` is flagged
+        in the result so the page knows how to show it. The zip is built in
+        a workspace and published to the artifact store.
+        """
+        handle = None
+        # Archives can be large, so they are built on disk rather than in tmpfs
+        with self.workspaces.workspace("archive", large=True) as archive_dir:
+            zip_path = os.path.join(archive_dir, "setwise_quizzes.zip")
+            try:
+                result, error, has_zip = build(zip_path)
+            except (JobCancelled, CancelledError):
+                return
+            except Exception as e:
+                result, error, has_zip = {}, f"Unexpected error: {str(e)}", False
+            if job.cancelled:
+                return
+            try:
+                if has_zip:
+                    handle = self.artifacts.put({os.path.basename(zip_path): zip_path})
+            except OSError as e:
+                error = f"Could not store the generated files: {str(e)}"
+        job.result = dict(result, artifact=handle, zip=os.path.basename(zip_path) if handle else None,
+                          error=error, num_sets=job.params['num_sets'], **{kind: True})
+        self._finish(job, error)
+
+    def _cache_for(self, params):
+        return self.cache if params.get('cacheable', True) else None
+
+    def _warm_previews(self, handle, quiz_sets, draft):
+        """Render page 1 of each set now, so the results page only serves images"""
+        if self.thumbnails is None or draft:
+            return
+        for quiz_set in quiz_sets:
+            pdf_path = self.artifacts.path(handle, quiz_set['pdf']) if quiz_set.get('pdf') else None
+            if pdf_path:
+                self.thumbnails.page(pdf_path, 1)
+
+    def _finish(self, job, error):
+        job.stage = "failed" if error else "done"
+        job.progress = 1.0
+        job.finished = time.time()
+        started = job.events[0][0] if job.events else 0.0
+        log.info("Job %s", job.stage, extra={'fields': {
+            'queued_ms': round(started * 1000, 1),
+            'ms': round((job.finished - job.created) * 1000, 1)}})
+        if self.metrics is not None:
+            self.metrics.inc("setwise_web_jobs_total", kind=job.kind, outcome=job.stage)
+            self.metrics.observe("setwise_web_job_seconds", job.finished - job.created, kind=job.kind)
+            self.metrics.observe("setwise_web_job_queue_seconds", started, kind=job.kind)
+            self.metrics.observe("setwise_web_sets_per_request", job.params.get('num_sets') or 0, kind=job.kind)
+
+    def _expire(self):
+        cutoff = time.time() - self.result_ttl
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished < cutoff]:
+            del self._jobs[job_id]
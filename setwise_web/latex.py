@@ -0,0 +1,529 @@
+"""
+LaTeX compilation for Setwise Web
+pdflatex runs, precompiled formats, cached figures and log diagnostics
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from setwise_web.config import (
+    COMPILE_TIMEOUT, FIGURE_MAX_BYTES, FIGURE_RETRY_AFTER, MAX_LATEX_PASSES, PDFLATEX)
+from setwise_web.logs import log
+from setwise_web.questions import _VERBATIM_ENVS, _argument_end, question_lines
+from setwise_web.storage import evict_lru, link_or_copy
+
+
+_LOG_LINE_REF = re.compile(r'^l\.(\d+)\s?(.*)')
+MAX_LATEX_ERRORS_PER_SET = 5
+# What pdflatex says when a -fmt file is missing, corrupt or from another TeX build
+_FORMAT_LOAD_ERROR = re.compile(r"can't find the format file|Fatal format file error|"
+                                r"format file .*(?:made|written) by")
+# Follow-ups TeX prints after the real error, never a cause of their own
+_LOG_TRAILERS = ('Emergency stop', '==> Fatal error occurred')
+_VERBATIM_BOUNDARY = re.compile(
+    r'\\(begin|end)\{(' + '|'.join(re.escape(name) for name in _VERBATIM_ENVS) + r')\}'
+)
+
+
+def _question_fingerprint(entry):
+    """Longest literal line of a question's text - used to find it in rendered TeX"""
+    text = entry.get('template') or entry.get('question') or ""
+    if not isinstance(text, str):
+        return None
+    chunks = [chunk.strip() for piece in re.split(r'\{\{.*?\}\}', text) for chunk in piece.splitlines()]
+    chunk = max(chunks, key=len, default="")
+    return chunk if len(chunk) >= 8 else None
+
+
+def question_starts(tex_lines, model):
+    """Map the 1-based line where each question starts in a rendered .tex to its (section, index)
+
+    setwise shuffles question order per set, so each question is located by
+    its fingerprint rather than by position. Lines inside verbatim
+    environments are skipped - a listing may quote another question's text.
+    The .tex itself is left as setwise wrote it.
+    """
+    body_start = next((n for n, line in enumerate(tex_lines) if '\\begin{document}' in line), 0)
+    searchable = []
+    verbatim = None
+    for n in range(body_start + 1, len(tex_lines)):
+        line = tex_lines[n]
+        boundary = _VERBATIM_BOUNDARY.search(line)
+        if verbatim is None and boundary and boundary.group(1) == 'begin':
+            verbatim = boundary.group(2)
+            if f"\\end{{{verbatim}}}" in line[boundary.end():]:
+                verbatim = None
+            continue
+        if verbatim is not None:
+            if f"\\end{{{verbatim}}}" in line:
+                verbatim = None
+            continue
+        searchable.append(n)
+    starts = {}
+    for section in ('mcq', 'subjective'):
+        for index, entry in enumerate(model.get(section) or [], start=1):
+            fingerprint = _question_fingerprint(entry) if isinstance(entry, dict) else None
+            if not fingerprint:
+                continue
+            for n in searchable:
+                if n + 1 not in starts and fingerprint in tex_lines[n]:
+                    starts[n + 1] = (section, index)
+                    break
+    return starts
+
+
+def parse_latex_log(log_text, starts=None):
+    """Extract the ``! ...`` error records from a pdflatex log
+
+    Returns a list of dicts with ``message``, ``tex_line`` (None if the log
+    gives no ``l.<n>`` reference), ``context`` (the offending source text)
+    and ``source`` - the (section, index) of the question containing that
+    line according to ``starts`` (from ``question_starts``), or None for
+    template code.
+    """
+    errors = []
+    log_lines = log_text.splitlines()
+    for n, line in enumerate(log_lines):
+        if not line.startswith('! '):
+            continue
+        message = line[2:].strip()
+        if message.startswith(_LOG_TRAILERS) and errors:
+            continue
+        record = {'message': message, 'tex_line': None, 'context': "", 'source': None}
+        for follow in log_lines[n + 1:n + 20]:
+            if follow.startswith('! '):
+                break
+            ref = _LOG_LINE_REF.match(follow)
+            if ref:
+                record['tex_line'] = int(ref.group(1))
+                record['context'] = ref.group(2).strip()[-80:]
+                break
+        if record['tex_line'] and starts:
+            record['source'] = _source_for_tex_line(starts, record['tex_line'])
+        errors.append(record)
+        if len(errors) >= MAX_LATEX_ERRORS_PER_SET:
+            break
+    return errors
+
+
+def _source_for_tex_line(starts, tex_line):
+    started = [line for line in starts if line <= tex_line]
+    return starts[max(started)] if started else None
+
+
+def collect_latex_errors(output_dir, num_sets, questions_text="", model=None):
+    """Parse the log of every set that failed to produce a PDF into diagnostics
+
+    With the question ``model`` each error is traced back to its question.
+    """
+    lines = question_lines(questions_text)
+    diagnostics = []
+    for i in range(1, num_sets + 1):
+        base = Path(output_dir) / f'quiz_set_{i}'
+        if base.with_suffix('.pdf').exists() or not base.with_suffix('.log').exists():
+            continue
+        try:
+            log_text = base.with_suffix('.log').read_text(encoding='utf-8', errors='ignore')
+            tex_lines = base.with_suffix('.tex').read_text(encoding='utf-8', errors='ignore').splitlines()
+        except OSError:
+            continue
+        starts = question_starts(tex_lines, model) if model else None
+        for record in parse_latex_log(log_text, starts):
+            section, index = record['source'] or (None, None)
+            diagnostics.append({
+                'severity': 'error', 'section': section, 'index': index, 'field': None,
+                'line': lines.get((section, index)), 'message': f"LaTeX: {record['message']}",
+                'set': i, 'tex_line': record['tex_line'], 'context': record['context'],
+            })
+    return diagnostics
+
+
+def _run_pdflatex(cmd, cwd, env, log_path, timeout):
+    """Run ``cmd`` until LaTeX stops asking for a rerun; False on any failed pass"""
+    for _ in range(MAX_LATEX_PASSES):
+        try:
+            proc = subprocess.run(
+                cmd, cwd=cwd, env=env, timeout=timeout,
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+        except (OSError, subprocess.TimeoutExpired) as e:
+            log.error("pdflatex failed to run in %s: %s", cwd, e)
+            return False
+        if proc.returncode != 0:
+            return False
+        try:
+            log_text = Path(log_path).read_text(encoding='utf-8', errors='ignore')
+        except OSError:
+            break
+        if "Rerun to get" not in log_text:
+            break
+    return True
+
+
+def _format_failed(log_path):
+    """True when a warm compile died loading its format rather than on the document"""
+    try:
+        log_text = Path(log_path).read_text(encoding='utf-8', errors='ignore')
+    except OSError:
+        # TeX only opens the log once the format has loaded
+        return True
+    return bool(_FORMAT_LOAD_ERROR.search(log_text))
+
+
+def _compile_source(source, tex_path, env, timeout, formats):
+    """One compile of ``source`` into ``tex_path``'s PDF, warm when a format is available"""
+    log_path = tex_path.with_suffix('.log')
+    pdf_path = tex_path.with_suffix('.pdf')
+    if formats is not None:
+        warm = formats.prepare(source, env)
+        if warm is not None:
+            format_name, warm_tex = warm
+            warm_env = dict(env, TEXFORMATS=f"{formats.root}{os.pathsep}{env.get('TEXFORMATS', '')}")
+            cmd = [PDFLATEX, f"-fmt={format_name}", f"-jobname={tex_path.stem}",
+                   "-interaction=nonstopmode", "-halt-on-error", warm_tex.name]
+            # A log left by an earlier run would hide a format that never loaded
+            log_path.unlink(missing_ok=True)
+            ok = _run_pdflatex(cmd, tex_path.parent, warm_env, log_path, timeout)
+            warm_tex.unlink(missing_ok=True)
+            if (ok and pdf_path.exists()) or not _format_failed(log_path):
+                return ok and pdf_path.exists()
+            log.warning("Format %s failed to load for %s - retrying cold", format_name, tex_path.name)
+            formats.discard(format_name)
+    
+    cmd = [PDFLATEX, f"-jobname={tex_path.stem}", "-interaction=nonstopmode", "-halt-on-error", source.name]
+    ok = _run_pdflatex(cmd, tex_path.parent, env, log_path, timeout)
+    return ok and pdf_path.exists()
+
+
+def _figures_failed(tex_path, external_tex, log_path):
+    """True when a failed compile of the figures copy may be down to a cached figure
+
+    The copy keeps line numbers, so an error on a line it left untouched is
+    in the document itself and would happen just the same with inline figures.
+    """
+    try:
+        original = tex_path.read_text(encoding='utf-8').splitlines()
+        external = external_tex.read_text(encoding='utf-8').splitlines()
+        log_text = log_path.read_text(encoding='utf-8', errors='ignore')
+    except OSError:
+        return True
+    changed = {number for number, (a, b) in enumerate(zip(original, external), 1) if a != b}
+    lines = [error['tex_line'] for error in parse_latex_log(log_text) if error['tex_line']]
+    return not lines or any(line in changed for line in lines)
+
+
+def compile_tex(tex_path, texinputs=None, timeout=COMPILE_TIMEOUT, formats=None, figures=None):
+    """Compile a .tex file to PDF in its own directory, rerunning only when LaTeX asks to
+
+    With a ``FormatCache`` the package-loading part of the preamble comes
+    from a precompiled format. A format that fails to load is discarded and
+    the file compiled cold; an error in the document itself is reported as
+    is, keeping the format. With a ``FigureCache`` the figures are included
+    from cached PDFs; only an error that points at a replaced figure (or at
+    no line at all) is retried once with the untouched .tex.
+    Returns True when the PDF was produced. The ``.log`` is left next to
+    the source for error reporting.
+    """
+    tex_path = Path(tex_path)
+    env = os.environ.copy()
+    if texinputs:
+        # Trailing separator keeps the default TeX search path
+        env["TEXINPUTS"] = f"{texinputs}{os.pathsep}{env.get('TEXINPUTS', '')}"
+    
+    # Every compile writes quiz_set_N.pdf/.log, whichever copy of the source it reads
+    source = tex_path
+    if figures is not None:
+        source = figures.externalize(tex_path, env) or tex_path
+    try:
+        ok = _compile_source(source, tex_path, env, timeout, formats)
+        if not ok and source != tex_path and _figures_failed(tex_path, source, tex_path.with_suffix('.log')):
+            log.warning("Compile of %s with cached figures failed - retrying with inline figures", tex_path.name)
+            ok = _compile_source(tex_path, tex_path, env, timeout, formats)
+    finally:
+        if source != tex_path:
+            source.unlink(missing_ok=True)
+    return ok
+
+
+class FormatCache:
+    """Precompiled LaTeX formats so compiles skip loading the template's packages
+
+    The rendered preamble is split after its last ``\\usepackage``; that part
+    depends only on the setwise template (default/compact/minimal) and is
+    dumped once into a format with mylatexformat. Compiles then load the
+    format and only run the quiz-specific rest of the preamble, marked off
+    with ``\\endofdump`` in a scratch copy of the .tex file.
+    """
+
+    PACKAGE_LINE = re.compile(r'^\s*\\(documentclass|usepackage|RequirePackage)\b')
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.available = bool(shutil.which("kpsewhich")) and subprocess.run(
+            ["kpsewhich", "mylatexformat.ltx"], capture_output=True, text=True
+        ).stdout.strip() != ""
+        self.builds = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._build_locks = {}
+
+    @classmethod
+    def split_preamble(cls, tex):
+        """Return (package part, remainder) of a document, or None if it has no packages"""
+        head, sep, _ = tex.partition('\\begin{document}')
+        if not sep:
+            return None
+        lines = head.splitlines(keepends=True)
+        last = max((n for n, line in enumerate(lines) if cls.PACKAGE_LINE.match(line)), default=None)
+        if last is None:
+            return None
+        # A multi-line \\usepackage[...]{...} must not be cut in half
+        end = last + 1
+        while end < len(lines):
+            part = "".join(lines[:end])
+            if part.count('{') == part.count('}') and part.count('[') == part.count(']'):
+                break
+            end += 1
+        dump = "".join(lines[:end])
+        return dump, tex[len(dump):]
+
+    def prepare(self, tex_path, env):
+        """Make sure a format exists for ``tex_path`` and write its warm copy
+
+        Returns (format name, warm .tex path) or None when the file cannot
+        use a format. The warm copy is named after ``tex_path``'s stem.
+        """
+        if not self.available:
+            return None
+        try:
+            split = self.split_preamble(tex_path.read_text(encoding='utf-8'))
+        except OSError:
+            return None
+        if split is None:
+            return None
+        dump, rest = split
+        name = "setwise-" + hashlib.sha256(f"{PDFLATEX}\n{dump}".encode('utf-8')).hexdigest()[:24]
+        if not self._ensure(name, dump, env):
+            return None
+        warm_tex = tex_path.with_name(f".{tex_path.stem}.warm.tex")
+        # On the line after the dump, not a line of its own, so log line numbers
+        # still match the original (and a trailing % comment can't swallow it)
+        warm_tex.write_text(dump + "\\endofdump " + rest, encoding='utf-8')
+        return name, warm_tex
+
+    def discard(self, name):
+        """Forget a format that failed to load (e.g. after a TeX upgrade)"""
+        (self.root / f"{name}.fmt").unlink(missing_ok=True)
+
+    def _ensure(self, name, dump, env):
+        if (self.root / f"{name}.fmt").exists():
+            return True
+        with self._lock:
+            build_lock = self._build_locks.setdefault(name, threading.Lock())
+        with build_lock:
+            if (self.root / f"{name}.fmt").exists():
+                return True
+            scratch = Path(tempfile.mkdtemp(prefix=f"{name}-", dir=self.root))
+            try:
+                (scratch / "preamble.tex").write_text(
+                    dump + "\\begin{document}\n\\end{document}\n", encoding='utf-8'
+                )
+                cmd = [PDFLATEX, "-ini", "-interaction=nonstopmode", f"-jobname={name}",
+                       "&pdflatex", "mylatexformat.ltx", "preamble.tex"]
+                try:
+                    proc = subprocess.run(
+                        cmd, cwd=scratch, env=env, timeout=COMPILE_TIMEOUT,
+                        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+                    )
+                    built = proc.returncode == 0 and (scratch / f"{name}.fmt").exists()
+                except (OSError, subprocess.TimeoutExpired):
+                    built = False
+                if built:
+                    os.replace(scratch / f"{name}.fmt", self.root / f"{name}.fmt")
+                    self.builds += 1
+                    log.info("Built LaTeX format %s", name)
+                else:
+                    self.failures += 1
+                    log.warning("Could not build LaTeX format %s - compiling cold", name)
+                return built
+            finally:
+                shutil.rmtree(scratch, ignore_errors=True)
+
+
+class FigureCache:
+    """Figures compiled once to standalone PDFs and shared by every set and request
+
+    ``tikzpicture``/``circuitikz`` environments (pgfplots axes live inside
+    these) and ``\\chemfig`` commands in the document body are each built
+    with the document's full preamble and the ``preview`` package, keyed
+    by a hash of that preamble and the figure source. The compile copy of a
+    set then includes the cached PDFs instead of typesetting the figures
+    again. Replacements keep the line count, so LaTeX log line numbers still
+    match the original .tex. A figure that fails to build stays inline until
+    ``retry_after`` seconds have passed. Least recently used PDFs are
+    dropped once the directory outgrows ``max_bytes``.
+    """
+
+    ENVIRONMENTS = ('tikzpicture', 'circuitikz')
+    _BEGIN = re.compile(r'\\begin\{(' + '|'.join(ENVIRONMENTS) + r')\}|\\chemfig(?![A-Za-z])')
+    # Figures that draw relative to the page cannot be cut out of it
+    _PAGE_BOUND = re.compile(r'remember picture|overlay|\\label|\\ref\b')
+
+    def __init__(self, root, max_bytes=FIGURE_MAX_BYTES, retry_after=FIGURE_RETRY_AFTER):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.retry_after = retry_after
+        self.builds = 0
+        self.hits = 0
+        self.failures = 0
+        self._failed = {}
+        self._lock = threading.Lock()
+        self._build_locks = {}
+
+    def find_figures(self, body):
+        """``(start, end)`` spans of every externalizable figure in ``body``"""
+        spans = []
+        position = 0
+        while True:
+            match = self._BEGIN.search(body, position)
+            if match is None:
+                return spans
+            if match.group(1):
+                end = self._environment_end(body, match.group(1), match.end())
+            else:
+                end = _argument_end(body, match.end())
+            if end is None:
+                return spans
+            if not self._PAGE_BOUND.search(body, match.start(), end):
+                spans.append((match.start(), end))
+            position = end
+
+    @staticmethod
+    def _environment_end(body, name, position):
+        depth = 1
+        pattern = re.compile(r'\\(begin|end)\{' + re.escape(name) + r'\}')
+        for match in pattern.finditer(body, position):
+            depth += 1 if match.group(1) == 'begin' else -1
+            if depth == 0:
+                return match.end()
+        return None
+
+    def externalize(self, tex_path, env):
+        """Write a compile copy of ``tex_path`` that includes cached figure PDFs
+
+        Returns the copy's path, or None when nothing could be externalized.
+        Figure PDFs are linked next to the copy.
+        """
+        try:
+            tex = tex_path.read_text(encoding='utf-8')
+        except OSError:
+            return None
+        head, sep, body = tex.partition('\\begin{document}')
+        if not sep:
+            return None
+        parts = []
+        position = 0
+        for start, end in self.find_figures(body):
+            source = body[start:end]
+            if source.startswith('\\chemfig') and 'chemfig' not in head:
+                continue
+            key = hashlib.sha256(f"{PDFLATEX}\n{head}\n{source}".encode('utf-8')).hexdigest()[:24]
+            if not self._ensure(key, head, source, env):
+                continue
+            figure_name = f"fig-{key}.pdf"
+            link_target = tex_path.parent / figure_name
+            try:
+                if not link_target.exists():
+                    link_or_copy(self.root / figure_name, link_target)
+            except OSError:
+                # Evicted since it was checked - typeset this one inline
+                continue
+            # One comment line per original line keeps log line numbers valid
+            parts.append(body[position:start])
+            parts.append(f"\\includegraphics{{{figure_name}}}" + "%\n" * source.count("\n"))
+            position = end
+        if not parts:
+            return None
+        parts.append(body[position:])
+        if not re.search(r'\\usepackage(\[[^\]]*\])?\{[^}]*\bgraphicx\b', head):
+            # Prepended on the first line, again so line numbers do not move
+            head = "\\RequirePackage{graphicx}" + head
+        external_tex = tex_path.with_name(f".{tex_path.stem}.figures.tex")
+        external_tex.write_text(head + sep + "".join(parts), encoding='utf-8')
+        return external_tex
+
+    def _ensure(self, key, head, source, env):
+        figure = self.root / f"fig-{key}.pdf"
+        try:
+            # mtime is the recency eviction goes by
+            os.utime(figure)
+            with self._lock:
+                self.hits += 1
+            return True
+        except OSError:
+            pass
+        with self._lock:
+            failed_at = self._failed.get(key)
+            if failed_at is not None:
+                if time.monotonic() - failed_at < self.retry_after:
+                    return False
+                del self._failed[key]
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+        try:
+            with build_lock:
+                if figure.exists():
+                    return True
+                built = self._build(key, head, source, env, figure)
+        finally:
+            with self._lock:
+                self._build_locks.pop(key, None)
+        if built:
+            self.evict()
+        return built
+
+    def _build(self, key, head, source, env, figure):
+        scratch = Path(tempfile.mkdtemp(prefix=f".fig-{key}-", dir=self.root))
+        try:
+            (scratch / "figure.tex").write_text(
+                head + "\\usepackage[active,tightpage]{preview}\n"
+                "\\begin{document}\n\\begin{preview}\n" + source + "\n\\end{preview}\n\\end{document}\n",
+                encoding='utf-8'
+            )
+            cmd = [PDFLATEX, "-interaction=nonstopmode", "-halt-on-error", "figure.tex"]
+            built = (_run_pdflatex(cmd, scratch, env, scratch / "figure.log", COMPILE_TIMEOUT)
+                     and (scratch / "figure.pdf").exists())
+            with self._lock:
+                if built:
+                    os.replace(scratch / "figure.pdf", figure)
+                    self.builds += 1
+                else:
+                    self._failed[key] = time.monotonic()
+                    self.failures += 1
+            log.debug("Figure %s: %s", key, 'built' if built else 'failed to build - left inline')
+            return built
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    def evict(self):
+        """Drop least recently used figures until the cache fits in ``max_bytes``"""
+        figures = []
+        for figure in self.root.glob("fig-*.pdf"):
+            try:
+                stat = figure.stat()
+            except OSError:
+                continue
+            figures.append((stat.st_mtime, stat.st_size, figure))
+        evict_lru(figures, self.max_bytes, lambda figure: figure.unlink(missing_ok=True))
+
+    def stats(self):
+        with self._lock:
+            return {'builds': self.builds, 'hits': self.hits, 'failures': self.failures}
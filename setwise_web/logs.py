@@ -0,0 +1,118 @@
+"""
+Logging for Setwise Web
+Request-tagged log lines and timed stage spans
+"""
+
+import contextvars
+import functools
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import CancelledError
+from contextlib import contextmanager
+
+# Logging goes through the "setwise_web" logger, one line per event, tagged
+# with the id of the request (job) it belongs to. TRACE is below DEBUG and
+# is the only level that dumps whole files.
+TRACE = 5
+logging.addLevelName(TRACE, "TRACE")
+LOG_LEVEL = os.environ.get("SETWISE_WEB_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("SETWISE_WEB_LOG_FORMAT", "text")
+
+log = logging.getLogger("setwise_web")
+# Every span is also written here, whatever the log level, for the metrics registry
+_span_log = logging.getLogger("setwise_web.spans")
+_span_log.propagate = False
+_span_log.setLevel(logging.INFO)
+_request_id = contextvars.ContextVar("setwise_web_request_id", default="-")
+
+
+class _LogFormatter(logging.Formatter):
+    """``key=value`` text lines, or one JSON object per line"""
+
+    def __init__(self, as_json=False):
+        super().__init__()
+        self.as_json = as_json
+
+    def format(self, record):
+        fields = getattr(record, 'fields', None) or {}
+        timestamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created))
+        message = record.getMessage()
+        if record.exc_info:
+            message = f"{message}\n{self.formatException(record.exc_info)}"
+        if self.as_json:
+            return json.dumps({'ts': timestamp, 'level': record.levelname, 'request': record.request_id,
+                               'msg': message, **fields}, default=str)
+        pairs = " ".join(f"{key}={value}" for key, value in fields.items())
+        return f"{timestamp} {record.levelname:<7} [{record.request_id}] {message}" + (f" {pairs}" if pairs else "")
+
+
+class _RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+
+# Imported once per process, so the handler, the filter and every caller of
+# request_context share this module's one ContextVar
+_handler = logging.StreamHandler(sys.stdout)
+_handler.setFormatter(_LogFormatter(as_json=LOG_FORMAT == "json"))
+_handler.addFilter(_RequestIdFilter())
+log.addHandler(_handler)
+log.propagate = False
+_level = logging.getLevelName(LOG_LEVEL)
+log.setLevel(_level if isinstance(_level, int) else logging.INFO)
+
+
+@contextmanager
+def request_context(request_id):
+    """Tag every log line written inside the block with ``request_id``"""
+    token = _request_id.set(request_id)
+    try:
+        yield request_id
+    finally:
+        _request_id.reset(token)
+
+
+def current_request_id():
+    """Request id of the work running in this context ("-" outside any request)"""
+    return _request_id.get()
+
+
+def bind_request(fn):
+    """``fn`` wrapped to run in a copy of the caller's context
+
+    Thread pools don't carry context variables over, so work handed to
+    another thread is bound first to keep the request id on its log lines.
+    Bind once per submission - a context can only be entered by one thread.
+    """
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+@contextmanager
+def log_span(stage, level=logging.INFO, **fields):
+    """Time a stage and log its duration when it ends
+
+    Yields the ``fields`` dict, so the block can add what it learned
+    (e.g. whether a compile succeeded) to the span's log line. A span
+    left by a cancelled job or compile has the outcome ``cancelled``.
+    """
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield fields
+    except CancelledError:
+        outcome = "cancelled"
+        raise
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        span = {'stage': stage, 'ms': round(elapsed, 1), 'outcome': outcome, **fields}
+        if _span_log.handlers:
+            _span_log.info(stage, extra={'fields': span})
+        if log.isEnabledFor(level):
+            log.log(level, "%s finished", stage, extra={'fields': span})
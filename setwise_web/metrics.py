@@ -0,0 +1,243 @@
+"""
+Metrics for Setwise Web
+Counters, gauges and histograms in the Prometheus text format
+"""
+
+import functools
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from setwise_web.config import (
+    ACTIVE_SESSION_WINDOW, METRICS_FILE, METRICS_FLUSH_INTERVAL, METRICS_HOST, METRICS_PORT,
+    SETS_BUCKETS, STAGE_BUCKETS)
+from setwise_web.logs import _span_log, log
+
+
+class MetricsRegistry:
+    """Counters, gauges and histograms rendered in the Prometheus text format
+
+    Counters and histograms are updated as things happen. Gauges (and
+    counters kept by other components, such as cache hits) are read at
+    render time from the ``collect`` callbacks, each returning
+    ``(name, labels, value)`` tuples.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._buckets = {}
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+        self._sessions = {}
+
+    def describe(self, name, kind, description, buckets=None):
+        self._meta[name] = (kind, description)
+        if buckets is not None:
+            self._buckets[name] = tuple(buckets)
+
+    def collect(self, fn):
+        self._collectors.append(fn)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self._buckets[name]
+        with self._lock:
+            counts, total, count = self._histograms.get(key, ([0] * len(buckets), 0.0, 0))
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._histograms[key] = (counts, total + value, count + 1)
+
+    def session_seen(self, session_id):
+        with self._lock:
+            self._sessions[session_id] = time.time()
+
+    def active_sessions(self):
+        cutoff = time.time() - ACTIVE_SESSION_WINDOW
+        with self._lock:
+            for session_id in [s for s, seen in self._sessions.items() if seen < cutoff]:
+                del self._sessions[session_id]
+            return len(self._sessions)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = [*labels, *extra]
+        if not pairs:
+            return ""
+        escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+    def render(self):
+        samples = {}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                samples.setdefault(name, []).append(f"{name}{self._labels(labels)} {value}")
+            for (name, labels), (counts, total, count) in self._histograms.items():
+                lines = samples.setdefault(name, [])
+                for bound, n in zip(self._buckets[name], counts):
+                    lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {n}")
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{self._labels(labels)} {total:.6f}")
+                lines.append(f"{name}_count{self._labels(labels)} {count}")
+        for collector in self._collectors:
+            try:
+                for name, labels, value in collector():
+                    samples.setdefault(name, []).append(
+                        f"{name}{self._labels(sorted(labels.items()))} {value}")
+            except Exception:
+                log.exception("Metrics collector failed")
+        out = []
+        for name in sorted(samples):
+            kind, description = self._meta.get(name, ("untyped", ""))
+            out.append(f"# HELP {name} {description}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(samples[name])
+        return "\n".join(out) + "\n"
+
+    def serve(self, port, host=METRICS_HOST):
+        """Serve ``/metrics`` on ``host``:``port`` from a daemon thread"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="setwise-metrics", daemon=True).start()
+        return server
+
+    def start_flusher(self, path, interval=METRICS_FLUSH_INTERVAL):
+        """Rewrite ``path`` with the current metrics every ``interval`` seconds"""
+        path = Path(path)
+
+        def flush():
+            while True:
+                try:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    scratch = path.with_name(f".{path.name}.tmp")
+                    scratch.write_text(self.render(), encoding='utf-8')
+                    # Readers never see a half-written file
+                    os.replace(scratch, path)
+                except OSError as e:
+                    log.warning("Could not write metrics to %s: %s", path, e)
+                time.sleep(interval)
+
+        threading.Thread(target=flush, name="setwise-metrics-flush", daemon=True).start()
+
+
+class _SpanMetrics(logging.Handler):
+    """Feeds the span records written by ``log_span`` into a MetricsRegistry"""
+
+    def __init__(self, metrics):
+        super().__init__()
+        self.metrics = metrics
+
+    def emit(self, record):
+        span = record.fields
+        self.metrics.observe("setwise_web_stage_seconds", span['ms'] / 1000,
+                             stage=span['stage'], outcome=span['outcome'])
+        if span['stage'] == 'compile':
+            self.metrics.inc("setwise_web_compiles_total", template=span.get('template') or "unknown",
+                             outcome="ok" if span.get('ok') else "failed")
+        elif span['stage'] == 'render' and span.get('compile'):
+            # Sequential runs compile inside setwise: every set shares the run's outcome
+            self.metrics.inc("setwise_web_compiles_total", span.get('sets', 1),
+                             template=span.get('template') or "unknown",
+                             outcome="ok" if span.get('ok') else "failed")
+
+
+def _component_metrics(cache, figures, thumbnails, scheduler, artifacts, workspaces):
+    """Gauges and counters read from the shared caches, stores and queues"""
+    samples = []
+    cache = cache.stats()
+    samples += [("setwise_web_cache_hits_total", {'cache': 'quiz'}, cache['hits']),
+                ("setwise_web_cache_misses_total", {'cache': 'quiz'}, cache['misses'])]
+    if figures is not None:
+        figure_stats = figures.stats()
+        samples += [("setwise_web_cache_hits_total", {'cache': 'figure'}, figure_stats['hits']),
+                    ("setwise_web_cache_misses_total", {'cache': 'figure'}, figure_stats['builds'])]
+    if thumbnails is not None:
+        thumbnail_stats = thumbnails.stats()
+        samples += [("setwise_web_cache_hits_total", {'cache': 'thumbnail'}, thumbnail_stats['hits']),
+                    ("setwise_web_cache_misses_total", {'cache': 'thumbnail'}, thumbnail_stats['renders'])]
+    queue = scheduler.stats()
+    samples += [("setwise_web_compile_queue_depth", {}, queue['queue_depth']),
+                ("setwise_web_compiles_running", {}, queue['running'])]
+    artifacts = artifacts.stats()
+    samples += [("setwise_web_artifact_bytes", {}, artifacts['bytes']),
+                ("setwise_web_artifact_handles", {}, artifacts['handles'])]
+    work = workspaces.stats()
+    samples += [("setwise_web_workspaces_active", {}, work['active']),
+                ("setwise_web_workspace_bytes", {}, work['bytes'])]
+    samples += [("setwise_web_workspace_free_bytes", {'root': root}, free) for root, free in work['free'].items()]
+    return samples
+
+
+def create_metrics(cache, figures, thumbnails, scheduler, artifacts, workspaces):
+    """A registry describing every metric, fed by spans and the given components
+
+    Served on ``METRICS_HOST``:``METRICS_PORT`` and flushed to ``METRICS_FILE`` when those are set.
+    """
+    metrics = MetricsRegistry()
+    metrics.describe("setwise_web_stage_seconds", "histogram",
+                     "Duration of each generation stage", STAGE_BUCKETS)
+    metrics.describe("setwise_web_compiles_total", "counter", "pdflatex compiles by template and outcome")
+    metrics.describe("setwise_web_jobs_total", "counter", "Finished jobs by kind and outcome")
+    metrics.describe("setwise_web_job_seconds", "histogram",
+                     "Time from submitting a job to its result", STAGE_BUCKETS)
+    metrics.describe("setwise_web_job_queue_seconds", "histogram",
+                     "Time a job waited for a worker", STAGE_BUCKETS)
+    metrics.describe("setwise_web_sets_per_request", "histogram",
+                     "Quiz sets (PDFs) asked for per job", SETS_BUCKETS)
+    metrics.describe("setwise_web_cache_hits_total", "counter", "Cache hits by cache")
+    metrics.describe("setwise_web_cache_misses_total", "counter", "Cache misses (builds) by cache")
+    metrics.describe("setwise_web_compile_queue_depth", "gauge", "Compiles waiting for a slot")
+    metrics.describe("setwise_web_compiles_running", "gauge", "Compiles running now")
+    metrics.describe("setwise_web_artifact_bytes", "gauge", "Bytes held by the artifact store")
+    metrics.describe("setwise_web_artifact_handles", "gauge", "Results held by the artifact store")
+    metrics.describe("setwise_web_workspaces_active", "gauge", "Scratch directories in use")
+    metrics.describe("setwise_web_workspace_bytes", "gauge", "Bytes held by scratch directories")
+    metrics.describe("setwise_web_workspace_free_bytes", "gauge", "Free space on each scratch root")
+    metrics.describe("setwise_web_active_sessions", "gauge",
+                     f"Sessions seen in the last {ACTIVE_SESSION_WINDOW} seconds")
+    metrics.collect(functools.partial(
+        _component_metrics, cache, figures, thumbnails, scheduler, artifacts, workspaces
+    ))
+    metrics.collect(lambda: [("setwise_web_active_sessions", {}, metrics.active_sessions())])
+    
+    # Spans reach the registry from any thread through their own logger
+    for handler in list(_span_log.handlers):
+        _span_log.removeHandler(handler)
+    _span_log.addHandler(_SpanMetrics(metrics))
+    
+    if METRICS_PORT:
+        try:
+            metrics.serve(METRICS_PORT, METRICS_HOST)
+            log.info("Serving metrics on %s:%d", METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            log.warning("Could not serve metrics on %s:%d: %s", METRICS_HOST, METRICS_PORT, e)
+    if METRICS_FILE:
+        metrics.start_flusher(METRICS_FILE)
+    return metrics
@@ -0,0 +1,175 @@
+"""
+Page previews for Setwise Web
+PDF pages rasterized once on the server and cached as images
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from setwise_web.config import PDFINFO, PDFTOPPM, THUMBNAIL_TIMEOUT, THUMBNAIL_WIDTH
+from setwise_web.logs import log, log_span
+from setwise_web.storage import evict_lru
+
+
+# Pillow re-encodes page previews as WebP (PNG is served otherwise)
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+
+class ThumbnailCache:
+    """Server-side page images of compiled PDFs, keyed by the PDF's content hash
+
+    Pages are rasterized with poppler's ``pdftoppm`` on first request and
+    converted to WebP when Pillow is around, so a rerun ships a few small
+    images instead of whole PDFs. Files are touched on every hit and the
+    least recently used go first once the cache passes ``max_bytes``; page
+    counts are forgotten along with the last image of their PDF.
+    """
+
+    def __init__(self, root, max_bytes, width=THUMBNAIL_WIDTH):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.width = width
+        self.available = PDFTOPPM is not None
+        self.renders = 0
+        self.hits = 0
+        self._digests = OrderedDict()
+        self._page_counts = {}
+        self._lock = threading.Lock()
+        self._render_locks = {}
+
+    def digest(self, pdf_path):
+        """Content hash of a PDF, memoized per path, size and mtime"""
+        stat = os.stat(pdf_path)
+        memo_key = (str(pdf_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if memo_key in self._digests:
+                self._digests.move_to_end(memo_key)
+                return self._digests[memo_key]
+        sha = hashlib.sha256()
+        with open(pdf_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        with self._lock:
+            self._digests[memo_key] = digest
+            while len(self._digests) > 1024:
+                self._digests.popitem(last=False)
+        return digest
+
+    def page_count(self, pdf_path):
+        """Number of pages, or None when poppler cannot tell"""
+        digest = self.digest(pdf_path)
+        with self._lock:
+            if digest in self._page_counts:
+                return self._page_counts[digest]
+        count = None
+        if PDFINFO:
+            try:
+                proc = subprocess.run([PDFINFO, str(pdf_path)], capture_output=True, text=True,
+                                      timeout=THUMBNAIL_TIMEOUT)
+                match = re.search(r'^Pages:\s+(\d+)', proc.stdout, re.MULTILINE)
+                count = int(match.group(1)) if match else None
+            except (OSError, subprocess.TimeoutExpired):
+                count = None
+        with self._lock:
+            self._page_counts[digest] = count
+        return count
+
+    def page(self, pdf_path, page=1):
+        """Path of the image of ``page`` (1-based), rendering it if needed; None on failure"""
+        if not self.available:
+            return None
+        try:
+            digest = self.digest(pdf_path)
+        except OSError:
+            return None
+        stem = f"{digest[:32]}-p{page}-w{self.width}"
+        for suffix in ('.webp', '.png'):
+            cached = self.root / (stem + suffix)
+            if cached.exists():
+                try:
+                    os.utime(cached)
+                except OSError:
+                    continue
+                with self._lock:
+                    self.hits += 1
+                return cached
+        with self._lock:
+            render_lock = self._render_locks.setdefault(stem, threading.Lock())
+        try:
+            with render_lock:
+                for suffix in ('.webp', '.png'):
+                    if (self.root / (stem + suffix)).exists():
+                        return self.root / (stem + suffix)
+                with log_span("preview", page=page) as span:
+                    image = self._render(pdf_path, page, stem)
+                    span['ok'] = image is not None
+        finally:
+            with self._lock:
+                self._render_locks.pop(stem, None)
+        if image is not None:
+            self.evict()
+        return image
+
+    def _render(self, pdf_path, page, stem):
+        scratch = Path(tempfile.mkdtemp(prefix=f".{stem}-", dir=self.root))
+        try:
+            cmd = [PDFTOPPM, "-png", "-f", str(page), "-l", str(page), "-singlefile",
+                   "-scale-to-x", str(self.width), "-scale-to-y", "-1", str(pdf_path), str(scratch / "page")]
+            try:
+                proc = subprocess.run(cmd, capture_output=True, timeout=THUMBNAIL_TIMEOUT)
+            except (OSError, subprocess.TimeoutExpired) as e:
+                log.error("pdftoppm failed on %s: %s", pdf_path, e)
+                return None
+            png = scratch / "page.png"
+            if proc.returncode != 0 or not png.exists():
+                return None
+            image = png
+            if PIL_AVAILABLE:
+                try:
+                    with Image.open(png) as picture:
+                        picture.save(scratch / "page.webp", "WEBP", quality=80)
+                    image = scratch / "page.webp"
+                except (OSError, ValueError):
+                    image = png
+            target = self.root / (stem + image.suffix)
+            os.replace(image, target)
+            with self._lock:
+                self.renders += 1
+            return target
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    def evict(self):
+        """Drop least recently used images until the cache fits in ``max_bytes``"""
+        images = []
+        for image in self.root.iterdir():
+            if image.name.startswith('.'):
+                continue
+            try:
+                stat = image.stat()
+            except OSError:
+                continue
+            images.append((stat.st_mtime, stat.st_size, image))
+        kept = evict_lru(images, self.max_bytes, lambda image: image.unlink(missing_ok=True))
+        # Image names start with the first 32 hex digits of the PDF's digest
+        cached = {image.name[:32] for _, _, image in kept}
+        with self._lock:
+            self._page_counts = {digest: count for digest, count in self._page_counts.items()
+                                 if digest[:32] in cached}
+
+    def stats(self):
+        with self._lock:
+            return {'renders': self.renders, 'hits': self.hits}
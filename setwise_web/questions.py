@@ -0,0 +1,643 @@
+"""
+Question files for Setwise Web
+Sandboxed parsing of question files and the memo of parsed models
+"""
+
+import ast
+import hashlib
+import json
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+
+import jinja2
+import jinja2.meta
+
+from setwise_web.config import PARSE_CPU_SECONDS, PARSE_MEMORY_MB, PARSE_TIMEOUT
+from setwise_web.logs import log
+
+# Start of every child process that runs user content: CPU and memory limits
+_SANDBOX_LIMITS = """
+import json, sys
+limits = json.loads(sys.argv[1])
+try:
+    import resource
+    resource.setrlimit(resource.RLIMIT_CPU, (limits["cpu"], limits["cpu"]))
+    memory = limits["memory_mb"] * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+except (ImportError, ValueError, OSError):
+    pass
+"""
+
+# Runs in the child process: executes the file under the limits and prints
+# its questions, as plain data, on one JSON line
+_PARSE_WORKER = _SANDBOX_LIMITS + """
+def plain(value):
+    # Only plain data may leave the sandbox
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, dict):
+        return {str(k): plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [plain(v) for v in value]
+    for cast in (int, float):
+        try:
+            if cast(value) == value:
+                return cast(value)
+        except Exception:
+            pass
+    return str(value)
+
+source = sys.stdin.read()
+namespace = {}
+try:
+    exec(compile(source, "<questions>", "exec"), namespace)
+    data = {name: plain(namespace[name]) for name in ("mcq", "subjective", "quiz_metadata") if name in namespace}
+    print(json.dumps({"ok": True, "data": data}))
+except SyntaxError as e:
+    print(json.dumps({"ok": False, "kind": "syntax", "message": str(e)}))
+except MemoryError:
+    print(json.dumps({"ok": False, "kind": "limit", "message": "question file exceeded the memory limit"}))
+except BaseException as e:
+    print(json.dumps({"ok": False, "kind": "format", "message": f"{type(e).__name__}: {e}"}))
+"""
+
+
+# Runs in the child process: renders [text, values] pairs with Jinja's
+# sandbox and prints the results (null where rendering failed) as one JSON line
+_RENDER_WORKER = _SANDBOX_LIMITS + """
+from jinja2.sandbox import SandboxedEnvironment
+env = SandboxedEnvironment()
+rendered = []
+for text, values in json.loads(sys.stdin.read()):
+    try:
+        rendered.append(env.from_string(text).render(**values))
+    except BaseException:
+        rendered.append(None)
+print(json.dumps(rendered))
+"""
+
+
+def _run_sandboxed(worker, stdin):
+    """Run a worker script under the parse limits; raises subprocess.TimeoutExpired"""
+    limits = {'cpu': PARSE_CPU_SECONDS, 'memory_mb': PARSE_MEMORY_MB}
+    return subprocess.run(
+        [sys.executable, "-I", "-c", worker, json.dumps(limits)],
+        input=stdin, capture_output=True, text=True, timeout=PARSE_TIMEOUT,
+        cwd=tempfile.gettempdir()
+    )
+
+
+class QuestionParseError(Exception):
+    """A question file that could not be executed; ``kind`` is syntax, format or limit"""
+
+    def __init__(self, kind, message):
+        super().__init__(message)
+        self.kind = kind
+
+
+def parse_questions_sandboxed(questions_text):
+    """Execute a question file in a resource-limited child process
+
+    Returns a dict with whichever of ``mcq``, ``subjective`` and
+    ``quiz_metadata`` the file defines, converted to plain data. Raises
+    QuestionParseError when the file fails to run or hits a limit.
+    """
+    try:
+        proc = _run_sandboxed(_PARSE_WORKER, questions_text)
+    except subprocess.TimeoutExpired:
+        raise QuestionParseError("limit", f"question file did not finish within {PARSE_TIMEOUT:g}s")
+    try:
+        outcome = json.loads(proc.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        # Killed by the CPU or memory limit before it could report
+        raise QuestionParseError("limit", f"question file was stopped (exit code {proc.returncode}) - "
+                                          f"check for infinite loops or huge allocations")
+    if not outcome['ok']:
+        raise QuestionParseError(outcome['kind'], outcome['message'])
+    return outcome['data']
+
+
+class QuestionModelCache:
+    """Parsed question models memoized by content hash
+
+    Parsing means running the file in the sandbox, which costs a process
+    spawn, so the validate button, draft previews and full generations of
+    the same text share one parse. Models are treated as read-only.
+    """
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, questions_text):
+        """Return the model for ``questions_text``, parsing it on first use
+
+        Raises QuestionParseError; failures are not memoized.
+        """
+        digest = hashlib.sha256(questions_text.encode('utf-8')).hexdigest()
+        with self._lock:
+            if digest in self._models:
+                self._models.move_to_end(digest)
+                return self._models[digest]
+        model = parse_questions_sandboxed(questions_text)
+        with self._lock:
+            self._models[digest] = model
+            while len(self._models) > self.max_entries:
+                self._models.popitem(last=False)
+        return model
+
+    def put(self, questions_text, model):
+        """Record a model derived from an already parsed one, skipping the sandbox"""
+        digest = hashlib.sha256(questions_text.encode('utf-8')).hexdigest()
+        with self._lock:
+            self._models[digest] = model
+            self._models.move_to_end(digest)
+            while len(self._models) > self.max_entries:
+                self._models.popitem(last=False)
+
+
+# Jinja2 parses templated questions for validation; they only ever render in
+# the sandbox, see render_templates_sandboxed
+_JINJA_ENV = jinja2.Environment()
+
+
+def merge_header_config(quiz_metadata, header_config):
+    """Overlay the header fields from the UI onto the file's quiz_metadata
+
+    Only fields the user filled in are replaced; everything else the file
+    defines (instructions, total marks, ...) is kept.
+    """
+    metadata = dict(quiz_metadata or {})
+    header_config = header_config or {}
+    for field, key in (('title', 'title'), ('subject', 'subject'), ('exam_info', 'duration')):
+        if header_config.get(field):
+            metadata[key] = header_config[field]
+    if metadata:
+        metadata.setdefault('total_marks', 100)
+    return metadata
+
+
+def render_questions_module(model, quiz_metadata):
+    """Serialize a question model as the Python module setwise expects"""
+    lines = ["# Generated by setwise-web from the parsed question model"]
+    if quiz_metadata:
+        lines.append(f"quiz_metadata = {quiz_metadata!r}")
+    lines.append(f"mcq = {model.get('mcq', [])!r}")
+    lines.append(f"subjective = {model.get('subjective', [])!r}")
+    return "\n\n".join(lines) + "\n"
+
+
+# LaTeX that either escapes the document sandbox or cannot appear inside a question
+_RISKY_LATEX = {
+    'write18': "shell escape is disabled on the server",
+    'input': "files cannot be read from inside a question",
+    'include': "files cannot be read from inside a question",
+    'openin': "files cannot be read from inside a question",
+    'openout': "files cannot be written from inside a question",
+    'immediate': "low-level file I/O is not allowed in questions",
+    'catcode': "changing category codes breaks the rest of the document",
+    'documentclass': "only valid in the preamble, which the template provides",
+    'usepackage': "only valid in the preamble, which the template provides",
+    'begin{document}': "the template already starts the document",
+    'end{document}': "would end the document early",
+}
+_RISKY_LATEX_PATTERN = re.compile(
+    r'\\(' + '|'.join(re.escape(command) for command in _RISKY_LATEX) + r')(?![A-Za-z])'
+)
+_TEMPLATE_EXPR = re.compile(r'\{\{(.*?)\}\}', re.DOTALL)
+
+
+def _template_names(text):
+    """Variables a template in ``text`` needs from outside
+
+    Names it sets itself (``{% set %}``, loop variables) and Jinja's
+    globals are left out. Raises ValueError for a template Jinja cannot
+    parse.
+    """
+    try:
+        names = jinja2.meta.find_undeclared_variables(_JINJA_ENV.parse(text))
+    except jinja2.TemplateSyntaxError as e:
+        raise ValueError(f"template syntax error on line {e.lineno}: {e.message}")
+    return {name for name in names if name not in _JINJA_ENV.globals}
+
+
+def question_lines(questions_text):
+    """Map (section, index) and (section, index, field) to source line numbers
+
+    Uses the syntax tree only - nothing is executed here.
+    """
+    lines = {}
+    try:
+        tree = ast.parse(questions_text)
+    except SyntaxError:
+        return lines
+    for node in tree.body:
+        if not (isinstance(node, ast.Assign) and isinstance(node.value, ast.List)):
+            continue
+        for target in node.targets:
+            if not (isinstance(target, ast.Name) and target.id in ('mcq', 'subjective')):
+                continue
+            for index, element in enumerate(node.value.elts, start=1):
+                lines[(target.id, index)] = element.lineno
+                if isinstance(element, ast.Dict):
+                    for key in element.keys:
+                        if isinstance(key, ast.Constant):
+                            lines[(target.id, index, key.value)] = key.lineno
+    return lines
+
+
+def validate_question_model(model, questions_text=""):
+    """Check every MCQ and subjective entry before any LaTeX runs
+
+    Returns a list of diagnostics, each a dict with ``severity`` ("error" or
+    "warning"), ``section``, 1-based ``index``, ``field``, source ``line``
+    (None when it cannot be located) and ``message``.
+    """
+    lines = question_lines(questions_text)
+    diagnostics = []
+
+    def report(severity, section, index, field, message):
+        line = lines.get((section, index, field)) or lines.get((section, index))
+        diagnostics.append({'severity': severity, 'section': section, 'index': index,
+                            'field': field, 'line': line, 'message': message})
+
+    def check_marks(section, index, field, marks):
+        if isinstance(marks, bool) or not isinstance(marks, (int, float)):
+            report('error', section, index, field, f"marks must be a number, got {marks!r}")
+        elif marks < 0:
+            report('error', section, index, field, "marks cannot be negative")
+
+    def check_latex(section, index, field, text):
+        for match in _RISKY_LATEX_PATTERN.finditer(text):
+            report('error', section, index, field,
+                   f"\\{match.group(1)} is not allowed: {_RISKY_LATEX[match.group(1)]}")
+
+    def check_entry(section, index, entry, text_fields):
+        texts = {}
+        for field in text_fields:
+            value = entry.get(field)
+            if isinstance(value, str):
+                texts[field] = value
+            elif isinstance(value, list):
+                texts.update({f"{field}[{n}]": v for n, v in enumerate(value) if isinstance(v, str)})
+        parts = entry.get('parts')
+        for n, part in enumerate(parts if isinstance(parts, list) else []):
+            if isinstance(part, dict):
+                texts.update({f"parts[{n}].{field}": part[field] for field in ('question', 'answer')
+                              if isinstance(part.get(field), str)})
+        for name, text in texts.items():
+            check_latex(section, index, name.split('[')[0], text)
+
+        used = {}
+        for name, text in texts.items():
+            if 'template' not in entry and '{{' not in text and '{%' not in text:
+                # Plain LaTeX like {#1} is not Jinja unless the question is templated
+                continue
+            try:
+                found = _template_names(text)
+            except ValueError as e:
+                # Only templated questions go through Jinja; elsewhere {{ is likely plain LaTeX
+                severity = 'error' if 'template' in entry else 'warning'
+                report(severity, section, index, name.split('[')[0], str(e))
+                continue
+            for variable in found:
+                used.setdefault(variable, name.split('[')[0])
+        variables = entry.get('variables')
+        if 'template' in entry:
+            if not isinstance(variables, list) or not variables:
+                report('error', section, index, 'variables',
+                       "templated question needs a non-empty 'variables' list")
+                return
+            for n, values in enumerate(variables, start=1):
+                if not isinstance(values, dict):
+                    report('error', section, index, 'variables', f"variables entry {n} must be a dict")
+                    continue
+                for variable, field in sorted(used.items()):
+                    if variable not in values:
+                        report('error', section, index, field,
+                               f"'{{{{ {variable} }}}}' is not defined in variables entry {n}")
+        elif used:
+            report('warning', section, index, sorted(used.values())[0],
+                   "uses {{ }} placeholders but is not a templated question (use 'template' and 'variables')")
+
+    for index, entry in enumerate(model.get('mcq') or [], start=1):
+        if not isinstance(entry, dict):
+            report('error', 'mcq', index, None, "each MCQ must be a dict")
+            continue
+        if 'question' not in entry and 'template' not in entry:
+            report('error', 'mcq', index, None, "needs a 'question' or 'template' field")
+        options = entry.get('options')
+        if not isinstance(options, list) or len(options) < 2:
+            report('error', 'mcq', index, 'options', "needs an 'options' list with at least two choices")
+        elif 'answer' not in entry:
+            report('error', 'mcq', index, None, "needs an 'answer' field")
+        elif entry['answer'] not in options:
+            report('error', 'mcq', index, 'answer', f"answer {entry['answer']!r} is not one of the options")
+        elif len(set(map(str, options))) != len(options):
+            report('warning', 'mcq', index, 'options', "options contain duplicates")
+        check_marks('mcq', index, 'marks', entry.get('marks', 1))
+        check_entry('mcq', index, entry, ('question', 'template', 'options', 'answer'))
+
+    for index, entry in enumerate(model.get('subjective') or [], start=1):
+        if not isinstance(entry, dict):
+            report('error', 'subjective', index, None, "each subjective question must be a dict")
+            continue
+        if 'question' not in entry and 'template' not in entry:
+            report('error', 'subjective', index, None, "needs a 'question' or 'template' field")
+        check_marks('subjective', index, 'marks', entry.get('marks', 1))
+        parts = entry.get('parts')
+        if parts is not None:
+            if not isinstance(parts, list) or not parts:
+                report('error', 'subjective', index, 'parts', "'parts' must be a non-empty list")
+                parts = []
+            for n, part in enumerate(parts, start=1):
+                if not isinstance(part, dict) or 'question' not in part:
+                    report('error', 'subjective', index, 'parts', f"part {n} needs a 'question' field")
+                    continue
+                check_marks('subjective', index, 'parts', part.get('marks', 1))
+        check_entry('subjective', index, entry, ('question', 'template', 'answer'))
+
+    return diagnostics
+
+
+_MATH_ENVS = {
+    'equation', 'equation*', 'align', 'align*', 'gather', 'gather*', 'multline', 'multline*',
+    'eqnarray', 'eqnarray*', 'displaymath', 'math',
+}
+_ALIGNMENT_ENVS = {
+    'tabular', 'tabular*', 'tabularx', 'longtable', 'array', 'matrix', 'pmatrix', 'bmatrix',
+    'vmatrix', 'Vmatrix', 'smallmatrix', 'cases', 'align', 'align*', 'aligned', 'alignat',
+    'split', 'eqnarray', 'eqnarray*',
+}
+# Drawing environments and chemistry/unit macros have their own syntax for _ and &
+_FREEFORM_ENVS = {'tikzpicture', 'circuitikz', 'axis', 'chemfig'}
+_FREEFORM_COMMANDS = {'ce', 'chemfig', 'SI', 'si', 'qty', 'unit', 'draw', 'node'}
+# Labels, keys and file names may contain _ and the like; their argument is not checked
+_OPAQUE_ARGUMENT_COMMANDS = {
+    'label', 'ref', 'eqref', 'pageref', 'autoref', 'nameref', 'cref', 'Cref', 'cite', 'url', 'href',
+    'hyperref', 'includegraphics', 'input', 'include', 'lstinputlisting', 'inputminted',
+}
+# Environments whose body LaTeX does not parse
+_VERBATIM_ENVS = {'verbatim', 'verbatim*', 'Verbatim', 'lstlisting', 'minted', 'comment'}
+_VERBATIM_COMMANDS = {'verb', 'lstinline', 'mintinline'}
+
+
+def _argument_end(text, position):
+    """End of the optional ``[...]`` and braced argument at ``position``, or None"""
+    while position < len(text) and text[position].isspace():
+        position += 1
+    if text.startswith('[', position):
+        close = text.find(']', position)
+        if close < 0:
+            return None
+        position = close + 1
+    if not text.startswith('{', position):
+        return None
+    depth = 0
+    for i in range(position, len(text)):
+        if text[i] == '{' and text[i - 1] != '\\':
+            depth += 1
+        elif text[i] == '}' and text[i - 1] != '\\':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return None
+
+
+def _verbatim_end(text, name, position):
+    """End of an inline verbatim command's argument starting at ``position``, or None"""
+    if name == 'mintinline':
+        # \mintinline{language}|code| or \mintinline{language}{code}
+        position = _argument_end(text, position)
+        if position is None:
+            return None
+    elif text.startswith('[', position):
+        close = text.find(']', position)
+        if close < 0:
+            return None
+        position = close + 1
+    if position >= len(text):
+        return None
+    if text[position] == '{' and name != 'verb':
+        return _argument_end(text, position)
+    close = text.find(text[position], position + 1)
+    return None if close < 0 else close + 1
+
+
+def lint_latex_fragment(text):
+    """Cheap static check of one rendered question fragment
+
+    Returns ``(severity, message)`` pairs for unbalanced environments,
+    braces and math delimiters, and for ``%``/``&``/``_``/``^`` used where
+    LaTeX would reject or swallow them. Verbatim text and the arguments of
+    label, reference and file commands are not checked. Each kind of
+    problem is reported once per fragment.
+    """
+    problems = []
+    envs = []
+    braces = 0
+    math = None
+    freeform_depth = None
+    i = 0
+    
+    def flag(severity, message):
+        if (severity, message) not in problems:
+            problems.append((severity, message))
+    
+    while i < len(text):
+        char = text[i]
+        if char == '\\':
+            env = re.match(r'\\(begin|end)\s*\{([^}]*)\}', text[i:])
+            if env:
+                name = env.group(2)
+                if env.group(1) == 'begin' and name in _VERBATIM_ENVS:
+                    close = text.find(f"\\end{{{name}}}", i + env.end())
+                    if close < 0:
+                        flag('error', f"\\begin{{{name}}} is never closed")
+                        break
+                    i = close + len(f"\\end{{{name}}}")
+                    continue
+                if env.group(1) == 'begin':
+                    envs.append(name)
+                    if name in _MATH_ENVS and math is None:
+                        math = name
+                elif not envs:
+                    flag('error', f"\\end{{{name}}} has no matching \\begin{{{name}}}")
+                else:
+                    opened = envs.pop()
+                    if opened != name:
+                        flag('error', f"\\begin{{{opened}}} is closed by \\end{{{name}}}")
+                    if math in (opened, name):
+                        math = None
+                i += env.end()
+                continue
+            command = re.match(r'\\([A-Za-z]+|.)', text[i:])
+            name = command.group(1) if command else ''
+            if name in ('(', '['):
+                if math is None:
+                    math = name
+            elif name in (')', ']'):
+                if math == {')': '(', ']': '['}[name]:
+                    math = None
+                else:
+                    flag('error', f"\\{name} closes math mode that was never opened")
+            elif name in _OPAQUE_ARGUMENT_COMMANDS or name in _VERBATIM_COMMANDS:
+                start = i + len(command.group(0))
+                if name in _VERBATIM_COMMANDS:
+                    end = _verbatim_end(text, name, start)
+                else:
+                    end = _argument_end(text, start)
+                if end is not None:
+                    i = end
+                    continue
+            elif name in _FREEFORM_COMMANDS and freeform_depth is None:
+                freeform_depth = braces
+            i += len(command.group(0)) if command else 1
+            continue
+        
+        freeform = freeform_depth is not None or any(env in _FREEFORM_ENVS for env in envs)
+        if char == '%':
+            flag('warning', "unescaped % comments out the rest of the line - write \\%")
+            newline = text.find('\n', i)
+            i = len(text) if newline == -1 else newline
+            continue
+        if char == '{':
+            braces += 1
+        elif char == '}':
+            braces -= 1
+            if braces < 0:
+                flag('error', "'}' without a matching '{'")
+                braces = 0
+            if freeform_depth is not None and braces <= freeform_depth:
+                freeform_depth = None
+        elif char == '$':
+            delimiter = '$$' if text.startswith('$$', i) else '$'
+            if math is None:
+                math = delimiter
+            elif math == delimiter:
+                math = None
+            else:
+                flag('error', f"{delimiter} inside math mode opened with {math}")
+            i += len(delimiter)
+            continue
+        elif char in '_^' and math is None and not freeform:
+            flag('error', f"{char} outside math mode - write \\{char} or wrap it in $...$")
+        elif char == '&' and not freeform and not any(env in _ALIGNMENT_ENVS for env in envs):
+            flag('error', "& outside a table or matrix - write \\&")
+        elif char == ' ' and freeform_depth is not None and braces == freeform_depth:
+            # A freeform macro without a braced argument (e.g. \draw ... ;) ends here
+            freeform_depth = None
+        i += 1
+    
+    if braces:
+        flag('error', f"{braces} '{{' never closed")
+    for name in envs:
+        flag('error', f"\\begin{{{name}}} is never closed")
+    if math in ('$', '$$', '(', '['):
+        opener = math if math.startswith('$') else f"\\{math}"
+        flag('error', f"math mode opened with {opener} is never closed")
+    return problems
+
+
+def _template_fragments(entry, fields):
+    """Yield (field, label, text, values) for every text field of an entry and each of its variable sets"""
+    variables = entry.get('variables') if 'template' in entry else None
+    bindings = variables if isinstance(variables, list) and variables else [None]
+    for n, values in enumerate(bindings, start=1):
+        label = f" (variables entry {n})" if values is not None else ""
+        for field in fields:
+            value = entry.get(field)
+            texts = value if isinstance(value, list) else [value]
+            for text in texts:
+                if isinstance(text, str):
+                    yield field, label, text, values if isinstance(values, dict) else {}
+
+
+def render_templates_sandboxed(templates):
+    """Render ``(text, values)`` pairs the way setwise does, in a resource-limited child process
+
+    Templates are user code - Jinja can reach Python internals and loop or
+    allocate without bound - so they never render in the server process.
+    Returns one string per pair; placeholders of a template that fails to
+    render (or of every template, when the child is stopped) become 1.
+    """
+    fallback = [_TEMPLATE_EXPR.sub('1', text) for text, _ in templates]
+    pending = [i for i, (text, _) in enumerate(templates) if '{{' in text or '{%' in text]
+    if not pending:
+        return fallback
+    try:
+        proc = _run_sandboxed(_RENDER_WORKER, json.dumps([templates[i] for i in pending]))
+        rendered = json.loads(proc.stdout.strip().splitlines()[-1])
+    except (subprocess.TimeoutExpired, IndexError, ValueError):
+        log.info("Template rendering for lint was stopped - linting the raw templates")
+        return fallback
+    for i, text in zip(pending, rendered):
+        if text is not None:
+            fallback[i] = text
+    return fallback
+
+
+def lint_question_model(model, questions_text=""):
+    """Run ``lint_latex_fragment`` over every rendered question, option, answer and part
+
+    Returns diagnostics in the same shape as ``validate_question_model``.
+    """
+    lines = question_lines(questions_text)
+    diagnostics = []
+    sections = (
+        ('mcq', ('question', 'template', 'options', 'answer')),
+        ('subjective', ('question', 'template', 'answer')),
+    )
+    questions = []
+    for section, fields in sections:
+        for index, entry in enumerate(model.get(section) or [], start=1):
+            if not isinstance(entry, dict):
+                continue
+            fragments = list(_template_fragments(entry, fields))
+            for part in entry.get('parts') or []:
+                if isinstance(part, dict):
+                    fragments += [('parts', label, text, values)
+                                  for _, label, text, values in _template_fragments(part, ('question', 'answer'))]
+            questions.append((section, index, fragments))
+    # Every template of the model renders in one child process
+    rendered = iter(render_templates_sandboxed([(text, values) for *_, fragments in questions
+                                                for _, _, text, values in fragments]))
+    for section, index, fragments in questions:
+        seen = set()
+        for field, label, _, _ in fragments:
+            text = next(rendered)
+            for severity, message in lint_latex_fragment(text):
+                if (field, message) in seen:
+                    continue
+                seen.add((field, message))
+                diagnostics.append({
+                    'severity': severity, 'section': section, 'index': index, 'field': field,
+                    'line': lines.get((section, index, field)) or lines.get((section, index)),
+                    'message': f"LaTeX: {message}{label}",
+                })
+    return diagnostics
+
+
+def describe_question(diagnostic):
+    """'MCQ 2', 'Subjective 1' or 'Template' for diagnostics outside any question"""
+    if diagnostic['section'] is None:
+        return "Template"
+    section = "MCQ" if diagnostic['section'] == 'mcq' else "Subjective"
+    return f"{section} {diagnostic['index']}"
+
+
+def format_diagnostics(diagnostics):
+    """One line per diagnostic, e.g. ``line 12 · MCQ 2 · answer: ...``"""
+    formatted = []
+    for d in diagnostics:
+        where = f"Set {d['set']} · " if d.get('set') else ""
+        where += f"line {d['line']} · " if d['line'] else ""
+        field = f" · {d['field']}" if d['field'] else ""
+        context = f" [{d['context']}]" if d.get('context') else ""
+        formatted.append(f"{d['severity'].upper()}: {where}{describe_question(d)}{field}: {d['message']}{context}")
+    return "\n".join(formatted)
@@ -0,0 +1,173 @@
+"""
+Compile scheduling for Setwise Web
+Fair sharing of the server's pdflatex slots between sessions
+"""
+
+import functools
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from setwise_web.config import COMPILE_TIMEOUT, COMPILE_WORKERS
+from setwise_web.latex import compile_tex
+from setwise_web.logs import bind_request, current_request_id, log, log_span
+
+
+class JobCancelled(CancelledError):
+    """Raised from a job's progress callback once the job has been superseded
+
+    A CancelledError, like a compile dropped from the queue, so both are
+    handled (and timed) the same way.
+    """
+
+
+class CompileScheduler:
+    """Server-wide admission control for LaTeX compiles
+
+    At most ``max_concurrent`` compiles run at once no matter how many
+    sessions ask for them. Waiting work is queued per session and dispatched
+    round-robin, so one user's 5-set request cannot starve everyone queued
+    behind it. Every task remembers the request that queued it, so a
+    cancelled request's waiting compiles can be withdrawn in one go.
+    """
+
+    def __init__(self, max_concurrent=COMPILE_WORKERS):
+        self.max_concurrent = max_concurrent
+        self._queues = OrderedDict()
+        self._cond = threading.Condition()
+        self._running = 0
+        self._completed = 0
+        self._wait_times = deque(maxlen=500)
+        for n in range(max_concurrent):
+            threading.Thread(target=self._worker, name=f"setwise-compile-{n}", daemon=True).start()
+
+    def submit(self, session_id, fn, *args):
+        """Queue ``fn(*args)`` on behalf of ``session_id`` and return its Future"""
+        future = Future()
+        task = (future, bind_request(fn), args, time.time(), current_request_id())
+        with self._cond:
+            self._queues.setdefault(session_id, deque()).append(task)
+            self._cond.notify()
+        return future
+
+    def cancel(self, request_id):
+        """Withdraw every queued compile of ``request_id`` and return how many were dropped
+
+        Their futures are cancelled, so whoever waits on them gets a
+        ``CancelledError`` straight away. Compiles already running finish.
+        """
+        dropped = []
+        with self._cond:
+            for session_id, queue in list(self._queues.items()):
+                kept = deque(task for task in queue if task[4] != request_id)
+                dropped.extend(task[0] for task in queue if task[4] == request_id)
+                if kept:
+                    self._queues[session_id] = kept
+                else:
+                    del self._queues[session_id]
+        for future in dropped:
+            future.cancel()
+        if dropped:
+            log.debug("Withdrew %d queued compile(s)", len(dropped))
+        return len(dropped)
+
+    def position(self, session_id):
+        """1-based dispatch position of the session's next compile, or None if nothing is waiting"""
+        with self._cond:
+            # Round-robin serves the head of every queue in order before any second task
+            for position, queued_session in enumerate(self._queues, start=1):
+                if queued_session == session_id:
+                    return position
+        return None
+
+    def stats(self):
+        with self._cond:
+            waits = list(self._wait_times)
+            return {
+                'queue_depth': sum(len(q) for q in self._queues.values()),
+                'queued_sessions': len(self._queues),
+                'running': self._running,
+                'max_concurrent': self.max_concurrent,
+                'completed': self._completed,
+                'avg_wait': sum(waits) / len(waits) if waits else 0.0,
+                'max_wait': max(waits) if waits else 0.0,
+            }
+
+    def _next_task(self):
+        session_id, queue = self._queues.popitem(last=False)
+        task = queue.popleft()
+        if queue:
+            # Back of the line until every other session has had a turn
+            self._queues[session_id] = queue
+        return task
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queues:
+                    self._cond.wait()
+                future, fn, args, enqueued, _ = self._next_task()
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self._wait_times.append(time.time() - enqueued)
+                self._running += 1
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._completed += 1
+
+
+def compile_set(tex_path, *args, template=None):
+    """``compile_tex`` timed as one "compile" span"""
+    with log_span("compile", file=Path(tex_path).name, template=template) as span:
+        span['ok'] = compile_tex(tex_path, *args)
+    return span['ok']
+
+
+def compile_quiz_sets(output_dir, num_sets, texinputs=None, scheduler=None, session_id=None,
+                      on_compiled=None, only=None, formats=None, figures=None, template=None):
+    """Compile every rendered quiz_set_{i}.tex concurrently
+
+    Compiles go through the shared ``scheduler`` when one is given; otherwise
+    a private pool bounded by ``COMPILE_WORKERS`` is used. ``only`` restricts
+    the run to the given set numbers. ``on_compiled(i, ok)`` is called as each
+    set finishes. ``template`` only labels the compile spans. Returns the set
+    numbers that compiled successfully.
+    """
+    set_numbers = only if only is not None else range(1, num_sets + 1)
+    tex_paths = {i: Path(output_dir) / f'quiz_set_{i}.tex' for i in set_numbers}
+    tex_paths = {i: path for i, path in tex_paths.items() if path.exists()}
+    compiled = []
+    if not tex_paths:
+        return compiled
+    pool = None
+    futures = {}
+    if scheduler is not None:
+        submit = lambda *args: scheduler.submit(session_id, *args)
+    else:
+        pool = ThreadPoolExecutor(max_workers=max(1, min(COMPILE_WORKERS, len(tex_paths))))
+        submit = lambda fn, *args: pool.submit(bind_request(fn), *args)
+    try:
+        futures = {submit(functools.partial(compile_set, template=template),
+                          path, texinputs, COMPILE_TIMEOUT, formats, figures): i
+                   for i, path in tex_paths.items()}
+        for future in as_completed(futures):
+            i = futures[future]
+            ok = future.result()
+            if on_compiled:
+                on_compiled(i, ok)
+            if ok:
+                compiled.append(i)
+    finally:
+        # Pending compiles are pointless once the caller stops waiting (e.g. job cancelled)
+        for future in futures:
+            future.cancel()
+        if pool is not None:
+            pool.shutdown()
+    return sorted(compiled)
@@ -0,0 +1,458 @@
+"""
+Storage for Setwise Web
+The compiled-set cache, the artifact store and per-job scratch directories
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from setwise_web.config import SETWISE_VERSION, STORAGE_STATS_TTL
+from setwise_web.logs import log, log_span
+
+
+def link_or_copy(src, dst):
+    """Hardlink ``src`` to ``dst`` so no bytes are copied, falling back to a copy across filesystems"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def evict_lru(entries, max_bytes, remove):
+    """Remove the oldest ``(mtime, size, path)`` entries until the rest fit in ``max_bytes``
+
+    ``remove(path)`` deletes one entry. Returns the entries kept, oldest first.
+    """
+    entries = sorted(entries, key=lambda e: e[0])
+    total = sum(size for _, size, _ in entries)
+    for n, (_, size, path) in enumerate(entries):
+        if total <= max_bytes:
+            return entries[n:]
+        remove(path)
+        total -= size
+    return []
+
+
+class QuizCache:
+    """Content-addressed on-disk cache of compiled quiz sets with LRU eviction
+
+    Each entry is a directory named by its key holding the PDF/TEX/answer-key
+    files of every set plus a ``manifest.json``. Entries are written to a
+    scratch directory and renamed into place, so concurrent writers (other
+    sessions or other server processes) never observe a half-written entry.
+    The directory mtime is bumped on every hit and serves as the LRU clock.
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, root, max_bytes):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, output_dir):
+        """Return the cached quiz sets for ``key`` or None on a miss
+
+        A hit's files are linked into ``output_dir``, so the returned sets
+        stay valid even if the entry is evicted while they are in use. Sets
+        carry file paths, not bytes.
+        """
+        entry = self.root / key
+        linked = []
+        try:
+            manifest = json.loads((entry / self.MANIFEST).read_text())
+            quiz_sets = []
+            for item in manifest['sets']:
+                paths = {}
+                for field in ('pdf', 'tex', 'answer'):
+                    paths[field] = os.path.join(output_dir, item[field])
+                    link_or_copy(entry / item[field], paths[field])
+                    linked.append(paths[field])
+                quiz_sets.append({
+                    'name': item['name'],
+                    'tex_hash': tex_digest(Path(paths['tex']).read_text(encoding='utf-8')),
+                    'pdf_path': paths['pdf'],
+                    'tex_path': paths['tex'],
+                    'answer_path': paths['answer'],
+                })
+            os.utime(entry)
+        except (OSError, ValueError, KeyError):
+            # An entry evicted mid-read must not leave stale files for the real run
+            for path in linked:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return quiz_sets
+
+    def put(self, key, quiz_sets):
+        """Store ``quiz_sets`` under ``key`` and evict old entries past the size cap"""
+        entry = self.root / key
+        scratch = self.root / f".{key}.{uuid.uuid4().hex}.tmp"
+        scratch.mkdir()
+        try:
+            items = []
+            size = 0
+            for i, quiz_set in enumerate(quiz_sets, start=1):
+                item = {
+                    'name': quiz_set['name'],
+                    'pdf': f'quiz_set_{i}.pdf',
+                    'tex': f'quiz_set_{i}.tex',
+                    'answer': f'answer_key_{i}.txt',
+                }
+                # Entries share the output's inodes where possible instead of copying bytes
+                for field, path_key in (('pdf', 'pdf_path'), ('tex', 'tex_path'), ('answer', 'answer_path')):
+                    if quiz_set.get(path_key):
+                        link_or_copy(quiz_set[path_key], scratch / item[field])
+                    else:
+                        (scratch / item[field]).write_text("", encoding='utf-8')
+                size += sum((scratch / item[k]).stat().st_size for k in ('pdf', 'tex', 'answer'))
+                items.append(item)
+            (scratch / self.MANIFEST).write_text(json.dumps({'sets': items, 'bytes': size}))
+            os.rename(scratch, entry)
+        except OSError:
+            # Another writer got there first (or the disk is full) - keep theirs
+            shutil.rmtree(scratch, ignore_errors=True)
+            return
+        self.evict()
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in ``max_bytes``"""
+        entries = []
+        for entry in self.root.iterdir():
+            if entry.name.startswith('.'):
+                continue
+            try:
+                size = json.loads((entry / self.MANIFEST).read_text())['bytes']
+                mtime = entry.stat().st_mtime
+            except (OSError, ValueError, KeyError):
+                continue
+            entries.append((mtime, size, entry))
+        kept = evict_lru(entries, self.max_bytes, lambda entry: shutil.rmtree(entry, ignore_errors=True))
+        with self._lock:
+            self.evictions += len(entries) - len(kept)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+def tex_digest(tex_data):
+    return hashlib.sha256(tex_data.encode('utf-8')).hexdigest()
+
+
+def quiz_cache_key(questions_text, template, num_sets, header_config, seed):
+    """Hash every input that influences the compiled output"""
+    # Trailing whitespace and surrounding blank lines never change the quiz
+    normalized = "\n".join(line.rstrip() for line in questions_text.strip().splitlines())
+    payload = json.dumps({
+        'questions': normalized,
+        'template': template,
+        'num_sets': num_sets,
+        'header_config': header_config or {},
+        'seed': seed,
+        'setwise_version': SETWISE_VERSION,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ArtifactStore:
+    """Disk-backed store for the files of finished generations
+
+    Sessions hold only a handle (and file names) per result; bytes are read
+    when a preview or download actually needs them. Each handle is a
+    directory under ``root`` written atomically like a QuizCache entry.
+    Reads bump its mtime, handles idle for longer than ``ttl`` seconds are
+    swept, and least recently used handles go first once ``max_bytes`` is
+    exceeded. The handle count and size reported by ``stats`` come from the
+    last sweep, rescanned only once they are ``STORAGE_STATS_TTL`` old.
+    """
+
+    MANIFEST = "artifact.json"
+
+    def __init__(self, root, ttl, max_bytes):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.expired = 0
+        self._lock = threading.Lock()
+        self._usage = None
+
+    def put(self, files):
+        """Store ``files`` (name -> source path) under a new handle and return it"""
+        handle = uuid.uuid4().hex
+        scratch = self.root / f".{handle}.tmp"
+        scratch.mkdir()
+        try:
+            size = 0
+            for name, src in files.items():
+                dst = scratch / name
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                link_or_copy(src, dst)
+                size += dst.stat().st_size
+            (scratch / self.MANIFEST).write_text(json.dumps({'bytes': size, 'files': sorted(files)}))
+            os.rename(scratch, self.root / handle)
+        except OSError:
+            shutil.rmtree(scratch, ignore_errors=True)
+            raise
+        self.sweep()
+        return handle
+
+    def path(self, handle, name):
+        """Path of ``name`` under ``handle``, or None once it has expired"""
+        if not handle or not name:
+            return None
+        entry = self.root / handle
+        path = entry / name
+        try:
+            os.utime(entry)
+        except OSError:
+            return None
+        return path if path.exists() else None
+
+    def exists(self, handle):
+        return bool(handle) and (self.root / handle / self.MANIFEST).exists()
+
+    def resolve(self, quiz_set):
+        """Copy of a handle-only quiz set with ``pdf_path``/``tex_path``/``answer_path`` filled in"""
+        handle = quiz_set.get('artifact')
+        return dict(quiz_set, **{f'{field}_path': self.path(handle, quiz_set.get(field))
+                                 for field in ('pdf', 'tex', 'answer')})
+
+    def read_bytes(self, handle, name):
+        with log_span("artifact_read", level=logging.DEBUG, file=name):
+            path = self.path(handle, name)
+            return path.read_bytes() if path else None
+
+    def read_text(self, handle, name):
+        with log_span("artifact_read", level=logging.DEBUG, file=name):
+            path = self.path(handle, name)
+            return path.read_text(encoding='utf-8') if path else None
+
+    def discard(self, handle):
+        if handle:
+            shutil.rmtree(self.root / handle, ignore_errors=True)
+
+    def sweep(self):
+        """Drop expired handles, then least recently used ones past ``max_bytes``"""
+        cutoff = time.time() - self.ttl
+        entries = []
+        for entry in self.root.iterdir():
+            try:
+                mtime = entry.stat().st_mtime
+                if entry.name.startswith('.'):
+                    # Scratch left behind by a crashed writer
+                    if mtime < cutoff:
+                        shutil.rmtree(entry, ignore_errors=True)
+                    continue
+                size = json.loads((entry / self.MANIFEST).read_text())['bytes']
+            except (OSError, ValueError, KeyError):
+                continue
+            if mtime < cutoff:
+                shutil.rmtree(entry, ignore_errors=True)
+                with self._lock:
+                    self.expired += 1
+                continue
+            entries.append((mtime, size, entry))
+        kept = evict_lru(entries, self.max_bytes, lambda entry: shutil.rmtree(entry, ignore_errors=True))
+        with self._lock:
+            self.expired += len(entries) - len(kept)
+            self._usage = (len(kept), sum(size for _, size, _ in kept), time.monotonic())
+
+    def stats(self):
+        with self._lock:
+            usage = self._usage
+        if usage is None or time.monotonic() - usage[2] > STORAGE_STATS_TTL:
+            handles = 0
+            total = 0
+            for entry in self.root.iterdir():
+                try:
+                    total += json.loads((entry / self.MANIFEST).read_text())['bytes']
+                    handles += 1
+                except (OSError, ValueError, KeyError):
+                    continue
+            usage = (handles, total, time.monotonic())
+        with self._lock:
+            self._usage = usage
+            return {'handles': usage[0], 'bytes': usage[1], 'expired': self.expired}
+
+
+def publish_quiz_sets(store, quiz_sets, zip_path=None):
+    """Put one generation's files into ``store``
+
+    Returns ``(handle, quiz_sets)`` where the sets keep only their name,
+    TeX hash, handle and file names - what a session is meant to hold.
+    """
+    files = {}
+    published = []
+    for quiz_set in quiz_sets or []:
+        entry = {'name': quiz_set['name'], 'tex_hash': quiz_set.get('tex_hash')}
+        for field in ('pdf', 'tex', 'answer'):
+            path = quiz_set.get(f'{field}_path')
+            entry[field] = os.path.basename(path) if path else None
+            if path:
+                files[entry[field]] = path
+        published.append(entry)
+    if zip_path:
+        files[os.path.basename(zip_path)] = zip_path
+    handle = store.put(files)
+    for entry in published:
+        entry['artifact'] = handle
+    return handle, published
+
+
+class WorkspaceManager:
+    """Per-job scratch directories that are always cleaned up
+
+    Workspaces are created under ``root`` (tmpfs where available), or under
+    ``disk_root`` for large outputs and whenever ``root`` has less than
+    ``min_free_bytes`` left. Directory names carry the owning process id.
+    The janitor removes workspaces whose process has died, and this
+    process's own unreleased workspaces once they are older than ``ttl``
+    seconds. The bytes reported by ``stats`` are rescanned at most every
+    ``STORAGE_STATS_TTL`` seconds.
+    """
+
+    _OWNER = re.compile(r'-(\d+)-[a-z0-9_]+$')
+
+    def __init__(self, root, disk_root, ttl, min_free_bytes):
+        self.roots = [Path(root), Path(disk_root)]
+        for path in self.roots:
+            path.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.min_free_bytes = min_free_bytes
+        self.cleaned = 0
+        self._active = set()
+        self._lock = threading.Lock()
+        self._janitor = None
+        self._used = None
+
+    def create(self, prefix, large=False):
+        """Make a new workspace directory and return its path"""
+        root = self.roots[0]
+        if large or shutil.disk_usage(root).free < self.min_free_bytes:
+            root = self.roots[1]
+        path = tempfile.mkdtemp(prefix=f"{prefix}-{os.getpid()}-", dir=root)
+        with self._lock:
+            self._active.add(path)
+        return path
+
+    def release(self, path):
+        shutil.rmtree(path, ignore_errors=True)
+        with self._lock:
+            self._active.discard(path)
+
+    @contextmanager
+    def workspace(self, prefix, large=False):
+        """``with`` form of create/release - the directory goes away on every exit path"""
+        path = self.create(prefix, large)
+        try:
+            yield path
+        finally:
+            self.release(path)
+
+    def sweep(self):
+        """Remove orphaned workspaces; returns how many were removed"""
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for root in set(self.roots):
+            for entry in root.iterdir():
+                match = self._OWNER.search(entry.name)
+                if not match or not entry.is_dir():
+                    continue
+                owner = int(match.group(1))
+                try:
+                    if owner == os.getpid():
+                        with self._lock:
+                            active = str(entry) in self._active
+                        if active or entry.stat().st_mtime >= cutoff:
+                            continue
+                    elif _process_alive(owner):
+                        # Another live server process owns it; its own janitor decides
+                        continue
+                except OSError:
+                    continue
+                shutil.rmtree(entry, ignore_errors=True)
+                removed += 1
+        if removed:
+            log.info("Workspace janitor removed %d orphaned director%s", removed, 'y' if removed == 1 else 'ies')
+        with self._lock:
+            self.cleaned += removed
+        return removed
+
+    def start_janitor(self, interval):
+        """Sweep now and then every ``interval`` seconds on a daemon thread"""
+        if self._janitor is not None:
+            return
+
+        def run():
+            while True:
+                try:
+                    self.sweep()
+                except Exception:
+                    log.exception("Workspace janitor failed")
+                time.sleep(interval)
+
+        self._janitor = threading.Thread(target=run, name="setwise-janitor", daemon=True)
+        self._janitor.start()
+
+    def stats(self):
+        """Active workspaces, bytes they hold and free space on each root"""
+        with self._lock:
+            used = self._used
+        if used is None or time.monotonic() - used[1] > STORAGE_STATS_TTL:
+            total = 0
+            for root in set(self.roots):
+                for dirpath, _, filenames in os.walk(root):
+                    for name in filenames:
+                        try:
+                            total += os.lstat(os.path.join(dirpath, name)).st_size
+                        except OSError:
+                            continue
+            used = (total, time.monotonic())
+        with self._lock:
+            self._used = used
+            active = len(self._active)
+            cleaned = self.cleaned
+        return {
+            'active': active,
+            'bytes': used[0],
+            'cleaned': cleaned,
+            'free': {str(root): shutil.disk_usage(root).free for root in self.roots},
+        }
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,170 @@
+"""
+Student variants for Setwise Web
+One quiz per student, compiling each distinct variant once
+"""
+
+import csv
+import io
+import random
+import zipfile
+
+from setwise_web.bulk import run_bulk_generation
+from setwise_web.generation import derive_seed
+from setwise_web.questions import (
+    QuestionParseError, format_diagnostics, lint_question_model, parse_questions_sandboxed,
+    render_questions_module, validate_question_model)
+
+
+# NumPy draws every student's variant in one vectorized pass (pure Python otherwise)
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+_ROSTER_COLUMNS = ('student', 'variant', 'pdf', 'answer_key', 'status')
+
+
+def variable_slots(model):
+    """``(section, index, choices)`` for every question that picks among several variable sets"""
+    return [(section, index, len(entry['variables']))
+            for section in ('mcq', 'subjective')
+            for index, entry in enumerate(model.get(section) or [])
+            if isinstance(entry, dict) and isinstance(entry.get('variables'), list)
+            and len(entry['variables']) > 1]
+
+
+def plan_variants(choices, num_students, seed, max_variants=None):
+    """Draw one variant per student and dedupe them
+
+    ``choices`` is the number of options per column of a variant (one column
+    per variable slot, plus the ordering). With ``max_variants`` only that
+    many variants are drawn and students are spread over them. Returns
+    ``(variants, assignment)``: the distinct variants as tuples, and each
+    student's index into them.
+    """
+    draws = min(max_variants, num_students) if max_variants else num_students
+    if NUMPY_AVAILABLE:
+        rng = np.random.default_rng(seed)
+        rows = np.column_stack([rng.integers(0, count, size=draws) for count in choices])
+        if max_variants:
+            rows = rows[rng.integers(0, draws, size=num_students)]
+        unique, assignment = np.unique(rows, axis=0, return_inverse=True)
+        return [tuple(int(v) for v in row) for row in unique], [int(i) for i in assignment.ravel()]
+    rng = random.Random(seed)
+    rows = [tuple(rng.randrange(count) for count in choices) for _ in range(draws)]
+    if max_variants:
+        rows = [rows[rng.randrange(draws)] for _ in range(num_students)]
+    unique = sorted(set(rows))
+    index = {row: i for i, row in enumerate(unique)}
+    return unique, [index[row] for row in rows]
+
+
+def pin_variables(model, slots, selection):
+    """Copy of ``model`` where each variable slot keeps only its selected variable set"""
+    pinned = {section: list(model.get(section) or []) for section in ('mcq', 'subjective')}
+    for (section, index, _), choice in zip(slots, selection):
+        entry = pinned[section][index]
+        pinned[section][index] = dict(entry, variables=[entry['variables'][choice]])
+    return dict(model, **pinned)
+
+
+def roster_csv(roster):
+    """The roster as CSV text; student ids are written as given, quoted where needed"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(_ROSTER_COLUMNS)
+    writer.writerows([row[key] for key in _ROSTER_COLUMNS] for row in roster)
+    return buffer.getvalue()
+
+
+def generate_variant_pdfs(questions_text, template, student_ids, header_config=None, seed=None,
+                          orderings=2, max_variants=None, zip_path=None, workspaces=None, progress=None,
+                          cache=None, models=None, scheduler=None, formats=None, session_id=None,
+                          diagnostics=None, figures=None):
+    """Generate one quiz per student, compiling each distinct variant only once
+
+    A variant is a choice of variable set for every templated question plus
+    one of ``orderings`` question/option orders. All students' variants are
+    drawn in one pass and deduplicated; each distinct variable selection
+    becomes one setwise run whose sets are its orderings, and all runs go
+    through the bulk pipeline. The zip at ``zip_path`` gets a
+    ``roster.csv`` mapping every student to their PDF. Returns
+    ``(summary, error)``.
+    """
+    if progress is None:
+        progress = lambda stage, fraction: None
+    if seed is None:
+        seed = derive_seed(questions_text, template, header_config)
+    try:
+        model = models.get(questions_text) if models is not None else parse_questions_sandboxed(questions_text)
+    except QuestionParseError as e:
+        return None, f"Error in questions format: {str(e)}"
+    found = validate_question_model(model, questions_text) + lint_question_model(model, questions_text)
+    if diagnostics is not None:
+        diagnostics.extend(found)
+    errors = [d for d in found if d['severity'] == 'error']
+    if errors:
+        return None, (f"Question validation failed with {len(errors)} error(s):\n"
+                      + format_diagnostics(found))
+    
+    slots = variable_slots(model)
+    variants, assignment = plan_variants([count for *_, count in slots] + [orderings],
+                                         len(student_ids), seed, max_variants)
+    progress(f"{len(variants)} distinct variants for {len(student_ids)} students", 0.05)
+    
+    # Orderings of one selection are just the sets of its setwise run
+    selections = {}
+    for variant in variants:
+        selections.setdefault(variant[:-1], []).append(variant[-1])
+    entries = []
+    located = {}
+    for i, (selection, used) in enumerate(sorted(selections.items()), 1):
+        pinned = pin_variables(model, slots, selection)
+        pinned_text = render_questions_module(pinned, model.get('quiz_metadata'))
+        name = f"selection_{i:03d}"
+        entries.append({
+            'name': name,
+            'file': name,
+            'questions_text': pinned_text,
+            # The pinned module is derived data - no need to execute it again
+            'model': pinned,
+            'template': template,
+            'num_sets': len(used),
+            'header_config': header_config,
+            'seed': (seed - 1 + i) % 10000 + 1,
+        })
+        for set_number, ordering in enumerate(sorted(used), 1):
+            located[selection + (ordering,)] = (name, set_number)
+    
+    report = run_bulk_generation(
+        entries, zip_path, workspaces, progress=lambda stage, fraction: progress(stage, 0.05 + 0.95 * fraction),
+        cache=cache, models=models, scheduler=scheduler, formats=formats, session_id=session_id,
+        figures=figures
+    )
+    failed = {r['name']: r['error'] for r in report if r['status'] != 'ok'}
+    
+    roster = []
+    for student, variant_index in zip(student_ids, assignment):
+        name, set_number = located[variants[variant_index]]
+        roster.append({
+            'student': student,
+            'variant': f"{name}/set_{set_number}",
+            'pdf': f"{name}/quiz_set_{set_number}.pdf",
+            'answer_key': f"{name}/answer_key_{set_number}.txt",
+            'status': 'failed' if name in failed else 'ok',
+        })
+    with zipfile.ZipFile(zip_path, 'a') as archive:
+        archive.writestr("roster.csv", roster_csv(roster))
+    
+    summary = {
+        'students': len(student_ids),
+        'variants': len(variants),
+        'runs': len(entries),
+        'roster': roster,
+        'seed': seed,
+    }
+    if failed:
+        first = next(iter(failed.values()))
+        return summary, f"{len(failed)} of {len(entries)} variable selections failed to build:\n{first}"
+    return summary, None
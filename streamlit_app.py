@@ -5,19 +5,29 @@ Professional LaTeX quiz generator with live preview
 """
 
 import streamlit as st
-import tempfile
-import os
-import base64
-from pathlib import Path
+import re
+import time
+import uuid
+
+from setwise_web.bulk import build_bulk_entries, read_bulk_upload
+from setwise_web.config import (
+    ARTIFACT_DIR, ARTIFACT_MAX_BYTES, ARTIFACT_TTL, CACHE_DIR, CACHE_MAX_BYTES, COMPILE_WORKERS,
+    EXTERNALIZE_FIGURES, FIGURE_DIR, FIGURE_MAX_BYTES, FORMAT_DIR, IMPORT_ERROR, JOB_POLL_INTERVAL,
+    LIVE_PREVIEW_DEBOUNCE, LIVE_PREVIEW_POLL_INTERVAL, SETWISE_AVAILABLE, TEMPLATES, THUMBNAIL_DIR,
+    THUMBNAIL_MAX_BYTES, VARIANT_MAX_ORDERINGS, VARIANT_MAX_STUDENTS, WARM_FORMATS,
+    WORKSPACE_JANITOR_INTERVAL, WORKSPACE_MIN_FREE_BYTES, WORKSPACE_TTL, WORK_DIR, WORK_DISK_DIR)
+from setwise_web.generation import resolve_seed
+from setwise_web.jobs import JobManager
+from setwise_web.latex import FigureCache, FormatCache
+from setwise_web.logs import log
+from setwise_web.metrics import create_metrics
+from setwise_web.previews import ThumbnailCache
+from setwise_web.questions import (
+    QuestionModelCache, QuestionParseError, describe_question, lint_question_model,
+    validate_question_model)
+from setwise_web.scheduler import CompileScheduler
+from setwise_web.storage import ArtifactStore, QuizCache, WorkspaceManager, quiz_cache_key
 
-# Try to import setwise package
-try:
-    from setwise.quiz_generator import QuizGenerator
-    from setwise.template_manager import TemplateManager
-    SETWISE_AVAILABLE = True
-except ImportError as e:
-    SETWISE_AVAILABLE = False
-    IMPORT_ERROR = str(e)
 
 # Try to import PDF viewer
 try:
@@ -203,337 +213,236 @@ A = \\begin{pmatrix} 2 & 1 \\\\ 1 & 3 \\end{pmatrix}, \\quad \\mathbf{b} = \\beg
     }
     return examples.get(subject, "")
 
-def generate_quiz_pdfs(questions_text, template, num_sets, header_config=None):
-    """Generate quiz PDFs using the setwise package with comprehensive debugging"""
-    debug_log = []
-    if header_config is None:
-        header_config = {}
+
+@st.cache_resource
+def get_quiz_cache():
+    """One cache instance shared by every session in this server process"""
+    return QuizCache(CACHE_DIR, CACHE_MAX_BYTES)
+
+
+@st.cache_resource
+def get_artifact_store():
+    """One artifact store shared by every session in this server process"""
+    return ArtifactStore(ARTIFACT_DIR, ARTIFACT_TTL, ARTIFACT_MAX_BYTES)
+
+
+@st.cache_resource
+def get_workspace_manager():
+    """One workspace manager (and janitor thread) per server process"""
+    manager = WorkspaceManager(WORK_DIR, WORK_DISK_DIR, WORKSPACE_TTL, WORKSPACE_MIN_FREE_BYTES)
+    manager.start_janitor(WORKSPACE_JANITOR_INTERVAL)
+    return manager
+
+
+@st.cache_resource
+def get_question_models():
+    """One parsed-model memo shared by every session in this server process"""
+    return QuestionModelCache()
+
+
+def display_diagnostics(diagnostics):
+    """Table of validation, lint and LaTeX diagnostics"""
+    st.dataframe(
+        [{'Severity': d['severity'], 'Set': d.get('set') or "", 'Line': d['line'],
+          'Question': describe_question(d), 'Field': d['field'] or "",
+          'Problem': d['message'] + (f" [{d['context']}]" if d.get('context') else "")}
+         for d in diagnostics],
+        hide_index=True, use_container_width=True
+    )
+
+
+@st.cache_resource
+def get_format_cache():
+    """Formats are built once per template preamble and shared by every session"""
+    return FormatCache(FORMAT_DIR) if WARM_FORMATS else None
+
+
+@st.cache_resource
+def get_figure_cache():
+    """Shared figure cache, or None when externalization is turned off"""
+    if not EXTERNALIZE_FIGURES:
+        return None
+    return FigureCache(FIGURE_DIR, FIGURE_MAX_BYTES)
+
+
+@st.cache_resource
+def get_thumbnail_cache():
+    """Shared page-image cache, or None when poppler is not installed"""
+    cache = ThumbnailCache(THUMBNAIL_DIR, THUMBNAIL_MAX_BYTES)
+    return cache if cache.available else None
+
+
+@st.cache_resource
+def get_compile_scheduler():
+    """One compile scheduler shared by every session in this server process"""
+    return CompileScheduler(COMPILE_WORKERS)
+
+
+@st.cache_resource
+def get_metrics():
+    """Process-wide metrics, exported as configured by the SETWISE_WEB_METRICS_* settings"""
+    # Components are looked up here, on the script thread; collectors run on the exporter's threads
+    return create_metrics(get_quiz_cache(), get_figure_cache(), get_thumbnail_cache(),
+                          get_compile_scheduler(), get_artifact_store(), get_workspace_manager())
+
+
+def submit_generation_job(params, draft=False):
+    """Queue a generation for this session and remember its job id
+
+    Any job the session still has in flight is cancelled first - its
+    result would be replaced by this one anyway.
+    """
+    manager = get_job_manager()
+    if st.session_state.get('job_id'):
+        manager.cancel(st.session_state.job_id)
+    # Incremental recompiles compare against the last compiled result, not a draft
+    last_compiled = st.session_state.get('last_compiled') or {}
+    st.session_state.job_id = manager.submit(
+        st.session_state.session_id,
+        previous_sets=last_compiled.get('quiz_sets'),
+        **dict(params, draft=draft)
+    )
+
+
+def submit_archive_job(**params):
+    """Queue a bulk or variant generation for this session, replacing any job in flight
+
+    ``num_sets`` in ``params`` is the total number of PDFs, for the progress display.
+    """
+    manager = get_job_manager()
+    if st.session_state.get('job_id'):
+        manager.cancel(st.session_state.job_id)
+    st.session_state.job_id = manager.submit(st.session_state.session_id, **params)
+
+
+def discard_results(quiz_data):
+    """Delete the stored files of a result the session no longer shows"""
+    if quiz_data:
+        get_artifact_store().discard(quiz_data.get('artifact'))
+
+
+@st.cache_resource
+def get_job_manager():
+    """One job queue shared by every session in this server process"""
+    return JobManager(get_artifact_store(), get_workspace_manager(), cache=get_quiz_cache(),
+                      scheduler=get_compile_scheduler(), formats=get_format_cache(),
+                      models=get_question_models(), figures=get_figure_cache(),
+                      thumbnails=get_thumbnail_cache(), metrics=get_metrics())
+
+
+_TEX_DROP = re.compile(
+    r'\\(maketitle|noindent|hfill|newpage|clearpage|centering|medskip|bigskip|smallskip|'
+    r'hrule|vfill|thispagestyle\{[^}]*\}|pagestyle\{[^}]*\}|[vh]space\*?\{[^}]*\})'
+)
+_TEX_FIGURE_ENVS = ('tikzpicture', 'circuitikz', 'axis', 'tabular', 'figure', 'center')
+
+
+_TEX_MATH = re.compile(r'(\$\$.*?\$\$|(?<!\\)\$.*?(?<!\\)\$)')
+
+
+def _tex_line_to_markdown(line):
+    """Convert the text (non-math) parts of one line of LaTeX"""
+    line = _TEX_DROP.sub('', line)
+    line = re.sub(r'\\(?:sub)*section\*?\{([^}]*)\}',
+                  lambda m: '#' * (3 + m.group(0).count('sub')) + ' ' + m.group(1), line)
+    line = re.sub(r'\\textbf\{([^}]*)\}', r'**\1**', line)
+    line = re.sub(r'\\(?:textit|emph)\{([^}]*)\}', r'*\1*', line)
+    line = re.sub(r'\\begin\{\w+\}(\[[^\]]*\])?|\\end\{\w+\}', '', line)
+    return line.replace('\\\\', '  ')
+
+
+def tex_to_markdown(tex_data):
+    """Cheap LaTeX-to-Markdown conversion for the draft preview
+
+    Lists, headings and text styles become Markdown; math is left as
+    ``$...$``/``$$...$$`` for Streamlit's KaTeX renderer. Figures and tables
+    are shown as their LaTeX source since they need a real compile.
+    """
+    body = tex_data
+    if '\\begin{document}' in body:
+        body = body.split('\\begin{document}', 1)[1]
+    body = body.split('\\end{document}', 1)[0]
+    body = re.sub(r'(?<!\\)%.*', '', body)
+    body = re.sub(r'\\\[(.*?)\\\]', r'$$\1$$', body, flags=re.DOTALL)
+    body = re.sub(r'\\begin\{(equation|align)\*?\}(.*?)\\end\{\1\*?\}', r'$$\2$$', body, flags=re.DOTALL)
     
-    try:
-        debug_log.append("=== STARTING QUIZ GENERATION ===")
-        print(f"[DEBUG] Starting generation: template={template}, sets={num_sets}")
-        
-        if not SETWISE_AVAILABLE:
-            print(f"[ERROR] Setwise not available: {IMPORT_ERROR}")
-            return None, f"Setwise package not available. Import error: {IMPORT_ERROR}\\n\\nPlease ensure the setwise package is installed."
-        
-        debug_log.append("✓ Setwise package available")
-        print("[DEBUG] ✓ Setwise package available")
-        
-        # Validate questions format and inspect content
-        try:
-            print("[DEBUG] Validating questions syntax...")
-            exec_globals = {}
-            exec(questions_text, exec_globals)
-            debug_log.append("✓ Questions syntax valid")
-            print("[DEBUG] ✓ Questions syntax valid")
-            
-            # Debug: inspect the parsed questions
-            if 'mcq' in exec_globals:
-                mcq_questions = exec_globals['mcq']
-                print(f"[DEBUG] Found {len(mcq_questions)} MCQ questions")
-                for i, q in enumerate(mcq_questions):
-                    print(f"[DEBUG] MCQ {i+1}: keys = {list(q.keys())}")
-                    if 'template' in q:
-                        print(f"[DEBUG] MCQ {i+1} is templated with variables: {q.get('variables', 'NONE')}")
-                    elif 'question' in q:
-                        print(f"[DEBUG] MCQ {i+1} is standard question")
-                    else:
-                        print(f"[DEBUG] MCQ {i+1} ERROR: no 'question' or 'template' field!")
-            
-            if 'subjective' in exec_globals:
-                subj_questions = exec_globals['subjective']
-                print(f"[DEBUG] Found {len(subj_questions)} subjective questions")
-                for i, q in enumerate(subj_questions):
-                    print(f"[DEBUG] SUBJ {i+1}: keys = {list(q.keys())}")
-                    if 'template' in q:
-                        print(f"[DEBUG] SUBJ {i+1} is templated with variables: {q.get('variables', 'NONE')}")
-                    elif 'question' in q:
-                        print(f"[DEBUG] SUBJ {i+1} is standard question")
-                        if 'parts' in q:
-                            print(f"[DEBUG] SUBJ {i+1} has {len(q['parts'])} parts")
-                    else:
-                        print(f"[DEBUG] SUBJ {i+1} ERROR: no 'question' or 'template' field!")
-                        
-        except SyntaxError as e:
-            print(f"[ERROR] Syntax error: {e}")
-            return None, f"Python syntax error: {str(e)}\\n\\nCheck your mcq = [...] and subjective = [...] format."
-        except Exception as e:
-            print(f"[ERROR] Questions format error: {e}")
-            return None, f"Error in questions format: {str(e)}"
-        
-        # Create temporary file for questions with header metadata
-        print("[DEBUG] Creating temporary files...")
-        
-        # Create questions file WITHOUT quiz_config to test if that's causing issues
-        print("[DEBUG] Creating questions file WITHOUT quiz_config metadata...")
-        
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-            # Parse existing questions to see if quiz_metadata exists
-            questions_lines = questions_text.split('\n')
-            has_quiz_metadata = any('quiz_metadata' in line for line in questions_lines)
-            
-            if header_config and any(header_config.values()):
-                # User has provided header customization
-                if has_quiz_metadata:
-                    # Replace existing quiz_metadata with custom values
-                    full_content = questions_text
-                    # Find and replace the quiz_metadata section
-                    import re
-                    pattern = r'quiz_metadata\s*=\s*\{[^}]*\}'
-                    
-                    custom_metadata = "quiz_metadata = {\n"
-                    if header_config.get('title'):
-                        custom_metadata += f'    "title": "{header_config["title"]}",\n'
-                    if header_config.get('subject'):
-                        custom_metadata += f'    "subject": "{header_config["subject"]}",\n'
-                    if header_config.get('exam_info'):
-                        custom_metadata += f'    "duration": "{header_config["exam_info"]}",\n'
-                    custom_metadata += '    "total_marks": 100\n}'
-                    
-                    full_content = re.sub(pattern, custom_metadata, full_content, flags=re.DOTALL)
-                else:
-                    # Add quiz_metadata at the beginning
-                    metadata_header = "# Custom Quiz Metadata\n"
-                    metadata_header += "quiz_metadata = {\n"
-                    if header_config.get('title'):
-                        metadata_header += f'    "title": "{header_config["title"]}",\n'
-                    if header_config.get('subject'):
-                        metadata_header += f'    "subject": "{header_config["subject"]}",\n'
-                    if header_config.get('exam_info'):
-                        metadata_header += f'    "duration": "{header_config["exam_info"]}",\n'
-                    metadata_header += '    "total_marks": 100\n}\n\n'
-                    
-                    full_content = metadata_header + questions_text
-            else:
-                full_content = questions_text
-            
-            f.write(full_content)
-            questions_file = f.name
-        
-        debug_log.append(f"✓ Questions file created: {questions_file}")
-        print(f"[DEBUG] ✓ Questions file created: {questions_file}")
-        print(f"[DEBUG] Questions file content length: {len(full_content)} chars")
-        print(f"[DEBUG] FULL Questions file content:")
-        print("=" * 80)
-        print(full_content)
-        print("=" * 80)
-        
-        # Create temporary output directory
-        output_dir = tempfile.mkdtemp()
-        debug_log.append(f"✓ Output directory created: {output_dir}")
-        print(f"[DEBUG] ✓ Output directory created: {output_dir}")
-        
-        try:
-            # Find the correct template directory - setwise expects to be run from its own directory
-            print("[DEBUG] Setting up templates...")
-            import setwise
-            from pathlib import Path
-            setwise_dir = Path(setwise.__file__).parent
-            templates_dir = setwise_dir / 'templates'
-            debug_log.append(f"✓ Using templates from: {templates_dir}")
-            print(f"[DEBUG] ✓ Using templates from: {templates_dir}")
-            
-            # Change to setwise directory (CLI expects this)
-            original_cwd = os.getcwd()
-            print(f"[DEBUG] Changing directory from {original_cwd} to {setwise_dir}")
-            os.chdir(str(setwise_dir))
-            
-            print("[DEBUG] Initializing QuizGenerator...")
-            generator = QuizGenerator(
-                questions_file=questions_file,
-                output_dir=output_dir
-            )
-            
-            debug_log.append("✓ QuizGenerator initialized")
-            print("[DEBUG] ✓ QuizGenerator initialized")
-            
-            print(f"[DEBUG] Calling generate_quizzes(sets={num_sets}, template={template})...")
-            import time
-            import random
-            random_seed = random.randint(1, 10000)
-            print(f"[DEBUG] Using random seed: {random_seed}")
-            start_time = time.time()
-            
-            # Header configuration is now included in the questions file as quiz_config
-            print(f"[DEBUG] Header metadata included in questions file: title='{header_config.get('title', 'Quiz')}', subject='{header_config.get('subject', '')}', exam_info='{header_config.get('exam_info', '')}'")
-            
-            try:
-                print("[DEBUG] Starting quiz generation...")
-                
-                success = generator.generate_quizzes(
-                    num_sets=num_sets,
-                    template_name=template,
-                    compile_pdf=True,
-                    seed=random_seed
-                )
-                
-                # Check intermediate results during generation
-                print(f"[DEBUG] Post-generation check - files in output dir:")
-                try:
-                    files = os.listdir(output_dir)
-                    for f in files:
-                        fpath = os.path.join(output_dir, f)
-                        size = os.path.getsize(fpath) if os.path.isfile(fpath) else 0
-                        print(f"[DEBUG]   {f}: {size} bytes")
-                except Exception as e:
-                    print(f"[DEBUG]   Error listing files: {e}")
-                
-                end_time = time.time()
-                debug_log.append(f"→ generate_quizzes returned: {success} (took {end_time-start_time:.2f}s)")
-                print(f"[DEBUG] → generate_quizzes returned: {success} (took {end_time-start_time:.2f}s)")
-                
-                # Restore original directory
-                print(f"[DEBUG] Restoring directory to {original_cwd}")
-                os.chdir(original_cwd)
-                
-                if not success:
-                    print("[ERROR] QuizGenerator returned False")
-                    
-                    # Enhanced error investigation
-                    enhanced_debug = []
-                    
-                    # 1. Check generated files
-                    try:
-                        files = os.listdir(output_dir)
-                        enhanced_debug.append(f"Files created: {files}")
-                        
-                        # Look for .log files specifically
-                        log_files = [f for f in files if f.endswith('.log')]
-                        tex_files = [f for f in files if f.endswith('.tex')]
-                        pdf_files = [f for f in files if f.endswith('.pdf')]
-                        
-                        enhanced_debug.append(f"LaTeX files: {tex_files}")
-                        enhanced_debug.append(f"PDF files: {pdf_files}")
-                        enhanced_debug.append(f"Log files: {log_files}")
-                        
-                        # Read LaTeX log files for compilation errors
-                        for log_file in log_files:
-                            log_path = os.path.join(output_dir, log_file)
-                            with open(log_path, 'r', encoding='utf-8', errors='ignore') as f:
-                                log_content = f.read()
-                                if 'Error' in log_content or 'error' in log_content:
-                                    enhanced_debug.append(f"LaTeX errors in {log_file}:")
-                                    # Extract error lines
-                                    error_lines = [line.strip() for line in log_content.split('\n') 
-                                                 if ('error' in line.lower() or 'Error' in line) and line.strip()]
-                                    enhanced_debug.extend(error_lines[:5])  # First 5 errors
-                        
-                        # Check if TEX files were created but PDF compilation failed
-                        if tex_files and not pdf_files:
-                            enhanced_debug.append("❌ LaTeX files created but PDF compilation failed")
-                            enhanced_debug.append("💡 This suggests a LaTeX compilation error")
-                            
-                            # Try to read the tex file to see if it's valid
-                            for tex_file in tex_files[:1]:  # Check first tex file
-                                tex_path = os.path.join(output_dir, tex_file)
-                                with open(tex_path, 'r', encoding='utf-8', errors='ignore') as f:
-                                    tex_content = f.read()
-                                    enhanced_debug.append(f"TEX file size: {len(tex_content)} characters")
-                                    if len(tex_content) < 100:
-                                        enhanced_debug.append("⚠️ TEX file seems very small - generation may have failed")
-                                    enhanced_debug.append(f"TEX content preview: {tex_content[:200]}...")
-                        
-                        elif not tex_files:
-                            enhanced_debug.append("❌ No LaTeX files created - question processing failed")
-                            enhanced_debug.append("💡 This suggests an error in question validation or template processing")
-                            
-                    except Exception as e:
-                        enhanced_debug.append(f"Error investigating files: {e}")
-                    
-                    # 2. Check template and questions
-                    try:
-                        enhanced_debug.append(f"Template used: {template}")
-                        enhanced_debug.append(f"Number of sets: {num_sets}")
-                        enhanced_debug.append(f"Questions file size: {len(open(questions_file).read())} chars")
-                        
-                        # Try to validate questions manually
-                        with open(questions_file, 'r') as f:
-                            content = f.read()
-                            enhanced_debug.append(f"Questions preview: {content[:300]}...")
-                            
-                    except Exception as e:
-                        enhanced_debug.append(f"Error checking questions: {e}")
-                    
-                    # 3. Suggest local testing
-                    enhanced_debug.append("")
-                    enhanced_debug.append("🔍 TROUBLESHOOTING SUGGESTIONS:")
-                    enhanced_debug.append("1. Try running locally: pip install git+https://github.com/nipunbatra/setwise.git")
-                    enhanced_debug.append("2. Test with: setwise generate --questions-file your_file.py --sets 1")
-                    enhanced_debug.append("3. Check LaTeX installation: pdflatex --version")
-                    enhanced_debug.append("4. Validate questions: setwise questions validate your_file.py")
-                    enhanced_debug.append("")
-                    enhanced_debug.append("💡 This error often occurs due to:")
-                    enhanced_debug.append("   - LaTeX not properly installed on server")
-                    enhanced_debug.append("   - Invalid question syntax")
-                    enhanced_debug.append("   - Template rendering errors")
-                    enhanced_debug.append("   - Permission issues in temporary directories")
-                    
-                    debug_info = "\\n".join(debug_log + enhanced_debug)
-                    return None, f"QuizGenerator returned False.\\n\\nDetailed Debug Information:\\n{debug_info}"
-                    
-            except Exception as gen_error:
-                end_time = time.time()
-                print(f"[ERROR] Exception during generate_quizzes: {gen_error}")
-                debug_log.append(f"✗ Exception during generation: {str(gen_error)}")
-                debug_info = "\\n".join(debug_log)
-                return None, f"Generation exception: {str(gen_error)}\\n\\nFull Debug Log:\\n{debug_info}"
-                
-        except Exception as e:
-            import traceback
-            error_details = traceback.format_exc()
-            debug_log.append(f"✗ Error: {str(e)}")
-            return None, f"Generation error: {str(e)}\\n\\nFull Debug Log:\\n" + "\\n".join(debug_log)
-        
-        # Collect results
-        print("[DEBUG] Collecting results...")
-        quiz_sets = []
-        
-        for i in range(1, num_sets + 1):
-            pdf_path = os.path.join(output_dir, f'quiz_set_{i}.pdf')
-            answer_path = os.path.join(output_dir, f'answer_key_{i}.txt')
-            tex_path = os.path.join(output_dir, f'quiz_set_{i}.tex')
-            
-            print(f"[DEBUG] Checking for files: PDF={os.path.exists(pdf_path)}, Answer={os.path.exists(answer_path)}, TEX={os.path.exists(tex_path)}")
-            
-            if os.path.exists(pdf_path):
-                with open(pdf_path, 'rb') as f:
-                    pdf_data = f.read()
-                
-                print(f"[DEBUG] Read PDF {i}: {len(pdf_data)} bytes")
-                
-                answer_key = ""
-                if os.path.exists(answer_path):
-                    with open(answer_path, 'r') as f:
-                        answer_key = f.read()
-                    print(f"[DEBUG] Read answer key {i}: {len(answer_key)} chars")
-                
-                tex_data = ""
-                if os.path.exists(tex_path):
-                    with open(tex_path, 'r', encoding='utf-8') as f:
-                        tex_data = f.read()
-                    print(f"[DEBUG] Read TEX {i}: {len(tex_data)} chars")
-                
-                quiz_sets.append({
-                    'name': f'Quiz Set {i}',
-                    'pdf_data': pdf_data,
-                    'answer_key': answer_key,
-                    'tex_data': tex_data
-                })
-                print(f"[DEBUG] Added quiz set {i} to results")
-        
-        print(f"[DEBUG] Final results: {len(quiz_sets)} quiz sets collected")
-        
-        # Cleanup
-        try:
-            os.unlink(questions_file)
-        except:
-            pass
-        
-        return quiz_sets, None
-        
-    except Exception as e:
-        return None, f"Unexpected error: {str(e)}"
+    lines = []
+    list_stack = []
+    verbatim_env = None
+    in_display_math = False
+    for raw in body.splitlines():
+        line = raw.strip()
+        if verbatim_env:
+            lines.append(raw)
+            if f'\\end{{{verbatim_env}}}' in line:
+                lines.append("```")
+                verbatim_env = None
+            continue
+        if in_display_math:
+            lines.append(line)
+            in_display_math = line.count('$$') % 2 == 0
+            continue
+        figure = re.match(r'\\begin\{(\w+)\}', line)
+        if figure and figure.group(1) in _TEX_FIGURE_ENVS:
+            verbatim_env = figure.group(1)
+            lines.append("```latex")
+            lines.append(raw)
+            if f'\\end{{{verbatim_env}}}' in line:
+                lines.append("```")
+                verbatim_env = None
+            continue
+        if re.match(r'\\begin\{(enumerate|itemize)\}', line):
+            list_stack.append('1.' if 'enumerate' in line else '-')
+            continue
+        if re.match(r'\\end\{(enumerate|itemize)\}', line):
+            if list_stack:
+                list_stack.pop()
+            continue
+        if line.count('$$') % 2 == 1:
+            # Display math continues on the following lines - leave it verbatim
+            in_display_math = True
+            lines.append(line)
+            continue
+        # Only the text between math segments is rewritten
+        parts = _TEX_MATH.split(line)
+        line = "".join(part if n % 2 else _tex_line_to_markdown(part) for n, part in enumerate(parts))
+        if line.startswith('\\item'):
+            indent = '   ' * max(len(list_stack) - 1, 0)
+            marker = list_stack[-1] if list_stack else '-'
+            line = f"{indent}{marker} {line[len('item') + 1:].strip()}"
+        lines.append(line)
+    
+    markdown = "\n".join(lines)
+    return re.sub(r'\n{3,}', '\n\n', markdown).strip()
+
+
+def display_pdf_pages(thumbnails, pdf_path, height=400, key=""):
+    """Show a PDF as server-rendered page images: page 1 first, more pages on request
+
+    Returns False when page 1 could not be rendered so the caller can fall
+    back to the embedded viewer.
+    """
+    pages_key = f"preview_pages_{key}"
+    shown = st.session_state.get(pages_key, 1)
+    first = thumbnails.page(pdf_path, 1)
+    if first is None:
+        return False
+    total = thumbnails.page_count(pdf_path)
+
+    with st.container(height=height):
+        st.image(str(first), use_container_width=True)
+        for page in range(2, shown + 1):
+            image = thumbnails.page(pdf_path, page)
+            if image is None:
+                break
+            st.image(str(image), use_container_width=True)
+
+    if total is None or shown < total:
+        label = f"Show page {shown + 1}" + (f" of {total}" if total else "")
+        # Bumping the count in a callback lets the enclosing fragment redraw on its own
+        st.button(label, key=f"more_{pages_key}",
+                  on_click=lambda: st.session_state.update({pages_key: shown + 1}))
+    return True
 
 def display_pdf_embed(pdf_data, height=400, key_suffix=""):
     """Display PDF with streamlit-pdf-viewer for better compatibility"""
@@ -552,8 +461,7 @@ def display_pdf_embed(pdf_data, height=400, key_suffix=""):
     
     if PDF_VIEWER_AVAILABLE:
         try:
-            # Try different approaches to fix the NoneType error
-            print(f"[DEBUG] Attempting PDF viewer with data type: {type(pdf_data)}, size: {len(pdf_data)}")
+            log.debug("Embedding PDF viewer for %d bytes", len(pdf_data))
             
             # Use the ORIGINAL working version (before zoom_level caused issues)
             pdf_viewer(
@@ -564,37 +472,275 @@ def display_pdf_embed(pdf_data, height=400, key_suffix=""):
             )
             st.caption("📖 PDF Preview - Use download button for full-size PDF")
         except Exception as e:
-            import traceback
-            print(f"[DEBUG] PDF viewer exception details:")
-            print(traceback.format_exc())
+            log.exception("PDF viewer failed")
             
             # Fallback to simple success message
             st.error(f"PDF viewer error: {e}")
             st.success(f"✅ PDF generated successfully ({len(pdf_data):,} bytes)")
-            st.markdown("*Use the Download PDF button to view the quiz*")
+            st.markdown("*Use Download All to get the PDFs and view the quiz*")
     else:
         # Fallback when PDF viewer not available
         st.success(f"✅ PDF generated successfully ({len(pdf_data):,} bytes)")
-        st.markdown("*Use the Download PDF button to view the quiz (PDF viewer not available)*")
+        st.markdown("*Use Download All to get the PDFs and view the quiz (PDF viewer not available)*")
 
-def main():
-    st.title("🎯 Setwise Quiz Generator")
-    st.markdown("Generate professional LaTeX quizzes with dynamic templated questions")
+@st.fragment(run_every=LIVE_PREVIEW_POLL_INTERVAL)
+def live_preview_watcher(params):
+    """Submit a draft of set 1 once the editor content has been stable for a moment"""
+    live_key = st.session_state.get('live_key')
+    if live_key is None or live_key == st.session_state.get('live_submitted_key'):
+        return
+    if time.time() - st.session_state.get('live_changed_at', 0) < LIVE_PREVIEW_DEBOUNCE:
+        return
+    st.session_state.live_submitted_key = live_key
+    # Superseded live jobs are cancelled by submit_generation_job
+    submit_generation_job(dict(params, num_sets=1, requested_sets=params['num_sets']), draft=True)
+    st.rerun()
+
+def display_zip_download(quiz_data, tooltip):
+    """Download button for a result's zip, read from the artifact store"""
+    zip_path = get_artifact_store().path(quiz_data.get('artifact'), quiz_data.get('zip'))
+    if zip_path:
+        # A callable is only read when the button is clicked, not on every rerun
+        st.download_button(
+            label="Download All (zip)",
+            data=zip_path.read_bytes,
+            file_name="setwise_quizzes.zip",
+            mime="application/zip",
+            type="primary",
+            use_container_width=True,
+            help=tooltip
+        )
+
+def display_variant_results(quiz_data):
+    """Render a finished variant run: variant counts, the zip and the student roster"""
+    summary = quiz_data.get('summary')
+    if quiz_data['error']:
+        st.error("Variant Generation Failed")
+        st.code(quiz_data['error'], language=None)
+        if quiz_data.get('diagnostics'):
+            display_diagnostics([d for d in quiz_data['diagnostics'] if d['severity'] == 'error'])
+    if not summary:
+        return
     
-    # Show status if package not available
-    if not SETWISE_AVAILABLE:
-        st.error(f"Setwise package not available: {IMPORT_ERROR}")
-        st.info("The quiz generator requires the setwise package to be installed.")
+    col_students, col_variants, col_runs = st.columns(3)
+    col_students.metric("Students", summary['students'])
+    col_variants.metric("Distinct variants compiled", summary['variants'])
+    col_runs.metric("Variable selections", summary['runs'])
+    st.caption(f"Seed: {summary['seed']} - the same seed and roster size reproduce this assignment")
+    display_zip_download(quiz_data,
+                         tooltip="One folder per variable selection, plus roster.csv mapping students to PDFs")
+    with st.expander("Roster"):
+        st.dataframe(summary['roster'], hide_index=True, use_container_width=True)
+
+def display_bulk_results(quiz_data):
+    """Render a finished bulk generation: one zip download and a per-quiz report"""
+    report = quiz_data.get('report') or []
+    ok = [r for r in report if r['status'] == 'ok']
+    if quiz_data['error']:
+        st.error(f"Bulk Generation Failed: {quiz_data['error']}")
+    elif len(ok) < len(report):
+        st.warning(f"{len(ok)} of {len(report)} quizzes generated - see the failures below")
+    else:
+        st.success(f"{len(ok)} quizzes generated ({sum(r['sets'] for r in ok)} sets)")
+    
+    if ok:
+        display_zip_download(quiz_data,
+                             tooltip="One folder per quiz with its PDFs, TEX files and answer keys")
+    
+    st.dataframe(
+        [{'Quiz': r['name'], 'File': r['file'], 'Template': r['template'], 'Sets': r['sets'],
+          'Seed': r['seed'], 'Status': r['status'], 'Warnings': r['warnings'],
+          'Error': r['error'] or ""}
+         for r in report],
+        hide_index=True, use_container_width=True
+    )
+
+@st.fragment
+def display_quiz_set(quiz_set, i, total, draft):
+    """Preview and answer key of one set, read from the artifact store only as shown
+
+    Widget keys include the set's artifact handle, so a new result never
+    inherits the paging state of the one it replaced.
+    """
+    store = get_artifact_store()
+    st.markdown(f"**{quiz_set['name']}**")
+
+    # Two sub-columns: preview and answer key
+    sub_col1, sub_col2 = st.columns([2, 1])
+
+    with sub_col1:
+        if draft:
+            with st.container(height=400):
+                st.markdown(tex_to_markdown(store.read_text(quiz_set['artifact'], quiz_set['tex']) or ""))
+        else:
+            # Page images when poppler is installed, the embedded viewer otherwise
+            pdf_path = store.path(quiz_set['artifact'], quiz_set['pdf'])
+            thumbnails = get_thumbnail_cache()
+            shown = bool(pdf_path and thumbnails and display_pdf_pages(
+                thumbnails, pdf_path, height=400, key=f"{quiz_set['artifact']}_{i}"))
+            if not shown:
+                pdf_data = store.read_bytes(quiz_set['artifact'], quiz_set['pdf'])
+                log.debug("Quiz set %d PDF data: %s bytes", i + 1, len(pdf_data) if pdf_data else None)
+                if pdf_data:
+                    display_pdf_embed(pdf_data, height=400, key_suffix=f"{quiz_set['artifact']}_{i}_{total}")
+                else:
+                    st.warning(f"PDF generation failed for set {i+1} - no PDF data")
+
+    with sub_col2:
+        # Read only once asked for - the fragment reruns on every toggle and page turn
+        if store.path(quiz_set['artifact'], quiz_set['answer']) and st.toggle(
+                "View Answers", key=f"answers_{quiz_set['artifact']}_{i}"):
+            st.text(store.read_text(quiz_set['artifact'], quiz_set['answer']) or "")
+
+def display_quiz_results(quiz_data):
+    """Render a finished generation: error details or one row per quiz set"""
+    if quiz_data.get('bulk'):
+        display_bulk_results(quiz_data)
+        return
+    if quiz_data.get('variants'):
+        display_variant_results(quiz_data)
         return
+    quiz_sets = quiz_data['quiz_sets']
+    error = quiz_data['error']
     
+    if error:
+        st.error("Quiz Generation Failed")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("Try Enhanced Demo", use_container_width=True):
+                st.session_state.questions = load_example_questions("Enhanced Demo")
+                st.rerun()
+
+        with col2:
+            if st.button("Show Error Details", use_container_width=True):
+                st.session_state.show_raw_logs = True
+
+        # Simplified error display
+        if quiz_data.get('diagnostics'):
+            # Structured problems are short and actionable - show them without digging
+            display_diagnostics([d for d in quiz_data['diagnostics'] if d['severity'] == 'error'])
+        elif error.startswith("Question validation failed"):
+            st.code(error, language=None)
+        
+        with st.expander("View Error Details"):
+            if error.startswith("Question validation failed"):
+                st.warning("Fix the problems listed above - nothing was compiled")
+            elif "LaTeX files created but PDF compilation failed" in error:
+                st.warning("LaTeX compilation failed - try simpler expressions or test locally")
+            elif "No LaTeX files created" in error:
+                st.warning("Question processing failed - check Python syntax")
+            else:
+                st.warning("Generation failed - try simpler questions or test locally")
+
+            if st.session_state.get('show_raw_logs', False):
+                st.text(error)
+                if st.button("Hide Raw Logs"):
+                    st.session_state.show_raw_logs = False
+            else:
+                if st.button("Show Technical Details"):
+                    st.session_state.show_raw_logs = True
+    elif quiz_sets and not get_artifact_store().exists(quiz_data.get('artifact')):
+        st.info("These results have expired - generate again to see them")
+    elif quiz_sets:
+        if quiz_data.get('draft'):
+            col_draft_info, col_draft_compile = st.columns([2, 1])
+            with col_draft_info:
+                st.info("Draft preview - rendered without LaTeX. Figures and tables show their source.")
+            with col_draft_compile:
+                if st.button("Compile PDFs", type="primary", use_container_width=True):
+                    params = dict(quiz_data['params'])
+                    # Live previews render set 1 only; compile what was actually asked for
+                    params['num_sets'] = params.pop('requested_sets', params['num_sets'])
+                    submit_generation_job(params, draft=False)
+                    st.rerun()
+        
+        if quiz_data.get('seed') is not None:
+            st.caption(f"Seed: {quiz_data['seed']} - regenerate with this seed to reproduce these sets")
+        
+        if quiz_data.get('diagnostics'):
+            with st.expander(f"⚠️ {len(quiz_data['diagnostics'])} warning(s) in the questions"):
+                display_diagnostics(quiz_data['diagnostics'])
+
+        display_zip_download(quiz_data,
+                             tooltip="Every set's PDF, TEX file and answer key in one zip")
+
+        # One fragment per set - paging through a preview reruns only that set
+        for i, quiz_set in enumerate(quiz_sets):
+            display_quiz_set(quiz_set, i, len(quiz_sets), bool(quiz_data.get('draft')))
+
+            # Add spacing between sets
+            if i < len(quiz_sets) - 1:
+                st.markdown("---")
+
+        # Session state holds only handles; the files stay in the artifact store
+    else:
+        st.warning("No PDFs generated")
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def display_job_progress(job_id):
+    """Poll the background job and hand its result to the page once it finishes"""
+    manager = get_job_manager()
+    job = manager.get(job_id)
+    if job is None:
+        # Expired or lost (e.g. server restart) - nothing left to wait for
+        st.session_state.pop('job_id', None)
+        st.warning("Generation job is no longer available - please generate again")
+        return
+    
+    if job.finished:
+        job = manager.collect(job_id)
+        replaced = [st.session_state.get('quiz_results'), st.session_state.get('last_compiled')]
+        st.session_state.quiz_results = job.result
+        if job.result.get('quiz_sets') and not job.result.get('draft'):
+            st.session_state.last_compiled = job.result
+        # The last compiled result backs incremental recompiles, so it outlives a newer draft
+        kept = (st.session_state.quiz_results, st.session_state.get('last_compiled'))
+        for old in replaced:
+            if old is not None and not any(old is k for k in kept):
+                discard_results(old)
+        st.session_state.pop('job_id', None)
+        st.rerun()
+    
+    position = manager.scheduler.position(job.session_id) if manager.scheduler else None
+    if position is not None:
+        st.info(f"⏳ Queued (position {position}) - the server is busy compiling other quizzes")
+    st.progress(job.progress, text=f"Generating {job.params['num_sets']} quiz sets: {job.stage}")
+    with st.expander("Progress details"):
+        for elapsed, message in job.events:
+            st.text(f"{elapsed:6.2f}s  {message}")
+
+@st.fragment
+def settings_panel():
+    """Template, sets, seed, header and advanced options
+
+    A fragment, so changing a setting reruns only this panel. The values
+    are kept in ``st.session_state.settings`` for the editor and bulk
+    panels to read when they submit a job.
+    """
     # Controls row 1
-    col_ctrl1, col_ctrl2, col_ctrl3, col_ctrl4 = st.columns([1, 1, 1, 2])
+    col_ctrl1, col_ctrl2, col_ctrl_seed, col_ctrl3, col_ctrl4 = st.columns([1, 1, 1, 1, 1])
     
     with col_ctrl1:
-        template = st.selectbox("Template", ["default", "compact", "minimal"])
+        template = st.selectbox("Template", TEMPLATES, key="template")
     
     with col_ctrl2:
-        num_sets = st.slider("Sets", 1, 5, 2)
+        num_sets = st.slider("Sets", 1, 5, 2, key="num_sets")
+    
+    with col_ctrl_seed:
+        # Fixed comes first: only a seed that survives edits lets unchanged sets be reused
+        seed_mode = st.selectbox(
+            "Seed", ["Fixed", "Content hash", "Random"], key="seed_mode",
+            help="Fixed keeps the same shuffle while you edit, so sets your edit did not touch are "
+                 "reused instead of recompiled. Content hash picks a seed from the questions and "
+                 "settings - every edit reshuffles and recompiles all sets. Both regenerate "
+                 "identical sets (and hit the cache); Random always makes new ones"
+        )
+        fixed_seed = 42
+        if seed_mode == "Fixed":
+            fixed_seed = st.number_input("Seed value", min_value=1, max_value=10000, value=42, step=1,
+                                         key="fixed_seed")
     
     with col_ctrl3:
         example = st.selectbox("Examples", ["", "Ultimate Demo"])
@@ -609,13 +755,13 @@ def main():
         col_header1, col_header2, col_header3 = st.columns([1, 1, 1])
         
         with col_header1:
-            quiz_title = st.text_input("Quiz Title", value="Quiz")
+            quiz_title = st.text_input("Quiz Title", value="Quiz", key="quiz_title")
         
         with col_header2:
-            subject_name = st.text_input("Subject", value="")
+            subject_name = st.text_input("Subject", value="", key="subject_name")
         
         with col_header3:
-            exam_info = st.text_input("Duration/Info", value="")
+            exam_info = st.text_input("Duration/Info", value="", key="exam_info")
         
         # Store header info in session state for quiz generation
         st.session_state.header_config = {
@@ -624,15 +770,103 @@ def main():
             "exam_info": exam_info
         }
     
-    # Main split pane layout
-    col_left, col_right = st.columns([1, 1])
+    variant = None
+    with st.expander("Advanced Options"):
+        parallel_compile = st.checkbox(
+            "Compile sets in parallel", value=True, key="parallel_compile",
+            help=f"Render every set first, then compile them side by side (server runs up to {COMPILE_WORKERS} compiles at once)"
+        )
+        variant_mode = st.checkbox(
+            "High-volume variants (one quiz per student)", key="variant_mode",
+            help="Generate a quiz for every student; identical variants are compiled only once"
+        )
+        if variant_mode:
+            col_var1, col_var2, col_var3 = st.columns(3)
+            with col_var1:
+                num_students = st.number_input("Students", min_value=1, max_value=VARIANT_MAX_STUDENTS,
+                                               value=100, step=1, key="num_students")
+            with col_var2:
+                orderings = st.number_input(
+                    "Orderings per selection", min_value=1, max_value=VARIANT_MAX_ORDERINGS, value=2, step=1,
+                    key="orderings",
+                    help="How many question/option orders each choice of template variables is shuffled into"
+                )
+            with col_var3:
+                max_variants = st.number_input(
+                    "Max distinct variants", min_value=0, max_value=VARIANT_MAX_STUDENTS, value=0, step=1,
+                    key="max_variants",
+                    help="0 means no cap. A cap makes students share variants and bounds compile time"
+                )
+            student_ids_text = st.text_area(
+                "Student IDs (optional, one per line - overrides the student count)", height=100,
+                key="student_ids_text"
+            )
+            variant = {
+                'num_students': int(num_students),
+                'orderings': int(orderings),
+                'max_variants': int(max_variants) or None,
+                'student_ids_text': student_ids_text,
+            }
     
-    # LEFT PANE: Questions Editor
-    with col_left:
-        st.subheader("Questions Editor")
-        
-        if 'questions' not in st.session_state:
-            st.session_state.questions = '''# Simple Demo Quiz - Load "Ultimate Demo" to see all features!
+    st.session_state.settings = {
+        'template': template,
+        'num_sets': num_sets,
+        'seed_mode': seed_mode,
+        'fixed_seed': fixed_seed,
+        'parallel': parallel_compile,
+        'variant': variant,
+    }
+
+@st.fragment
+def bulk_panel():
+    """Upload several question files and generate them as one job"""
+    with st.expander("📦 Bulk Generation"):
+        st.markdown("""
+        Upload question files (or a zip of them) to generate every quiz in one go.
+        Add a `manifest.yaml` or `manifest.json` to set options per file - without one,
+        every file uses the template, sets, seed and header chosen above.
+        ```yaml
+        defaults: {template: compact, num_sets: 3}
+        quizzes:
+          - file: algebra.py
+            sections: [A1, A2, A3]     # one folder (and seed) per section
+          - file: calculus.py
+            num_sets: 2
+            title: Calculus Midterm
+        ```
+        """)
+        bulk_uploads = st.file_uploader(
+            "Question files, zip and manifest", type=["py", "zip", "yaml", "yml", "json"],
+            accept_multiple_files=True, key="bulk_uploads"
+        )
+        if st.button("Generate All", disabled=not bulk_uploads):
+            settings = st.session_state.settings
+            try:
+                files, manifest = read_bulk_upload((f.name, f.getvalue()) for f in bulk_uploads)
+                entries = build_bulk_entries(files, manifest, defaults={
+                    'template': settings['template'],
+                    'num_sets': settings['num_sets'],
+                    # Random seeds would make the batch unreproducible; fall back to the content hash
+                    'seed': int(settings['fixed_seed']) if settings['seed_mode'] == "Fixed" else None,
+                    **st.session_state.header_config
+                })
+            except ValueError as e:
+                st.error(f"Bulk upload rejected: {e}")
+            else:
+                submit_archive_job(entries=entries, num_sets=sum(entry['num_sets'] for entry in entries))
+                st.rerun()
+
+@st.fragment
+def editor_panel():
+    """Questions editor and the buttons that act on it
+
+    A fragment, so editing reruns only the editor - the results pane and
+    its previews are left alone until a job is submitted.
+    """
+    st.subheader("Questions Editor")
+    
+    if 'questions' not in st.session_state:
+        st.session_state.questions = '''# Simple Demo Quiz - Load "Ultimate Demo" to see all features!
 quiz_metadata = {
     "title": "Simple Math Quiz",
     "subject": "Mathematics",
@@ -682,215 +916,199 @@ subjective = [
         "marks": 7
     }
 ]'''
-        
         # Text editor
-        questions_text = st.text_area(
-            "Questions (Python format)",
-            value=st.session_state.questions,
-            height=500,
-            key="editor"
-        )
-        
-        # Update session state
-        st.session_state.questions = questions_text
-        
-        # Validation and generation buttons
-        col_btn1, col_btn2 = st.columns(2)
-        
-        with col_btn1:
-            if st.button("Validate Questions", use_container_width=True):
-                try:
-                    exec(questions_text)
+    questions_text = st.text_area(
+        "Questions (Python format)",
+        value=st.session_state.questions,
+        height=500,
+        key="editor"
+    )
+    
+    # Update session state
+    st.session_state.questions = questions_text
+    
+    # Validation and generation buttons
+    col_btn1, col_btn_draft, col_btn2 = st.columns(3)
+    
+    with col_btn1:
+        if st.button("Validate Questions", use_container_width=True):
+            try:
+                model = get_question_models().get(questions_text)
+                diagnostics = (validate_question_model(model, questions_text)
+                               + lint_question_model(model, questions_text))
+                if any(d['severity'] == 'error' for d in diagnostics):
+                    st.error("Questions have errors that would stop the quiz from building")
+                elif diagnostics:
+                    st.warning("Questions are valid, with warnings")
+                else:
                     st.success("Questions format is valid!")
-                except SyntaxError as e:
+                if diagnostics:
+                    display_diagnostics(diagnostics)
+            except QuestionParseError as e:
+                if e.kind == "syntax":
                     st.error(f"Syntax error: {str(e)}")
-                except Exception as e:
+                else:
                     st.error(f"Format error: {str(e)}")
-        
-        with col_btn2:
-            if st.button("Generate Quiz Sets", type="primary", use_container_width=True):
-                # Clear previous results to ensure fresh generation
-                if 'quiz_results' in st.session_state:
-                    del st.session_state.quiz_results
-                st.session_state.generate_now = True
-                st.rerun()
     
-    # RIGHT PANE: PDF Previews
-    with col_right:
-        st.subheader(f"PDF Preview ({num_sets} sets)")
-        
-        # Check if we need to generate new quizzes or show existing ones
-        should_generate = st.session_state.get('generate_now', False) and questions_text.strip()
-        has_existing = 'quiz_results' in st.session_state and st.session_state.quiz_results
-        
-        if should_generate:
-            # Add debug info in the UI
-            st.info("🔄 Starting quiz generation...")
-            debug_container = st.empty()
-            
-            with st.spinner(f"Generating {num_sets} quiz sets..."):
-                debug_container.text("Step 1: Validating questions...")
-                header_config = st.session_state.get('header_config', {})
-                print(f"[STREAMLIT] About to call generate_quiz_pdfs with {len(questions_text)} chars, template={template}, sets={num_sets}")
-                quiz_sets, error = generate_quiz_pdfs(questions_text, template, num_sets, header_config)
-                debug_container.text("Step 2: Generation complete, processing results...")
-                print(f"[STREAMLIT] generate_quiz_pdfs returned: quiz_sets={len(quiz_sets) if quiz_sets else 0}, error={bool(error)}")
-            
-            # Store results in session state to prevent regeneration on download
-            if quiz_sets and not error:
-                st.session_state.quiz_results = {
-                    'quiz_sets': quiz_sets,
-                    'error': error,
-                    'template': template,
-                    'num_sets': num_sets
-                }
-            
-            # Reset generate flag but preserve generated content
-            if 'generate_now' in st.session_state:
-                del st.session_state.generate_now
-        
-        # Display results (either newly generated or from session state)
-        if has_existing or (should_generate and not st.session_state.get('generate_now')):
-            if has_existing:
-                quiz_data = st.session_state.quiz_results
-                quiz_sets = quiz_data['quiz_sets']
-                error = quiz_data['error']
-            else:
-                # Use the results we just generated
-                pass
-            
-            if error:
-                st.error("Quiz Generation Failed")
-                
-                col1, col2 = st.columns(2)
-                with col1:
-                    if st.button("Try Enhanced Demo", use_container_width=True):
-                        st.session_state.questions = load_example_questions("Enhanced Demo")
-                        st.rerun()
-                
-                with col2:
-                    if st.button("Show Error Details", use_container_width=True):
-                        st.session_state.show_raw_logs = True
-            
-                # Simplified error display
-                with st.expander("View Error Details"):
-                    if "LaTeX files created but PDF compilation failed" in error:
-                        st.warning("LaTeX compilation failed - try simpler expressions or test locally")
-                    elif "No LaTeX files created" in error:
-                        st.warning("Question processing failed - check Python syntax")
-                    else:
-                        st.warning("Generation failed - try simpler questions or test locally")
-                    
-                    if st.session_state.get('show_raw_logs', False):
-                        st.text(error)
-                        if st.button("Hide Raw Logs"):
-                            st.session_state.show_raw_logs = False
-                    else:
-                        if st.button("Show Technical Details"):
-                            st.session_state.show_raw_logs = True
-            elif quiz_sets:
-                # Display each PDF set in rows
-                for i, quiz_set in enumerate(quiz_sets):
-                    st.markdown(f"**{quiz_set['name']}**")
-                    
-                    # Four sub-columns: PDF preview, PDF download, TEX download, answer key
-                    sub_col1, sub_col2, sub_col3, sub_col4 = st.columns([2, 0.7, 0.7, 0.6])
-                    
-                    with sub_col1:
-                        pdf_data = quiz_set.get('pdf_data')
-                        print(f"[DEBUG] Quiz set {i+1} PDF data: type={type(pdf_data)}, size={len(pdf_data) if pdf_data else 'None'}")
-                        if pdf_data:
-                            display_pdf_embed(pdf_data, height=400, key_suffix=f"set_{i}_{len(quiz_sets)}")
-                        else:
-                            st.warning(f"PDF generation failed for set {i+1} - no PDF data")
-                    
-                    with sub_col2:
-                        if quiz_set['pdf_data']:
-                            st.download_button(
-                                label="Download PDF",
-                                data=quiz_set['pdf_data'],
-                                file_name=f"quiz_set_{i+1}.pdf",
-                                mime="application/pdf",
-                                key=f"download_pdf_{i}_{len(quiz_sets)}",
-                                use_container_width=True,
-                                help="Download PDF to your device"
-                            )
-                    
-                    with sub_col3:
-                        if quiz_set.get('tex_data'):
-                            st.download_button(
-                                label="Download TEX",
-                                data=quiz_set['tex_data'],
-                                file_name=f"quiz_set_{i+1}.tex",
-                                mime="text/plain",
-                                key=f"download_tex_{i}_{len(quiz_sets)}",
-                                use_container_width=True,
-                                help="Download LaTeX source file"
-                            )
-                    
-                    with sub_col4:
-                        if quiz_set['answer_key']:
-                            st.download_button(
-                                label="Download Answers",
-                                data=quiz_set['answer_key'],
-                                file_name=f"answer_key_{i+1}.txt",
-                                mime="text/plain",
-                                key=f"download_answers_{i}_{len(quiz_sets)}",
-                                use_container_width=True,
-                                help="Download answer key as text file"
-                            )
-                            
-                            # Show preview of answer key
-                            with st.expander("View Answers"):
-                                st.text(quiz_set['answer_key'])
-                    
-                    # Add spacing between sets
-                    if i < len(quiz_sets) - 1:
-                        st.markdown("---")
-                
-                # Results are now preserved in session state for downloads
+    with col_btn_draft:
+        draft_clicked = st.button("Draft Preview", use_container_width=True,
+                                  help="Render questions and answers without compiling PDFs")
+    
+    with col_btn2:
+        generate_clicked = st.button("Generate Quiz Sets", type="primary", use_container_width=True)
+    
+    live_preview = st.toggle(
+        "Live preview",
+        help="Automatically re-render a draft of set 1 shortly after you stop editing"
+    )
+    
+    # Read at submit time, so settings changed in their own fragment are picked up
+    settings = st.session_state.settings
+    template = settings['template']
+    num_sets = settings['num_sets']
+    variant = settings['variant']
+    header_config = st.session_state.get('header_config', {})
+    generation_params = {
+        'questions_text': questions_text,
+        'template': template,
+        'num_sets': num_sets,
+        'header_config': header_config,
+        'seed': resolve_seed(settings['seed_mode'], settings['fixed_seed'], questions_text, template, header_config),
+        # A random seed still gets recorded, but asking for one means asking for new sets
+        'cacheable': settings['seed_mode'] != "Random",
+        'parallel': settings['parallel'],
+    }
+    
+    if generate_clicked and variant:
+        if questions_text.strip():
+            student_ids = [line.strip() for line in variant['student_ids_text'].splitlines() if line.strip()]
+            student_ids = student_ids or [f"student_{i:04d}" for i in range(1, variant['num_students'] + 1)]
+            if len(student_ids) > VARIANT_MAX_STUDENTS:
+                st.warning(f"At most {VARIANT_MAX_STUDENTS} students per run")
             else:
-                st.warning("No PDFs generated")
+                submit_archive_job(
+                    questions_text=questions_text, template=template, header_config=header_config,
+                    seed=generation_params['seed'], cacheable=generation_params['cacheable'],
+                    student_ids=student_ids, orderings=variant['orderings'],
+                    max_variants=variant['max_variants'], num_sets=len(student_ids)
+                )
+                st.rerun()
         else:
-            # Show instructions when no preview
-            st.info("📝 Enter questions and click 'Generate Quiz Sets' to get started!")
-    
-            with st.expander("📚 Quick Help"):
-                st.markdown("""
-                **Quick Start:**
-                1. Edit questions or load an example
-                2. Choose template and number of sets  
-                3. Click "Generate Quiz Sets"
-                4. Download PDFs and answer keys
-        
-                **Question Format:**
-                ```python
-                mcq = [...]          # Multiple choice questions
-                subjective = [...]   # Written answer questions
-                quiz_metadata = {    # Optional headers
-                    "title": "My Quiz",
-                    "duration": "60 minutes"
-                }
-                ```
+            st.warning("Enter some questions first")
+    elif draft_clicked or generate_clicked:
+        if questions_text.strip():
+            submit_generation_job(generation_params, draft=draft_clicked)
+            st.rerun()
+        else:
+            st.warning("Enter some questions first")
+    
+    if live_preview and questions_text.strip():
+        # Restart the debounce window whenever the content actually changes
+        live_key = quiz_cache_key(questions_text, template, 1, header_config, None)
+        if st.session_state.get('live_key') != live_key:
+            st.session_state.live_key = live_key
+            st.session_state.live_changed_at = time.time()
+        live_preview_watcher(generation_params)
+
+@st.fragment
+def results_pane():
+    """Job progress, results or getting-started help
+
+    Runs as its own fragment so result widgets (page previews, error
+    details) rerun without touching the editor.
+    """
+    st.subheader("PDF Preview")
+    cache_stats = get_quiz_cache().stats()
+    queue_stats = get_compile_scheduler().stats()
+    artifact_stats = get_artifact_store().stats()
+    work_stats = get_workspace_manager().stats()
+    st.caption(f"Cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+               f"({cache_stats['hit_rate']:.0%} hit rate) · "
+               f"Compiles: {queue_stats['running']}/{queue_stats['max_concurrent']} running, "
+               f"{queue_stats['queue_depth']} queued, avg wait {queue_stats['avg_wait']:.1f}s · "
+               f"Stored results: {artifact_stats['handles']} ({artifact_stats['bytes'] / 1024 / 1024:.1f} MB) · "
+               f"Scratch: {work_stats['active']} active ({work_stats['bytes'] / 1024 / 1024:.1f} MB, "
+               f"{work_stats['free'][str(WORK_DIR)] / 1024 / 1024:.0f} MB free)")
+    
+    # A running job takes precedence; its results replace the old ones once collected
+    job_id = st.session_state.get('job_id')
+    has_existing = 'quiz_results' in st.session_state and st.session_state.quiz_results
+    
+    if job_id:
+        display_job_progress(job_id)
+    elif has_existing:
+        display_quiz_results(st.session_state.quiz_results)
+    else:
+        # Show instructions when no preview
+        st.info("📝 Enter questions and click 'Generate Quiz Sets' to get started!")
+
+        with st.expander("📚 Quick Help"):
+            st.markdown("""
+            **Quick Start:**
+            1. Edit questions or load an example
+            2. Choose template and number of sets  
+            3. Click "Generate Quiz Sets"
+            4. Download all PDFs and answer keys as one zip
+    
+            **Question Format:**
+            ```python
+            mcq = [...]          # Multiple choice questions
+            subjective = [...]   # Written answer questions
+            quiz_metadata = {    # Optional headers
+                "title": "My Quiz",
+                "duration": "60 minutes"
+            }
+            ```
+    
+            **Features:**
+            - Templated questions with `{{ variables }}`
+            - Multi-part subjective questions
+            - Professional PDF output
+            """) 
         
-                **Features:**
-                - Templated questions with `{{ variables }}`
-                - Multi-part subjective questions
-                - Professional PDF output
-                """) 
+        with st.expander("💡 Troubleshooting"):
+            st.markdown("""
+            **If generation fails:**
+            - Try the "Enhanced Demo" example first
+            - Use simpler questions
+            - Test locally: `pip install git+https://github.com/nipunbatra/setwise.git`
             
-            with st.expander("💡 Troubleshooting"):
-                st.markdown("""
-                **If generation fails:**
-                - Try the "Enhanced Demo" example first
-                - Use simpler questions
-                - Test locally: `pip install git+https://github.com/nipunbatra/setwise.git`
-                
-                **Common fixes:**
-                - Check Python syntax
-                - Ensure MCQ answers match options exactly
-                - Use raw strings for LaTeX: `r"$x^2$"`
-                """)
+            **Common fixes:**
+            - Check Python syntax
+            - Ensure MCQ answers match options exactly
+            - Use raw strings for LaTeX: `r"$x^2$"`
+            """)
+
+def main():
+    st.title("🎯 Setwise Quiz Generator")
+    st.markdown("Generate professional LaTeX quizzes with dynamic templated questions")
+    
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    get_metrics().session_seen(st.session_state.session_id)
+    
+    # Show status if package not available
+    if not SETWISE_AVAILABLE:
+        st.error(f"Setwise package not available: {IMPORT_ERROR}")
+        st.info("The quiz generator requires the setwise package to be installed.")
+        return
+    
+    # Each panel is a fragment: interacting with one reruns only that panel.
+    # Submitting a job reruns the whole app so the results pane picks it up.
+    settings_panel()
+    bulk_panel()
+    
+    # Main split pane layout
+    col_left, col_right = st.columns([1, 1])
+    
+    # LEFT PANE: Questions Editor
+    with col_left:
+        editor_panel()
+    
+    # RIGHT PANE: PDF Previews
+    with col_right:
+        results_pane()
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,73 @@
+import pytest
+
+from setwise_web import bulk
+from setwise_web.bulk import build_bulk_entries, run_bulk_generation
+from setwise_web.scheduler import JobCancelled
+from setwise_web.storage import WorkspaceManager
+
+DEFAULTS = {'template': "default", 'num_sets': 2, 'seed': None, 'title': "Quiz", 'subject': "", 'exam_info': ""}
+FILES = {'algebra.py': "mcq = []\n", 'week2/calculus.py': "mcq = []  # calculus\n"}
+
+
+def test_without_manifest_every_file_is_one_quiz():
+    entries = build_bulk_entries(FILES, None, DEFAULTS)
+    assert [e['name'] for e in entries] == ["algebra", "calculus"]
+    assert all(e['template'] == "default" and e['num_sets'] == 2 for e in entries)
+    assert all(1 <= e['seed'] <= 10000 for e in entries)
+
+
+def test_manifest_settings_override_defaults():
+    manifest = {'defaults': {'template': "compact"},
+                'quizzes': [{'file': "calculus.py", 'num_sets': 3, 'seed': 5, 'title': "Midterm"}]}
+    [entry] = build_bulk_entries(FILES, manifest, DEFAULTS)
+    assert entry['file'] == "week2/calculus.py"
+    assert (entry['template'], entry['num_sets'], entry['seed']) == ("compact", 3, 5)
+    assert entry['header_config'] == {'title': "Midterm", 'subject': "", 'exam_info': ""}
+
+
+def test_sections_get_their_own_folder_and_seed():
+    manifest = [{'file': "algebra.py", 'seed': 10000, 'sections': ["A", "B"]}]
+    entries = build_bulk_entries(FILES, manifest, DEFAULTS)
+    assert [(e['name'], e['seed']) for e in entries] == [("algebra/A", 10000), ("algebra/B", 1)]
+
+
+def test_content_hash_seed_is_stable():
+    first = build_bulk_entries(FILES, None, DEFAULTS)
+    assert [e['seed'] for e in first] == [e['seed'] for e in build_bulk_entries(FILES, None, DEFAULTS)]
+
+
+@pytest.mark.parametrize("manifest, message", [
+    ({'quizzes': []}, "no question files"),
+    ([{'name': "x"}], "has no 'file'"),
+    ([{'file': "missing.py"}], "not among the uploaded"),
+    ([{'file': "algebra.py", 'template': "fancy"}], "unknown template"),
+    ([{'file': "algebra.py", 'num_sets': 0}], "num_sets must be between"),
+    ([{'file': "algebra.py", 'seed': "abc"}], "whole numbers"),
+    ([{'file': "algebra.py"}, {'file': "algebra.py"}], "same folder"),
+    ("nonsense", "manifest must be"),
+])
+def test_invalid_manifests_are_rejected(manifest, message):
+    with pytest.raises(ValueError, match=message):
+        build_bulk_entries(FILES, manifest, DEFAULTS)
+
+
+def test_cancelling_stops_running_entries(tmp_path, monkeypatch):
+    reached = []
+
+    def generate_quiz_pdfs(*args, progress, **kwargs):
+        for i in range(1, 100):
+            reached.append(i)
+            progress(f"set {i} compiled", 0.5)
+        return [], None
+
+    def report(stage, fraction):
+        # The job is cancelled while the entries are compiling their third set
+        if stage.endswith("set 3 compiled"):
+            raise JobCancelled("job")
+
+    monkeypatch.setattr(bulk, "generate_quiz_pdfs", generate_quiz_pdfs)
+    entries = build_bulk_entries(FILES, None, DEFAULTS)
+    workspaces = WorkspaceManager(tmp_path / "work", tmp_path / "disk", ttl=60, min_free_bytes=0)
+    with pytest.raises(JobCancelled):
+        run_bulk_generation(entries, tmp_path / "out.zip", workspaces, progress=report)
+    assert max(reached) == 3
@@ -0,0 +1,171 @@
+import os
+
+from setwise_web import latex
+from setwise_web.latex import (
+    FigureCache, FormatCache, compile_tex, parse_latex_log, question_starts)
+
+TEX = [
+    r"\documentclass{article}",
+    r"\begin{document}",
+    r"\item What is the value of $x^2$?",
+    r"\begin{verbatim}",
+    r"What is the area of {{ shape }}?",
+    r"\end{verbatim}",
+    r"\item What is the area of a circle?",
+    r"\foo",
+    r"\end{document}",
+]
+MODEL = {
+    'mcq': [{'question': r"What is the area of {{ shape }}?"}, {'question': r"What is the value of $x^2$?"}],
+    'subjective': [],
+}
+
+LOG = """This is pdfTeX, Version 3.141592653
+(./quiz_set_1.tex
+! Undefined control sequence.
+l.8 \\foo
+         
+Here is how much of TeX's memory you used:
+! Emergency stop.
+<*> quiz_set_1.tex
+!  ==> Fatal error occurred, no output PDF file produced!
+"""
+
+
+def test_question_starts_skip_verbatim():
+    assert question_starts(TEX, MODEL) == {3: ('mcq', 2), 7: ('mcq', 1)}
+
+
+def test_error_record_with_line_and_source():
+    [record] = parse_latex_log(LOG, question_starts(TEX, MODEL))
+    assert record == {'message': "Undefined control sequence.", 'tex_line': 8,
+                      'context': "\\foo", 'source': ('mcq', 1)}
+
+
+def test_lines_before_any_question_belong_to_the_template():
+    log_text = "! Missing $ inserted.\nl.1 \\documentclass{article}\n"
+    [record] = parse_latex_log(log_text, question_starts(TEX, MODEL))
+    assert record['tex_line'] == 1
+    assert record['source'] is None
+
+
+def test_emergency_stop_alone_is_reported():
+    [record] = parse_latex_log("! Emergency stop.\n<*> quiz_set_1.tex\n")
+    assert record['message'] == "Emergency stop."
+    assert record['tex_line'] is None
+
+
+def test_error_count_is_capped():
+    log_text = "".join(f"! Error {n}.\nl.{n} x\n" for n in range(1, 20))
+    assert len(parse_latex_log(log_text)) == 5
+
+
+DOCUMENT = "\\documentclass{article}\n\\usepackage{amsmath} % maths\n\\newcommand{\\x}{1}\n\\begin{document}\nx\n\\end{document}\n"
+
+
+def fake_pdflatex(tmp_path, script):
+    """A pdflatex stand-in: ``script`` runs with ``args`` and ``job`` (the -jobname) defined"""
+    path = tmp_path / "pdflatex"
+    path.write_text("#!/usr/bin/env python3\nimport sys\nargs = sys.argv[1:]\n"
+                    "job = next(a.split('=', 1)[1] for a in args if a.startswith('-jobname='))\n"
+                    "open('calls.txt', 'a').write(' '.join(args) + '\\n')\n" + script)
+    path.chmod(0o755)
+    return str(path)
+
+
+class StubFormats:
+    def __init__(self, root):
+        self.root = root
+        self.discarded = []
+
+    def prepare(self, tex_path, env):
+        warm = tex_path.with_name(f".{tex_path.stem}.warm.tex")
+        warm.write_text(tex_path.read_text())
+        return "setwise-test", warm
+
+    def discard(self, name):
+        self.discarded.append(name)
+
+
+def test_warm_copy_keeps_line_numbers(tmp_path, monkeypatch):
+    formats = FormatCache(tmp_path / "formats")
+    formats.available = True
+    monkeypatch.setattr(formats, "_ensure", lambda name, dump, env: True)
+    tex_path = tmp_path / "quiz_set_1.tex"
+    tex_path.write_text(DOCUMENT)
+    _, warm_tex = formats.prepare(tex_path, {})
+    warm = warm_tex.read_text().splitlines()
+    assert len(warm) == len(DOCUMENT.splitlines())
+    assert warm[2] == "\\endofdump \\newcommand{\\x}{1}"
+
+
+def test_document_error_keeps_the_format(tmp_path, monkeypatch):
+    monkeypatch.setattr(latex, "PDFLATEX", fake_pdflatex(tmp_path, (
+        "open(job + '.log', 'w').write('! Undefined control sequence.\\nl.5 x\\n')\nsys.exit(1)\n")))
+    tex_path = tmp_path / "quiz_set_1.tex"
+    tex_path.write_text(DOCUMENT)
+    formats = StubFormats(tmp_path)
+    assert not compile_tex(tex_path, formats=formats)
+    assert formats.discarded == []
+    assert len((tmp_path / "calls.txt").read_text().splitlines()) == 1
+
+
+def test_format_that_fails_to_load_is_discarded(tmp_path, monkeypatch):
+    monkeypatch.setattr(latex, "PDFLATEX", fake_pdflatex(tmp_path, (
+        "if any(a.startswith('-fmt=') for a in args):\n"
+        "    print(\"I can't find the format file `setwise-test.fmt'!\")\n"
+        "    sys.exit(1)\n"
+        "open(job + '.log', 'w').write('ok\\n')\n"
+        "open(job + '.pdf', 'w').write('%PDF')\n")))
+    tex_path = tmp_path / "quiz_set_1.tex"
+    tex_path.write_text(DOCUMENT)
+    formats = StubFormats(tmp_path)
+    assert compile_tex(tex_path, formats=formats)
+    assert formats.discarded == ["setwise-test"]
+
+
+FIGURE_DOCUMENT = ("\\documentclass{article}\n\\usepackage{tikz}\n\\begin{document}\n"
+                   "Draw it:\n\\begin{tikzpicture}\n\\draw (0,0) -- (1,1);\n\\end{tikzpicture}\n"
+                   "\\undefined\n\\end{document}\n")
+
+
+class StubFigures:
+    def externalize(self, tex_path, env):
+        lines = tex_path.read_text().splitlines(keepends=True)
+        lines[4:7] = ["\\includegraphics{fig-test.pdf}%\n", "%\n", "%\n"]
+        external = tex_path.with_name(f".{tex_path.stem}.figures.tex")
+        external.write_text("".join(lines))
+        return external
+
+
+def failing_on_line(tmp_path, line):
+    return fake_pdflatex(tmp_path, (
+        f"open(job + '.log', 'w').write('! Undefined control sequence.\\nl.{line} x\\n')\nsys.exit(1)\n"))
+
+
+def test_document_error_is_not_retried_without_figures(tmp_path, monkeypatch):
+    monkeypatch.setattr(latex, "PDFLATEX", failing_on_line(tmp_path, 8))
+    tex_path = tmp_path / "quiz_set_1.tex"
+    tex_path.write_text(FIGURE_DOCUMENT)
+    assert not compile_tex(tex_path, figures=StubFigures())
+    assert len((tmp_path / "calls.txt").read_text().splitlines()) == 1
+    assert not (tmp_path / ".quiz_set_1.figures.tex").exists()
+
+
+def test_figure_error_retries_inline_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(latex, "PDFLATEX", failing_on_line(tmp_path, 5))
+    tex_path = tmp_path / "quiz_set_1.tex"
+    tex_path.write_text(FIGURE_DOCUMENT)
+    assert not compile_tex(tex_path, figures=StubFigures())
+    calls = (tmp_path / "calls.txt").read_text().splitlines()
+    assert [call.split()[-1] for call in calls] == [".quiz_set_1.figures.tex", "quiz_set_1.tex"]
+
+
+def test_figure_cache_evicts_least_recently_used(tmp_path):
+    figures = FigureCache(tmp_path, max_bytes=10)
+    for age, name in enumerate(["fig-new.pdf", "fig-old.pdf"]):
+        path = tmp_path / name
+        path.write_bytes(b"x" * 8)
+        os.utime(path, (1000 - age, 1000 - age))
+    figures.evict()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["fig-new.pdf"]
@@ -0,0 +1,97 @@
+from setwise_web.questions import lint_latex_fragment, lint_question_model, validate_question_model
+
+
+def messages(text, severity=None):
+    return [message for level, message in lint_latex_fragment(text) if severity in (None, level)]
+
+
+def test_clean_fragment_has_no_problems():
+    assert lint_latex_fragment(r"Solve $x^2 + y_1 = 0$ for \textbf{x} \& y") == []
+
+
+def test_unbalanced_environment():
+    assert messages(r"\begin{itemize} \item a") == [r"\begin{itemize} is never closed"]
+    assert messages(r"\begin{center} x \end{tabular}") == [r"\begin{center} is closed by \end{tabular}"]
+
+
+def test_unbalanced_braces_and_math():
+    assert "'}' without a matching '{'" in messages("a } b")
+    assert "1 '{' never closed" in messages(r"\textbf{a")
+    assert "math mode opened with $ is never closed" in messages("cost $x + 1")
+
+
+def test_specials_outside_math():
+    assert messages("x_1 is small", 'error') == [r"_ outside math mode - write \_ or wrap it in $...$"]
+    assert messages("A & B", 'error') == [r"& outside a table or matrix - write \&"]
+    assert messages("50% off") == [r"unescaped % comments out the rest of the line - write \%"]
+
+
+def test_alignment_and_math_environments_allow_specials():
+    assert lint_latex_fragment(r"\begin{tabular}{cc} a & b \end{tabular}") == []
+    assert lint_latex_fragment(r"\begin{equation} a_1 = b^2 \end{equation}") == []
+
+
+def test_each_problem_reported_once():
+    assert len(messages("a_b c_d e_f")) == 1
+
+
+def test_label_reference_and_file_arguments_are_not_checked():
+    assert lint_latex_fragment(r"\includegraphics[width=3cm]{my_fig.png}") == []
+    assert lint_latex_fragment(r"See \eqref{eq_main} and \ref{q_1}.\label{q_1}") == []
+    assert lint_latex_fragment(r"\href{https://example.com/a_b?x=1&y=2}{the notes}") == []
+    assert messages(r"\ref{q_1} and x_1", 'error') == [r"_ outside math mode - write \_ or wrap it in $...$"]
+
+
+def test_verbatim_is_not_checked():
+    assert lint_latex_fragment("\\begin{verbatim}\nx_1 = {a & b % c\n\\end{verbatim}") == []
+    assert lint_latex_fragment("\\begin{lstlisting}[language=Python]\nd = {}\n\\end{lstlisting}") == []
+    assert lint_latex_fragment("\\begin{minted}{python}\nprint(a_b)\n\\end{minted}") == []
+    assert lint_latex_fragment(r"Call \verb|f_x(&y)| or \lstinline{g_1}") == []
+    assert messages("\\begin{verbatim}\nx_1") == [r"\begin{verbatim} is never closed"]
+
+
+def undefined(entry):
+    model = {'mcq': [], 'subjective': [dict(entry, marks=1)]}
+    return [d['message'] for d in validate_question_model(model) if d['severity'] == 'error']
+
+
+def test_template_variables_set_or_looped_in_the_template_are_defined():
+    assert undefined({'template': "{% set y = x * 2 %}{{ y }}", 'variables': [{'x': 1}]}) == []
+    assert undefined({'template': "{% for i in xs %}{{ i }}{% endfor %}", 'variables': [{'xs': [1]}]}) == []
+    assert undefined({'template': "{{ n if n is divisibleby 3 else n|round(1) }}",
+                      'variables': [{'n': 3}]}) == []
+
+
+def test_missing_template_variables_are_reported():
+    assert undefined({'template': "{% for i in xs %}{{ i }}{% endfor %}", 'variables': [{'x': 1}]}) == [
+        "'{{ xs }}' is not defined in variables entry 1"]
+    assert undefined({'template': "Parts", 'variables': [{'a': 1}],
+                      'parts': [{'question': "{{ b }}", 'marks': 1}]}) == [
+        "'{{ b }}' is not defined in variables entry 1"]
+    assert undefined({'template': "{{ a ", 'variables': [{'a': 1}]})[0].startswith("template syntax error")
+
+
+def lint_template(template):
+    entry = {'template': template, 'variables': [{'x': 2}], 'marks': 1}
+    return lint_question_model({'mcq': [], 'subjective': [entry]})
+
+
+def test_templates_are_linted_as_rendered():
+    assert lint_template("$x^{{ x }}$") == []
+    assert [d['message'] for d in lint_template("{{ 'a_b' if x > 1 else 'ab' }}")] == [
+        r"LaTeX: _ outside math mode - write \_ or wrap it in $...$ (variables entry 1)"]
+
+
+def test_malicious_templates_do_not_run_in_the_server(tmp_path):
+    marker = tmp_path / "pwned"
+    lint_template("{{ cycler.__init__.__globals__.os.system('touch %s') }}" % marker)
+    assert not marker.exists()
+    # Huge allocations stop inside the child; the raw template is linted instead
+    assert [d['message'] for d in lint_template("{{ 'a' * 10**10 }} x_1")] == [
+        r"LaTeX: _ outside math mode - write \_ or wrap it in $...$ (variables entry 1)"]
+
+
+def test_jinja_syntax_errors_outside_templates_are_warnings():
+    model = {'mcq': [], 'subjective': [{'question': r"Simplify ${{x}^2}^3$", 'marks': 1}]}
+    diagnostics = validate_question_model(model)
+    assert [d['severity'] for d in diagnostics if 'syntax error' in d['message']] == ['warning']
@@ -0,0 +1,46 @@
+from concurrent.futures import CancelledError
+
+import pytest
+
+from setwise_web import metrics as metrics_module
+from setwise_web.logs import _span_log, log_span
+from setwise_web.metrics import MetricsRegistry
+from setwise_web.scheduler import JobCancelled
+
+
+def test_histograms_render_cumulative_buckets():
+    metrics = MetricsRegistry()
+    metrics.describe("stage_seconds", "histogram", "Stage time", (0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        metrics.observe("stage_seconds", value, stage="compile")
+    lines = metrics.render().splitlines()
+    assert lines[:2] == ["# HELP stage_seconds Stage time", "# TYPE stage_seconds histogram"]
+    assert lines[2:] == [
+        'stage_seconds_bucket{stage="compile",le="0.1"} 1',
+        'stage_seconds_bucket{stage="compile",le="1"} 3',
+        'stage_seconds_bucket{stage="compile",le="+Inf"} 4',
+        'stage_seconds_sum{stage="compile"} 6.050000',
+        'stage_seconds_count{stage="compile"} 4',
+    ]
+
+
+def test_label_values_are_escaped():
+    metrics = MetricsRegistry()
+    metrics.describe("jobs_total", "counter", "Jobs")
+    metrics.inc("jobs_total", kind='say "hi"\\\n')
+    assert 'jobs_total{kind="say \\"hi\\"\\\\\\n"} 1' in metrics.render().splitlines()
+
+
+@pytest.mark.parametrize("error, outcome", [
+    (JobCancelled("job"), "cancelled"),
+    (CancelledError(), "cancelled"),
+    (ValueError("boom"), "error"),
+])
+def test_span_outcomes(error, outcome, monkeypatch):
+    metrics = MetricsRegistry()
+    metrics.describe("setwise_web_stage_seconds", "histogram", "Stage time", (1,))
+    monkeypatch.setattr(_span_log, "handlers", [metrics_module._SpanMetrics(metrics)])
+    with pytest.raises(type(error)):
+        with log_span("render"):
+            raise error
+    assert f'setwise_web_stage_seconds_count{{outcome="{outcome}",stage="render"}} 1' in metrics.render()
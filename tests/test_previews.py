@@ -0,0 +1,32 @@
+import os
+
+from setwise_web.previews import ThumbnailCache
+
+
+def test_eviction_forgets_page_counts_of_evicted_pdfs(tmp_path):
+    thumbnails = ThumbnailCache(tmp_path, max_bytes=10)
+    old, new = "a" * 64, "b" * 64
+    for age, digest in enumerate([new, old]):
+        image = tmp_path / f"{digest[:32]}-p1-w900.png"
+        image.write_bytes(b"x" * 8)
+        os.utime(image, (1000 - age, 1000 - age))
+    thumbnails._page_counts = {old: 2, new: 3}
+    thumbnails.evict()
+    assert thumbnails._page_counts == {new: 3}
+
+
+def test_render_locks_are_dropped_after_rendering(tmp_path, monkeypatch):
+    pdf = tmp_path / "quiz_set_1.pdf"
+    pdf.write_bytes(b"%PDF")
+    thumbnails = ThumbnailCache(tmp_path / "thumbnails", max_bytes=10 ** 6)
+    thumbnails.available = True
+    
+    def render(pdf_path, page, stem):
+        target = thumbnails.root / f"{stem}.png"
+        target.write_bytes(b"png")
+        return target
+    
+    monkeypatch.setattr(thumbnails, "_render", render)
+    assert thumbnails.page(pdf, 1).exists()
+    assert thumbnails.page(pdf, 2).exists()
+    assert thumbnails._render_locks == {}
@@ -0,0 +1,42 @@
+import pytest
+
+from setwise_web import questions
+from setwise_web.questions import QuestionParseError, parse_questions_sandboxed
+
+
+def parse_error(text):
+    with pytest.raises(QuestionParseError) as info:
+        parse_questions_sandboxed(text)
+    return info.value
+
+
+def test_questions_come_back_as_plain_data():
+    model = parse_questions_sandboxed("mcq = [{'question': 'Q', 'options': ('a', 'b'), 'marks': 2.0}]\n"
+                                      "subjective = []\nhelper = 1\n")
+    assert model == {'mcq': [{'question': 'Q', 'options': ['a', 'b'], 'marks': 2}], 'subjective': []}
+
+
+def test_syntax_error():
+    error = parse_error("mcq = [")
+    assert error.kind == "syntax"
+
+
+def test_runaway_loop_is_killed_by_the_cpu_limit(monkeypatch):
+    monkeypatch.setattr(questions, "PARSE_CPU_SECONDS", 1)
+    monkeypatch.setattr(questions, "PARSE_TIMEOUT", 30)
+    error = parse_error("while True: pass")
+    assert error.kind == "limit"
+    assert "exit code" in str(error)
+
+
+def test_huge_allocation_hits_the_memory_limit():
+    error = parse_error("blob = bytearray(4 * 1024 ** 3)")
+    assert error.kind == "limit"
+    assert "memory" in str(error)
+
+
+def test_sleeping_file_hits_the_wall_clock_timeout(monkeypatch):
+    monkeypatch.setattr(questions, "PARSE_TIMEOUT", 1)
+    error = parse_error("import time\ntime.sleep(100)")
+    assert error.kind == "limit"
+    assert "did not finish within 1s" in str(error)
@@ -0,0 +1,74 @@
+import threading
+from concurrent.futures import CancelledError
+
+import pytest
+
+from setwise_web.logs import request_context
+from setwise_web.scheduler import CompileScheduler
+
+
+@pytest.fixture
+def blocked_scheduler():
+    """A one-slot scheduler whose slot is held until ``release`` is set"""
+    scheduler = CompileScheduler(1)
+    release = threading.Event()
+    started = threading.Event()
+    
+    def hold():
+        started.set()
+        release.wait(5)
+    
+    blocker = scheduler.submit("other", hold)
+    assert started.wait(5)
+    yield scheduler, release
+    release.set()
+    blocker.result(5)
+
+
+def test_result_and_exception_are_delivered():
+    scheduler = CompileScheduler(2)
+    assert scheduler.submit("a", pow, 2, 10).result(5) == 1024
+    with pytest.raises(ZeroDivisionError):
+        scheduler.submit("a", lambda: 1 / 0).result(5)
+
+
+def test_sessions_take_turns(blocked_scheduler):
+    scheduler, release = blocked_scheduler
+    order = []
+    futures = [scheduler.submit(session, order.append, name)
+               for session, name in (("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1"))]
+    assert scheduler.position("a") == 1
+    assert scheduler.position("b") == 2
+    assert scheduler.position("c") is None
+    release.set()
+    for future in futures:
+        future.result(5)
+    assert order == ["a1", "b1", "a2", "a3"]
+
+
+def test_cancelled_tasks_are_skipped(blocked_scheduler):
+    scheduler, release = blocked_scheduler
+    ran = []
+    skipped = scheduler.submit("a", ran.append, "skipped")
+    kept = scheduler.submit("a", ran.append, "kept")
+    assert skipped.cancel()
+    release.set()
+    kept.result(5)
+    assert ran == ["kept"]
+    assert scheduler.stats()['queue_depth'] == 0
+
+
+def test_cancel_withdraws_a_requests_queued_compiles(blocked_scheduler):
+    scheduler, release = blocked_scheduler
+    ran = []
+    with request_context("job-1"):
+        dropped = [scheduler.submit("a", ran.append, "dropped") for _ in range(2)]
+    with request_context("job-2"):
+        kept = scheduler.submit("a", ran.append, "kept")
+    assert scheduler.cancel("job-1") == 2
+    assert all(future.cancelled() for future in dropped)
+    with pytest.raises(CancelledError):
+        dropped[0].result(0)
+    release.set()
+    kept.result(5)
+    assert ran == ["kept"]
@@ -0,0 +1,109 @@
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from setwise_web import storage
+from setwise_web.storage import ArtifactStore, QuizCache, WorkspaceManager, evict_lru, quiz_cache_key
+
+
+def make_sets(directory, count=2, pdf_bytes=100):
+    quiz_sets = []
+    for i in range(1, count + 1):
+        paths = {
+            'pdf_path': directory / f"quiz_set_{i}.pdf",
+            'tex_path': directory / f"quiz_set_{i}.tex",
+            'answer_path': directory / f"answer_key_{i}.txt",
+        }
+        paths['pdf_path'].write_bytes(b"%" * pdf_bytes)
+        paths['tex_path'].write_text(f"set {i}", encoding='utf-8')
+        paths['answer_path'].write_text(f"answers {i}", encoding='utf-8')
+        quiz_sets.append({'name': f"Quiz Set {i}", **{k: str(v) for k, v in paths.items()}})
+    return quiz_sets
+
+
+def test_miss_then_hit(tmp_path):
+    cache = QuizCache(tmp_path / "cache", 10 * 1024 * 1024)
+    source, target = tmp_path / "source", tmp_path / "target"
+    source.mkdir()
+    target.mkdir()
+    assert cache.get("key", str(target)) is None
+    cache.put("key", make_sets(source))
+    
+    quiz_sets = cache.get("key", str(target))
+    assert [s['name'] for s in quiz_sets] == ["Quiz Set 1", "Quiz Set 2"]
+    assert all(os.path.dirname(s['pdf_path']) == str(target) for s in quiz_sets)
+    assert open(quiz_sets[1]['answer_path']).read() == "answers 2"
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'evictions': 0, 'hit_rate': 0.5}
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = QuizCache(tmp_path / "cache", 2500)
+    target = tmp_path / "target"
+    target.mkdir()
+    for key in ("old", "recent", "new"):
+        source = tmp_path / key
+        source.mkdir()
+        if key == "new":
+            # Directory mtimes are the LRU clock
+            os.utime(cache.root / "old", (0, 0))
+        cache.put(key, make_sets(source, pdf_bytes=500))
+    
+    assert cache.get("old", str(target)) is None
+    assert cache.get("recent", str(target)) is not None
+    assert cache.get("new", str(target)) is not None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_cache_key_ignores_trailing_whitespace_only():
+    key = quiz_cache_key("mcq = []\n", "default", 2, {}, 1)
+    assert key == quiz_cache_key("\nmcq = []   \n\n", "default", 2, {}, 1)
+    assert key != quiz_cache_key("mcq = []\n", "default", 2, {}, 2)
+    assert key != quiz_cache_key("mcq = []\n", "compact", 2, {}, 1)
+
+
+def test_artifact_stats_come_from_the_last_sweep(tmp_path, monkeypatch):
+    source = tmp_path / "quiz_set_1.pdf"
+    source.write_bytes(b"%" * 100)
+    store = ArtifactStore(tmp_path / "artifacts", ttl=3600, max_bytes=10 ** 6)
+    handle = store.put({"quiz_set_1.pdf": str(source)})
+    assert store.stats()['handles'] == 1
+    assert store.stats()['bytes'] == 100
+    # Removed behind the store's back: not noticed until the numbers are stale
+    shutil.rmtree(tmp_path / "artifacts" / handle)
+    assert store.stats()['handles'] == 1
+    monkeypatch.setattr(storage, "STORAGE_STATS_TTL", -1)
+    assert store.stats()['handles'] == 0
+
+
+def test_evict_lru_removes_oldest_until_it_fits():
+    removed = []
+    entries = [(3, 10, "c"), (1, 10, "a"), (2, 10, "b")]
+    assert evict_lru(entries, 15, removed.append) == [(3, 10, "c")]
+    assert removed == ["a", "b"]
+    assert evict_lru(entries, 30, removed.append) == sorted(entries)
+
+
+def test_workspace_sweep_removes_only_orphans(tmp_path):
+    workspaces = WorkspaceManager(tmp_path / "tmpfs", tmp_path / "disk", ttl=60, min_free_bytes=0)
+    # A child that has exited and been reaped stands in for a crashed server
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    old = time.time() - 3600
+
+    def workspace(pid, root="tmpfs"):
+        path = tmp_path / root / f"job-{pid}-abc123"
+        path.mkdir()
+        os.utime(path, (old, old))
+        return path
+
+    dead = workspace(exited.pid, root="disk")
+    live = workspace(os.getppid())
+    expired = workspace(os.getpid())
+    active = workspaces.create("job")
+    os.utime(active, (old, old))
+
+    assert workspaces.sweep() == 2
+    assert not dead.exists() and not expired.exists()
+    assert live.exists() and os.path.isdir(active)
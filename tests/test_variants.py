@@ -0,0 +1,48 @@
+import csv
+import io
+
+import pytest
+
+from setwise_web import variants
+from setwise_web.variants import plan_variants, roster_csv
+
+
+@pytest.fixture(params=[True, False], ids=["numpy", "pure-python"])
+def numpy_available(request, monkeypatch):
+    if request.param and not variants.NUMPY_AVAILABLE:
+        pytest.skip("NumPy not installed")
+    monkeypatch.setattr(variants, "NUMPY_AVAILABLE", request.param)
+    return request.param
+
+
+def test_every_student_gets_a_distinct_valid_variant_index(numpy_available):
+    unique, assignment = plan_variants([3, 2, 2], 50, seed=7)
+    assert len(assignment) == 50
+    assert len(unique) == len(set(unique)) <= 12
+    assert all(0 <= i < len(unique) for i in assignment)
+    assert all(0 <= a < 3 and 0 <= b < 2 and 0 <= c < 2 for a, b, c in unique)
+
+
+def test_same_seed_same_plan(numpy_available):
+    assert plan_variants([4, 3], 20, seed=11) == plan_variants([4, 3], 20, seed=11)
+
+
+def test_max_variants_caps_distinct_variants(numpy_available):
+    unique, assignment = plan_variants([10, 10, 10], 100, seed=3, max_variants=4)
+    assert len(unique) <= 4
+    assert len(assignment) == 100
+    assert set(assignment) <= set(range(len(unique)))
+
+
+def test_single_choice_columns_collapse_to_one_variant(numpy_available):
+    unique, assignment = plan_variants([1, 1], 5, seed=1)
+    assert unique == [(0, 0)]
+    assert assignment == [0] * 5
+
+
+def test_roster_csv_quotes_student_ids():
+    row = {'variant': "v1/set_1", 'pdf': "v1/quiz_set_1.pdf", 'answer_key': "v1/answer_key_1.txt", 'status': "ok"}
+    text = roster_csv([dict(row, student='Doe, "Jo"'), dict(row, student="s2")])
+    assert list(csv.reader(io.StringIO(text)))[1:] == [
+        ['Doe, "Jo"', "v1/set_1", "v1/quiz_set_1.pdf", "v1/answer_key_1.txt", "ok"],
+        ["s2", "v1/set_1", "v1/quiz_set_1.pdf", "v1/answer_key_1.txt", "ok"]]